@@ -0,0 +1,76 @@
+# back_end/benchmarks/bench_chunk_store.py
+"""
+Query payload size and latency with chunk text in Pinecone metadata (before)
+vs small metadata + one bulk fetch from the chunk store (after).
+
+Pinecone's wire time scales with response size, so the script reports the
+serialized match payload for both layouts together with the JSON decode
+time and the chunk-store fetch it adds:
+
+    python -m benchmarks.bench_chunk_store --top-k 5 --chunk-chars 2400
+"""
+import argparse
+import json
+import os
+import random
+import string
+import tempfile
+import time
+
+from services.chunk_store import SQLiteChunkStore
+
+
+def _text(n: int) -> str:
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9))) for _ in range(n // 6)]
+    return " ".join(words)[:n]
+
+
+def _payload(ids, texts, with_text: bool) -> bytes:
+    matches = []
+    for cid in ids:
+        meta = {"file_name": "quarterly-report.pdf", "description": "Q3 numbers"}
+        if with_text:
+            meta["text"] = texts[cid]
+        matches.append({"id": cid, "score": random.random(), "metadata": meta})
+    return json.dumps({"matches": matches, "namespace": "tenant"}).encode("utf-8")
+
+
+def _timeit(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--chunk-chars", type=int, default=2400, help="~600 tokens")
+    ap.add_argument("--corpus", type=int, default=20000, help="chunks in the store")
+    ap.add_argument("--repeat", type=int, default=500)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        store = SQLiteChunkStore(os.path.join(d, "chunks.sqlite3"))
+        texts = {f"chunk-{i}": _text(args.chunk_chars) for i in range(args.corpus)}
+        store.put_many("tenant", texts)
+
+        ids = random.sample(list(texts), args.top_k)
+        before = _payload(ids, texts, with_text=True)
+        after = _payload(ids, texts, with_text=False)
+
+        t_before = _timeit(lambda: json.loads(before), args.repeat)
+        t_after_decode = _timeit(lambda: json.loads(after), args.repeat)
+        # id batches are drawn before timing, so only the fetches are measured
+        all_ids = list(texts)
+        batches = iter([random.sample(all_ids, args.top_k) for _ in range(args.repeat)])
+        t_fetch = _timeit(lambda: store.get_many("tenant", next(batches)), args.repeat)
+
+    print(f"top_k={args.top_k} chunk_chars={args.chunk_chars} store_size={args.corpus}")
+    print(f"{'layout':<22}{'payload bytes':>15}{'decode ms':>12}{'fetch ms':>10}")
+    print(f"{'text in metadata':<22}{len(before):>15}{t_before:>12.3f}{0:>10.3f}")
+    print(f"{'chunk store':<22}{len(after):>15}{t_after_decode:>12.3f}{t_fetch:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
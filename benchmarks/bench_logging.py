@@ -0,0 +1,93 @@
+# back_end/benchmarks/bench_logging.py
+"""
+Request-thread cost of logging the retrieved context, per call:
+
+- print(): what agent_answer did before
+- a synchronous StreamHandler (logging.basicConfig)
+- log_event() through the queue pipeline, unsampled and at 1%
+
+The sink can be made slow (--sink-ms per write) to stand in for a blocked
+stdout pipe or log shipper; only the synchronous variants pay for it.
+
+    python -m benchmarks.bench_logging --context-chars 12000 --calls 2000 --sink-ms 0.2
+"""
+import argparse
+import io
+import logging
+import random
+import string
+import time
+
+from services import log_pipeline
+
+
+class _Sink(io.TextIOBase):
+    def __init__(self, delay_s: float):
+        self.delay_s = delay_s
+        self.bytes = 0
+
+    def write(self, s: str) -> int:
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        self.bytes += len(s)
+        return len(s)
+
+
+def _text(n: int) -> str:
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9))) for _ in range(n // 6)]
+    return " ".join(words)[:n]
+
+
+def _measure(fn, calls: int):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    us = lambda p: samples[min(len(samples) - 1, int(p * len(samples)))] * 1e6
+    return us(0.5), us(0.99), sum(samples) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--context-chars", type=int, default=12000, help="top-5 chunks of ~600 tokens")
+    ap.add_argument("--calls", type=int, default=2000)
+    ap.add_argument("--sink-ms", type=float, default=0.0, help="simulated latency per write")
+    args = ap.parse_args()
+
+    context = _text(args.context_chars)
+    delay = args.sink_ms / 1000
+    rows = []
+
+    sink = _Sink(delay)
+    rows.append(("print()", *_measure(lambda: print("context_used:", context, file=sink), args.calls), sink.bytes))
+
+    sink = _Sink(delay)
+    sync = logging.getLogger("bench.sync")
+    sync.propagate = False
+    sync.setLevel(logging.INFO)
+    sync.addHandler(logging.StreamHandler(sink))
+    rows.append(("sync StreamHandler", *_measure(lambda: sync.info("context_used: %s", context), args.calls), sink.bytes))
+
+    sink = _Sink(delay)
+    log_pipeline.setup_logging("INFO", stream=sink)
+    log = logging.getLogger("bench.queue")
+    for name, rate in (("log_event", 1.0), ("log_event @1%", 0.01)):
+        before = sink.bytes
+        stats = _measure(lambda: log_pipeline.log_event(log, "context_used", sample=rate, matches=5, context=context),
+                         args.calls)
+        log_pipeline.shutdown_logging()  # flush, so sink bytes are final
+        rows.append((name, *stats, sink.bytes - before))
+        log_pipeline.setup_logging("INFO", stream=sink)
+    log_pipeline.shutdown_logging()
+
+    print(f"context_chars={args.context_chars} calls={args.calls} sink_ms={args.sink_ms}")
+    print(f"{'variant':<22}{'p50 us':>10}{'p99 us':>10}{'total ms':>11}{'bytes out':>12}")
+    for name, p50, p99, total, out in rows:
+        print(f"{name:<22}{p50:>10.1f}{p99:>10.1f}{total:>11.1f}{out:>12}")
+    print(f"queue pipeline: {log_pipeline.log_stats()}")
+
+
+if __name__ == "__main__":
+    main()
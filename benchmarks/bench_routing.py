@@ -0,0 +1,116 @@
+# back_end/benchmarks/bench_routing.py
+"""
+Flat vs two-stage (document-routed) retrieval on one large namespace.
+
+Builds a synthetic namespace with the real chunker, embeds it with the
+deterministic hashing embedder from eval_retrieval, and compares:
+
+- flat: exact top-k over every chunk in the namespace
+- routed: exact top-N over per-document summary vectors (normalized mean
+  of the chunk vectors, as services/doc_routing.py stores them), then
+  top-k over the chunks of those N documents only
+
+    python -m benchmarks.bench_routing --docs 2000 --top-docs 4,8,16 --own-words 0,0.15
+
+Documents share six topic vocabularies plus boilerplate, as in
+eval_retrieval; --own-words is the share of words drawn from a
+vocabulary of the document's own (names, part numbers, parties). With
+0 documents on one topic are indistinguishable and routing can only lose
+recall; real namespaces sit somewhere above it.
+
+Reported per mode and k: recall@k, MRR@k, how often the question's source
+document was among the routed documents, chunks scored per query and
+search latency. Latency is in-process only; the Pinecone round trips
+(one per stage when routed) are not modelled.
+"""
+import argparse
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.eval_retrieval import HashingEmbedder, FlatIndex, _ints, _norm, build, build_questions, synthetic_corpus
+
+
+def centroids(chunks, vectors: np.ndarray):
+    """(doc names, summary vectors, row indices of each document's chunks)."""
+    rows: Dict[str, List[int]] = {}
+    for i, (name, _) in enumerate(chunks):
+        rows.setdefault(name, []).append(i)
+    names = list(rows)
+    summary = np.stack([vectors[rows[n]].sum(axis=0) for n in names])
+    summary /= np.maximum(np.linalg.norm(summary, axis=1, keepdims=True), 1e-12)
+    return names, summary, [np.array(rows[n]) for n in names]
+
+
+def _pct(xs: List[float], p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(p * len(xs)))] * 1000 if xs else 0.0
+
+
+def run(chunks, vectors: np.ndarray, qvecs: np.ndarray, questions: List[dict], ks: List[int], top_docs: int = 0):
+    """Metrics for flat search (top_docs=0) or routed search over top_docs documents."""
+    normed = [_norm(text) for _, text in chunks]
+    flat = FlatIndex(vectors)
+    if top_docs:
+        names, summary, doc_rows = centroids(chunks, vectors)
+        doc_index = FlatIndex(summary)
+    max_k = max(ks)
+    hits = {k: 0 for k in ks}
+    rr = {k: 0.0 for k in ks}
+    doc_hits = scored = 0
+    latencies = []
+    for q, qvec in zip(questions, qvecs):
+        start = time.perf_counter()
+        if top_docs and top_docs < len(names):
+            routed = doc_index.search(qvec, top_docs)
+            rows = np.concatenate([doc_rows[d] for d in routed])
+            ranked = rows[FlatIndex(vectors[rows]).search(qvec, max_k)].tolist()
+            scored += len(summary) + len(rows)
+            doc_hits += q.get("doc") in {names[d] for d in routed}
+        else:
+            ranked = flat.search(qvec, max_k)
+            scored += len(vectors)
+            doc_hits += 1
+        latencies.append(time.perf_counter() - start)
+        first = next((rank for rank, i in enumerate(ranked, start=1) if q["answer"] in normed[i]), None)
+        for k in ks:
+            if first is not None and first <= k:
+                hits[k] += 1
+                rr[k] += 1.0 / first
+    n = max(1, len(questions))
+    common = {"doc_recall": doc_hits / n, "scored": scored / n,
+              "query_ms_p50": _pct(latencies, 0.5), "query_ms_p95": _pct(latencies, 0.95)}
+    return {k: {"recall": hits[k] / n, "mrr": rr[k] / n, **common} for k in ks}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=2000, help="documents in the namespace")
+    ap.add_argument("--questions", type=int, default=300)
+    ap.add_argument("--chunk-tokens", type=int, default=600)
+    ap.add_argument("--overlap", type=int, default=120)
+    ap.add_argument("--dims", type=int, default=512)
+    ap.add_argument("--top-k", default="1,5,10")
+    ap.add_argument("--top-docs", default="4,8,16", help="ROUTE_TOP_DOCS values to compare")
+    ap.add_argument("--own-words", default="0,0.15", help="share of document-specific words")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    embedder = HashingEmbedder(args.dims)
+    ks = _ints(args.top_k)
+    print(f"{'own':>5}{'mode':>10}{'k':>4}{'recall':>8}{'mrr':>7}{'doc_rec':>9}{'scored':>9}{'q_p50ms':>9}{'q_p95ms':>9}")
+    for own_words in [float(x) for x in args.own_words.split(",") if x]:
+        docs = synthetic_corpus(args.docs, args.seed, own_words)
+        questions = build_questions(docs, args.questions, args.seed)
+        chunks, index, _ = build(docs, args.chunk_tokens, args.overlap, "off", embedder, "flat")
+        qvecs = embedder.embed([q["question"] for q in questions])
+        for top_docs in [0] + _ints(args.top_docs):
+            mode = f"routed{top_docs}" if top_docs else "flat"
+            for k, r in run(chunks, index.vectors, qvecs, questions, ks, top_docs).items():
+                print(f"{own_words:>5.2f}{mode:>10}{k:>4}{r['recall']:>8.3f}{r['mrr']:>7.3f}{r['doc_recall']:>9.3f}"
+                      f"{r['scored']:>9.0f}{r['query_ms_p50']:>9.3f}{r['query_ms_p95']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
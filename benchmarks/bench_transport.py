@@ -0,0 +1,122 @@
+# back_end/benchmarks/bench_transport.py
+"""
+Connection setup count under sustained load for three client layouts:
+
+- per-call: a new client for every request, so no connection is ever
+  reused (the worst case, e.g. `async with httpx.AsyncClient()` per call)
+- per-site: one pooled client per call site; calls rotate across sites,
+  which is what several module-level OpenAI()/create_client() instances
+  amounted to before services/http_transport.py
+- shared: the process-wide pool from services/http_transport.py
+
+Runs against a local keep-alive HTTP server so it needs no credentials:
+
+    python -m benchmarks.bench_transport --requests 2000 --threads 16
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from services.http_transport import http_client, pool_stats
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        body = b'{"ok":true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _tracer():
+    opened = {"n": 0}
+    lock = threading.Lock()
+
+    def trace(name, info):
+        if name == "connection.connect_tcp.complete":
+            with lock:
+                opened["n"] += 1
+
+    return opened, trace
+
+
+def run_per_call(url: str, n: int, threads: int):
+    opened, trace = _tracer()
+
+    def one(_):
+        with httpx.Client() as c:
+            c.get(url, extensions={"trace": trace})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(one, range(n)))
+    return time.perf_counter() - start, opened["n"]
+
+
+def run_per_site(url: str, n: int, threads: int, call_sites: int):
+    opened, trace = _tracer()
+
+    clients = [httpx.Client() for _ in range(call_sites)]
+    try:
+        def one(i):
+            clients[i % call_sites].get(url, extensions={"trace": trace})
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as ex:
+            list(ex.map(one, range(n)))
+        return time.perf_counter() - start, opened["n"]
+    finally:
+        for c in clients:
+            c.close()
+
+
+def run_pooled(url: str, n: int, threads: int):
+    client = http_client("bench")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(lambda _: client.get(url), range(n)))
+    return time.perf_counter() - start, pool_stats()["bench"]["connections_opened"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--call-sites", type=int, default=4, help="number of separately built clients before consolidation")
+    args = ap.parse_args()
+
+    server = _serve()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    try:
+        rows = [
+            ("per-call", *run_per_call(url, args.requests, args.threads)),
+            ("per-site", *run_per_site(url, args.requests, args.threads, args.call_sites)),
+            ("shared", *run_pooled(url, args.requests, args.threads)),
+        ]
+    finally:
+        server.shutdown()
+
+    print(f"{'mode':<10}{'requests':>10}{'conns':>8}{'req/s':>10}")
+    for mode, elapsed, conns in rows:
+        print(f"{mode:<10}{args.requests:>10}{conns:>8}{args.requests / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
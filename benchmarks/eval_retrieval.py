@@ -0,0 +1,351 @@
+# back_end/benchmarks/eval_retrieval.py
+"""
+Offline retrieval quality / latency evaluation.
+
+Runs the real extraction, chunker and dedup stage against a deterministic
+embedding and an in-process vector index, so changes to CHUNK_TOKENS,
+CHUNK_OVERLAP, embedding dimensions, TOP_K, dedup or the vector backend
+can be compared without OpenAI or Pinecone:
+
+    python -m benchmarks.eval_retrieval --corpus ./sample_docs \\
+        --chunk-tokens 400,600,800 --overlap 0,120 --dims 256,1024 \\
+        --top-k 3,5,10 --backend flat,hnsw --dedup off,skip
+
+Labels: each question is a sentence from the corpus with words dropped,
+and a chunk is relevant when it contains a 6-word span of that sentence.
+Pass --qa questions.jsonl ({"question": ..., "answer": ...} per line) to
+use hand-written questions instead; a chunk is then relevant when it
+contains `answer`. Without --corpus a synthetic corpus with repeated
+boilerplate is generated.
+
+Reported per configuration and k: recall@k (questions with a relevant
+chunk in the top k), MRR@k, average context tokens sent to the model,
+chunk count, index build time (chunk + embed + index), query latency
+(embed + search) and peak traced memory during the build.
+
+--embedder hash (default) is a signed feature-hashing bag of words and
+bigrams: deterministic and lexical, good for relative comparisons.
+--embedder st:<model> uses sentence-transformers if it is installed.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from services.chunker import iter_chunks_from_sections
+from services.dedup import Deduper
+from services.file_processing import Section, UnsupportedFormat, extract_sections_from_file_bytes
+from services.rate_limiter import count_tokens
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+_WORD = re.compile(r"\w+")
+NEEDLE_WORDS = 6
+
+
+# ---- corpus + labels ----
+
+def load_corpus(path: str) -> Dict[str, List[Section]]:
+    docs = {}
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            with open(full, "rb") as f:
+                content = f.read()
+            try:
+                sections = extract_sections_from_file_bytes(name, content)
+            except UnsupportedFormat as e:
+                print(f"skipping {full}: {e}")
+                continue
+            if sections:
+                docs[os.path.relpath(full, path)] = sections
+    return docs
+
+
+def synthetic_corpus(n_docs: int, seed: int, own_words: float = 0.0) -> Dict[str, List[Section]]:
+    """Topical documents sharing a boilerplate line and a template terms page.
+    own_words is the share of words drawn from a vocabulary unique to each
+    document, which makes documents separable by their summary vectors."""
+    rng = random.Random(seed)
+    topics = [[f"{t}{i}" for i in range(60)] for t in ("revenue", "policy", "engine", "clinical", "contract", "network")]
+    common = "the a of to and in for with on by is was are this that from".split()
+    boilerplate = ("This document is confidential and intended solely for the addressee. "
+                   "Any review, retransmission or dissemination is prohibited.")
+    # a full template page repeated through every document, like standard terms
+    terms = " ".join(rng.choice(common + topics[0][:10]) for _ in range(400))
+    docs = {}
+    for d in range(n_docs):
+        vocab = rng.choice(topics)
+        own = [f"d{d}x{i}" for i in range(30)]
+
+        def word():
+            r = rng.random()
+            return rng.choice(own if r < own_words else vocab if r < own_words + 0.55 else common)
+
+        pages = []
+        for p in range(rng.randint(3, 8)):
+            sentences = [
+                " ".join(word() for _ in range(rng.randint(12, 24))).capitalize() + "."
+                for _ in range(rng.randint(8, 20))
+            ]
+            pages.append(Section(" ".join(sentences) + "\n\n" + boilerplate, f"page {p + 1}"))
+            if p % 2:
+                pages.append(Section(terms, f"page {p + 1} terms"))
+        docs[f"doc-{d}.txt"] = pages
+    return docs
+
+
+def _norm(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def build_questions(docs: Dict[str, List[Section]], n: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    sentences = []
+    for name, sections in docs.items():
+        for s in sections:
+            for sent in re.split(r"(?<=[.!?])\s+", s.text):
+                words = _WORD.findall(sent)
+                if len(words) >= NEEDLE_WORDS + 6:
+                    sentences.append((name, words))
+    rng.shuffle(sentences)
+    questions = []
+    for name, words in sentences[:n]:
+        i = rng.randint(0, len(words) - NEEDLE_WORDS)
+        needle = " ".join(words[i:i + NEEDLE_WORDS]).lower()
+        # drop ~30% of the words so the query is not a verbatim copy
+        query = " ".join(w for w in words if rng.random() > 0.3)
+        questions.append({"question": query, "answer": needle, "doc": name})
+    return questions
+
+
+def load_qa(path: str) -> List[dict]:
+    with open(path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [{"question": q["question"], "answer": _norm(q["answer"])} for q in rows if q]
+
+
+# ---- embedders ----
+
+class HashingEmbedder:
+    name = "hash"
+
+    def __init__(self, dims: int):
+        self.dims = dims
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat in self._features(text):
+                h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "big")
+                out[row, h % self.dims] += 1.0 if (h >> 63) else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-9)
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model: str, dims: int):
+        from sentence_transformers import SentenceTransformer
+        self.name = f"st:{model}"
+        self.model = SentenceTransformer(model, truncate_dim=dims or None)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+
+def make_embedder(spec: str, dims: int):
+    if spec == "hash":
+        return HashingEmbedder(dims)
+    if spec.startswith("st:"):
+        return SentenceTransformerEmbedder(spec[3:], dims)
+    raise SystemExit(f"unknown embedder: {spec}")
+
+
+# ---- vector backends ----
+
+class FlatIndex:
+    """Exact cosine search, what Pinecone's exact results should look like."""
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def search(self, q: np.ndarray, k: int) -> List[int]:
+        scores = self.vectors @ q
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])].tolist()
+
+    def nbytes(self) -> int:
+        return self.vectors.nbytes
+
+
+class HnswIndex:
+    """Approximate search (HNSW), for comparing against exact results."""
+
+    def __init__(self, vectors: np.ndarray, m: int = 16, ef: int = 64):
+        self.m = m
+        self.count, dims = vectors.shape
+        self.index = hnswlib.Index(space="ip", dim=dims)
+        self.index.init_index(max_elements=max(1, self.count), M=m, ef_construction=200)
+        self.index.add_items(vectors, np.arange(self.count))
+        self.index.set_ef(ef)
+        self.dims = dims
+
+    def search(self, q: np.ndarray, k: int) -> List[int]:
+        labels, _ = self.index.knn_query(q, k=min(k, self.count))
+        return labels[0].tolist()
+
+    def nbytes(self) -> int:
+        # vectors + level-0 links; hnswlib allocates outside tracemalloc
+        return self.count * (self.dims * 4 + self.m * 2 * 4 + 16)
+
+
+def make_index(backend: str, vectors: np.ndarray):
+    if backend == "flat":
+        return FlatIndex(vectors)
+    if backend == "hnsw":
+        if hnswlib is None:
+            raise SystemExit("--backend hnsw needs `pip install hnswlib`")
+        return HnswIndex(vectors)
+    raise SystemExit(f"unknown backend: {backend}")
+
+
+# ---- evaluation ----
+
+def build(docs, chunk_tokens: int, overlap: int, dedup: str, embedder, backend: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks: List[Tuple[str, str]] = []
+    # texts actually embedded, and for each chunk the row of its vector, so a
+    # reused duplicate gets its canonical chunk's vector as in ingestion
+    to_embed: List[str] = []
+    rows: List[int] = []
+    for name, sections in docs.items():
+        doc_chunks = list(iter_chunks_from_sections(sections, chunk_tokens, overlap))
+        if dedup == "off":
+            new = [(c, None) for c in doc_chunks]
+            reused = []
+        else:
+            # in-memory only: cross-namespace dedup needs the signature store
+            deduper = Deduper(name, mode=dedup, cross_namespace=False)
+            ids = {id(c): f"{name}:{i}" for i, c in enumerate(doc_chunks)}
+            new, reused = deduper.split(doc_chunks, lambda c: ids[id(c)])
+        row_of = {}
+        for c, cid in new:
+            row_of[cid] = len(to_embed)
+            rows.append(len(to_embed))
+            to_embed.append(c[0])
+            chunks.append((name, c[0]))
+        for c, _, canonical, _ in reused:
+            rows.append(row_of[canonical])
+            chunks.append((name, c[0]))
+    chunk_s = time.perf_counter() - start
+    vectors = embedder.embed(to_embed)[rows]
+    embed_s = time.perf_counter() - start - chunk_s
+    index = make_index(backend, vectors)
+    build_s = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chunks, index, {"chunk_s": chunk_s, "embed_s": embed_s, "build_s": build_s,
+                           "peak_mb": peak / 2**20, "index_mb": index.nbytes() / 2**20}
+
+
+def evaluate(chunks, index, embedder, questions: List[dict], ks: List[int]) -> Tuple[Dict[int, dict], dict]:
+    normed = [_norm(text) for _, text in chunks]
+    tokens = [count_tokens(text) for _, text in chunks]
+    max_k = max(ks)
+    hits = {k: 0 for k in ks}
+    rr = {k: 0.0 for k in ks}
+    ctx = {k: 0 for k in ks}
+    latencies = []
+    for q in questions:
+        start = time.perf_counter()
+        qvec = embedder.embed([q["question"]])[0]
+        ranked = index.search(qvec, max_k)
+        latencies.append(time.perf_counter() - start)
+        first = next((rank for rank, i in enumerate(ranked, start=1) if q["answer"] in normed[i]), None)
+        for k in ks:
+            ctx[k] += sum(tokens[i] for i in ranked[:k])
+            if first is not None and first <= k:
+                hits[k] += 1
+                rr[k] += 1.0 / first
+    n = max(1, len(questions))
+    latencies.sort()
+    timing = {
+        "query_ms_p50": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "query_ms_p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000 if latencies else 0.0,
+    }
+    return {k: {"recall": hits[k] / n, "mrr": rr[k] / n, "context_tokens": ctx[k] / n} for k in ks}, timing
+
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--corpus", help="directory of documents; synthetic corpus if omitted")
+    ap.add_argument("--docs", type=int, default=40, help="synthetic corpus size")
+    ap.add_argument("--qa", help="jsonl of {question, answer}; generated from the corpus if omitted")
+    ap.add_argument("--questions", type=int, default=200)
+    ap.add_argument("--chunk-tokens", default="600")
+    ap.add_argument("--overlap", default="120")
+    ap.add_argument("--dims", default="512")
+    ap.add_argument("--top-k", default="1,5,10")
+    ap.add_argument("--backend", default="flat", help="flat,hnsw")
+    ap.add_argument("--dedup", default="off", help="off,skip,reuse")
+    ap.add_argument("--embedder", default="hash", help="hash | st:<sentence-transformers model>")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", help="also write results here")
+    args = ap.parse_args()
+
+    docs = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.docs, args.seed)
+    questions = load_qa(args.qa) if args.qa else build_questions(docs, args.questions, args.seed)
+    ks = _ints(args.top_k)
+    print(f"{len(docs)} documents, {len(questions)} questions")
+
+    results = []
+    grid = itertools.product(_ints(args.chunk_tokens), _ints(args.overlap), _ints(args.dims),
+                             args.backend.split(","), args.dedup.split(","))
+    for chunk_tokens, overlap, dims, backend, dedup in grid:
+        if overlap >= chunk_tokens:
+            continue
+        embedder = make_embedder(args.embedder, dims)
+        chunks, index, build_stats = build(docs, chunk_tokens, overlap, dedup, embedder, backend)
+        by_k, timing = evaluate(chunks, index, embedder, questions, ks)
+        config = {"embedder": embedder.name, "chunk_tokens": chunk_tokens, "overlap": overlap, "dims": dims,
+                  "backend": backend, "dedup": dedup, "chunks": len(chunks)}
+        for k in ks:
+            results.append({**config, "k": k, **by_k[k], **build_stats, **timing})
+
+    header = (f"{'chunk':>6}{'ovl':>5}{'dims':>6}{'backend':>8}{'dedup':>6}{'k':>4}"
+              f"{'recall':>8}{'mrr':>7}{'ctx_tok':>9}{'chunks':>8}{'build_s':>9}{'q_p50ms':>9}{'q_p95ms':>9}"
+              f"{'peak_mb':>9}{'index_mb':>9}")
+    print(header)
+    for r in results:
+        print(f"{r['chunk_tokens']:>6}{r['overlap']:>5}{r['dims']:>6}{r['backend']:>8}{r['dedup']:>6}{r['k']:>4}"
+              f"{r['recall']:>8.3f}{r['mrr']:>7.3f}{r['context_tokens']:>9.0f}{r['chunks']:>8}{r['build_s']:>9.2f}"
+              f"{r['query_ms_p50']:>9.2f}{r['query_ms_p95']:>9.2f}{r['peak_mb']:>9.1f}{r['index_mb']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
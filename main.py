@@ -1,22 +1,29 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
 import os
 import logging
 from dotenv import load_dotenv, find_dotenv
 from typing import Optional, List, Any, Union
 from middleware.auth import SupabaseAuthMiddleware
-from supabase import create_client, Client
+from middleware.admission import AdmissionMiddleware
+from services.rate_limiter import limiter, completion_tokens, INTERACTIVE
+from services.http_transport import get_openai, get_supabase, pool_stats
+from services.extraction_pool import extraction_pool
+from services.answer_cache import answer_cache
+from services.admission import scheduler
+from services.log_pipeline import setup_logging, log_stats
 from routes.agent import router as agent_router
 from routes.documents import router as documents_router
 from routes.chat_to_ppt import router as chat_to_ppt_router
 
-# Configure logging to see detailed errors
-logging.basicConfig(level=logging.DEBUG)
+# JSON logs through a background queue (LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE)
+setup_logging()
 
 load_dotenv(find_dotenv())
 app = FastAPI()
+# added first = runs innermost, after auth has set request.state.tenant_id
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(SupabaseAuthMiddleware)                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                           
 Port = 8001
 
@@ -32,13 +39,12 @@ app.add_middleware(
 
 
 # Initialize OpenAI client
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise RuntimeError("OPENAI_API_KEY environment variable not set")
-openai = OpenAI(api_key=api_key)
+openai = get_openai()
+# for calls made outside the limiter (it does the retries for `openai`)
+openai_direct = get_openai(sdk_retries=True)
 
 # Initialize Supabase client
-supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_ANON_KEY"))
+supabase = get_supabase(os.getenv("SUPABASE_ANON_KEY"))
 
 
 # Pydantic models for request bodies
@@ -90,12 +96,16 @@ async def send_message(message: Message):
         else:
             content_text = str(content)
 
-        response = openai.chat.completions.create(
+        messages = [{"role": "user", "content": content_text}]
+        response = await limiter.acall(
+            openai.chat.completions.create,
             model="gpt-4.1",
-            messages=[{"role": "user", "content": content_text}],
+            messages=messages,
             temperature=0,
             max_tokens=2048,
             store=True,
+            priority=INTERACTIVE,
+            tokens=completion_tokens(messages, max_tokens=2048),
         )
 
         result = response.choices[0].message.content
@@ -108,6 +118,18 @@ async def send_message(message: Message):
         logging.error(f"Error handling message: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+# Outbound pool / limiter / extraction / cache / admission / logging counters
+@app.get("/metrics")
+def metrics():
+    return {
+        "transport": pool_stats(),
+        "openai_limiter": limiter.snapshot(),
+        "extraction": extraction_pool.stats(),
+        "answer_cache": answer_cache.snapshot(),
+        "admission": scheduler.snapshot(),
+        "logging": log_stats(),
+    }
+
 # ChatKit session creation endpoint
 @app.post("/api/chatkit/session")
 def create_chatkit_session():
@@ -115,7 +137,7 @@ def create_chatkit_session():
         logging.info("Creating ChatKit session...")
         
         # Pass workflow as an object with id property
-        session = openai.beta.chatkit.sessions.create(
+        session = openai_direct.beta.chatkit.sessions.create(
             user="auto",
             #workflow as an object with id property
             workflow={
@@ -0,0 +1,113 @@
+# app/middleware/admission.py
+import json
+import time
+from urllib.parse import parse_qs
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from middleware.auth import BYPASS_TENANT_ID, BYPASS_USER_ID, request_user
+from services.admission import scheduler, Overloaded
+
+# Never queued or shed: health / metrics / docs and CORS preflights
+EXEMPT_PATHS = ("/metrics", "/docs", "/redoc", "/openapi.json")
+
+# JSON bodies up to this size are read for their user_id while auth is bypassed
+MAX_SNIFF_BYTES = 64 * 1024
+
+# Relative cost for fair queuing; everything else costs 1
+ROUTE_COSTS = {
+    ("POST", "/documents/upload"): 4.0,
+    ("PUT", "/documents/"): 4.0,
+    ("POST", "/agent/answer/batch"): 4.0,
+    ("POST", "/agent/answer/multihop"): 2.0,
+}
+
+
+async def _claimed_user(scope, receive):
+    """user_id the client names in the query string or a JSON body, and a
+    receive() that replays the body for the app."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if query.get("user_id"):
+        return query["user_id"][0], receive
+    headers = dict(scope.get("headers") or [])
+    content_type = headers.get(b"content-type", b"").split(b";")[0].strip()
+    try:
+        length = int(headers.get(b"content-length", b"0"))
+    except ValueError:
+        length = 0
+    # multipart uploads are not buffered here; they stay on the server-wide limits
+    if content_type != b"application/json" or not 0 < length <= MAX_SNIFF_BYTES:
+        return None, receive
+
+    messages, body = [], b""
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+
+    async def replay():
+        return messages.pop(0) if messages else await receive()
+
+    try:
+        claimed = json.loads(body).get("user_id")
+    except (ValueError, AttributeError):
+        claimed = None
+    return (claimed if isinstance(claimed, str) else None), replay
+
+
+async def _fairness_key(scope, receive):
+    """(key, tenant_limits, receive). The token's tenant when authenticated;
+    while auth is bypassed, the namespace request_user resolves, so tenants
+    still get their own limits. Requests naming no usable namespace share
+    only the server-wide limits."""
+    state = scope.get("state") or {}
+    tenant = state.get("tenant_id")
+    if tenant and tenant != BYPASS_TENANT_ID:
+        return tenant, True, receive
+    claimed = None
+    if state.get("user_id") == BYPASS_USER_ID:
+        claimed, receive = await _claimed_user(scope, receive)
+    try:
+        return request_user(Request(scope), claimed), True, receive
+    except HTTPException:
+        return "anonymous", False, receive
+
+
+def _cost(method: str, path: str) -> float:
+    for (m, prefix), cost in ROUTE_COSTS.items():
+        if m == method and path.startswith(prefix):
+            return cost
+    return 1.0
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI (not BaseHTTPMiddleware) so the slot is held until the whole
+    response, including a streamed body, has been sent.
+    Must be added before SupabaseAuthMiddleware so it runs inside it and
+    sees request.state.tenant_id / user_id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"].startswith(EXEMPT_PATHS):
+            return await self.app(scope, receive, send)
+
+        tenant, tenant_limits, receive = await _fairness_key(scope, receive)
+        try:
+            await scheduler.acquire(tenant, _cost(scope["method"], scope["path"]), tenant_limits=tenant_limits)
+        except Overloaded as e:
+            response = JSONResponse(e.as_dict(), status_code=e.status, headers={"Retry-After": str(e.retry_after)})
+            return await response(scope, receive, send)
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            scheduler.release(tenant, time.monotonic() - start)
@@ -1,6 +1,6 @@
 # app/middleware/auth.py
 import os
-from typing import Callable
+from typing import Callable, Optional
 from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi import Request, HTTPException
 from jose import jwt
@@ -12,6 +12,12 @@ load_dotenv()
 JWKS_URL = os.getenv("SUPABASE_JWKS_URL")
 SUPABASE_AUD = os.getenv("SUPABASE_AUD")  # optional
 
+# set on every request while auth is bypassed; not a real identity
+BYPASS_USER_ID = "test-user"
+BYPASS_TENANT_ID = "test-tenant"
+# separates derived namespaces (services/doc_routing.py), so no user id may contain it
+RESERVED_ID_CHAR = "#"
+
 # Simple in-memory JWKS cache
 _jwks_cache = {"keys": None}
 
@@ -27,8 +33,8 @@ class SupabaseAuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: Callable):
         
           # TEMPORARILY BYPASS AUTH FOR ALL ROUTES
-        request.state.user_id = "test-user"
-        request.state.tenant_id = "test-tenant"
+        request.state.user_id = BYPASS_USER_ID
+        request.state.tenant_id = BYPASS_TENANT_ID
         request.state.jwt_claims = {}
         return await call_next(request)
         
@@ -73,3 +79,23 @@ async def auth_user(request: Request):
     if not hasattr(request.state, "user_id") or not request.state.user_id:
         raise HTTPException(status_code=401, detail="Unauthorized")
     return request.state.user_id
+
+
+def request_user(request: Request, claimed: Optional[str] = None) -> str:
+    """
+    Namespace a request may act on: the authenticated user. A `user_id` sent
+    by the client must match it. While auth is bypassed there is no identity
+    to check against, so the client's `user_id` is used as before.
+    """
+    user_id = getattr(request.state, "user_id", None)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if user_id == BYPASS_USER_ID:
+        if not claimed:
+            raise HTTPException(status_code=400, detail="user_id is required")
+        if RESERVED_ID_CHAR in claimed:
+            raise HTTPException(status_code=400, detail=f"user_id may not contain {RESERVED_ID_CHAR!r}")
+        return claimed
+    if claimed and claimed != user_id:
+        raise HTTPException(status_code=403, detail="user_id does not match the authenticated user")
+    return user_id
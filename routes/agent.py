@@ -1,12 +1,22 @@
 # back_end/routes/agent.py
 from typing import Union, Optional, List, Dict
-from fastapi import APIRouter, HTTPException
-from openai import OpenAI
+import asyncio
+import json
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from services.embeddings import embed_text
-from services.pinecone_client import index
+from services.embeddings import embed_text, embed_texts, EMBED_BATCH
+from services.chunk_store import texts_for_matches
+from services.rate_limiter import limiter, completion_tokens, INTERACTIVE, BATCH
+from services.http_transport import get_openai
+from services.agent_tools import run_agent
+from services.answer_cache import answer_cache, prompt_version
+from services.doc_routing import search, cache_filter
+from services.log_pipeline import log_event
+from middleware.auth import request_user
 import os
+import logging
 
 
 
@@ -15,8 +25,21 @@ list=List
 dict=Dict
 
 router = APIRouter()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_openai()
+logger = logging.getLogger(__name__)
 top_k_val= int(os.getenv("TOP_K",5))
+# capped at the embeddings batch size, so a batch is embedded in one request
+BATCH_MAX_QUESTIONS = min(int(os.getenv("BATCH_MAX_QUESTIONS", str(EMBED_BATCH))), EMBED_BATCH)
+BATCH_COMPLETION_CONCURRENCY = int(os.getenv("BATCH_COMPLETION_CONCURRENCY", "8"))
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant. Use ONLY the provided context to answer. "
+    "If the answer is not present, say \"I don't see this in uploaded documents.\""
+    " Answer concisely and don't include **markdown** formatting."
+)
+ANSWER_MODEL = "gpt-5.1"
+# cached answers are only reused while prompt, model, top_k and routing are unchanged
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT, ANSWER_MODEL, str(top_k_val), json.dumps(cache_filter()))
 
 
 # Define the request model
@@ -24,61 +47,190 @@ class Message(BaseModel):
     session_id: str
     content: Union[str, Dict, List]
     user_id: Optional[str] = None
+    file_ids: Optional[List[str]] = None
 
 
-@router.post("/agent/answer")
-def agent_answer(req: Message):
-    q = req.content
-    user_ns = req.user_id
-    if not user_ns:
-        raise HTTPException(status_code=400, detail="user_id is required")
+class AgentQuestion(BaseModel):
+    session_id: str
+    content: str
+    user_id: Optional[str] = None
+    file_ids: Optional[List[str]] = None
 
 
-    # 1 query embedding
-    q_emb = embed_text(q)
-
-    # 2 pinecone search 
-    # include_metadata True to get stored snippet
-    results = index.query(
-        vector=q_emb,
-        top_k=top_k_val,
-        include_metadata=True,
-        namespace=user_ns  
-    )
+class BatchQuestions(BaseModel):
+    session_id: str
+    questions: List[str]
+    user_id: Optional[str] = None
+    file_ids: Optional[List[str]] = None
 
 
-    # 3) build context (concatenate top matches)
-    matches = results.get("matches", [])
+def build_context(matches, texts: Dict[str, str]) -> str:
     context_parts = []
-    
+
     for match in matches:
         filename = match["metadata"].get("file_name") or ""
         description = match["metadata"].get("description") or ""
-        text = match["metadata"].get("text") or ""
+        text = texts.get(match["id"]) or ""
 
         if not filename and not text:
             continue  # skip empty entries
 
-    # combine filename + content per document
+        # combine filename + content per document
         entry = f"file name:{filename}\ndescription:{description}\ncontent:{text}"
         context_parts.append(entry)
 
-# join each file+content block with clear spacing
-    context = "\n\n\n".join(context_parts)
+    # join each file+content block with clear spacing
+    return "\n\n\n".join(context_parts)
 
-    # 4) prompt the LLM 
-    system_prompt = (
-        "You are a helpful assistant. Use ONLY the provided context to answer. "
-        "If the answer is not present, say \"I don't see this in uploaded documents.\""
-        " Answer concisely and don't include **markdown** formatting."
+
+def cache_question(q, file_ids: Optional[List[str]] = None):
+    """Answer cache key: the same question pinned to other files is another question."""
+    return {"question": q, "file_ids": sorted(file_ids)} if file_ids else q
+
+
+async def retrieve(user_ns: str, version: int, q_emb: List[float], file_ids: Optional[List[str]] = None):
+    """Top-k matches for a query embedding, from the retrieval cache when the
+    namespace hasn't changed since they were stored. Unpinned queries are
+    routed to their closest documents first (services/doc_routing.py)."""
+    flt = cache_filter(file_ids)
+    matches = answer_cache.get_retrieval(user_ns, version, q_emb, top_k_val, flt)
+    if matches is not None:
+        return matches
+    matches, how = await search(user_ns, q_emb, top_k_val, file_ids)
+    logger.debug("retrieval for %s: %s over %d files", user_ns, how["mode"], len(how["file_ids"]))
+    return answer_cache.put_retrieval(user_ns, version, q_emb, top_k_val, flt, matches)
+
+
+def complete(context: str, q, priority: str = INTERACTIVE) -> str:
+    prompt = f"{SYSTEM_PROMPT}\n\nCONTEXT:\n{context}\n\nQUESTION:\n{q}"
+    response = limiter.call(
+        client.responses.create,
+        model=ANSWER_MODEL,
+        input=prompt,
+        priority=priority,
+        tokens=completion_tokens(prompt),
     )
-    prompt = f"{system_prompt}\n\nCONTEXT:\n{context}\n\nQUESTION:\n{q}"
+    return response.output_text
+
+
+@router.post("/agent/answer")
+async def agent_answer(request: Request, req: Message):
+    q = req.content
+    user_ns = request_user(request, req.user_id)
+
+    # 0 same question against an unchanged namespace: reuse the answer
+    version = answer_cache.version(user_ns)
+    cache_q = cache_question(q, req.file_ids)
+    cached = answer_cache.get_answer(user_ns, version, cache_q, PROMPT_VERSION)
+    if cached is not None:
+        return {"session_id": req.session_id, "message": cached}
+
+    # 1 query embedding
+    q_emb = await asyncio.to_thread(embed_text, q)
 
-    response = client.responses.create(model="gpt-5.1", input=prompt)
-    print("context_used:", context)
+    # 2 pinecone search (or cached matches)
+    matches = await retrieve(user_ns, version, q_emb, req.file_ids)
+
+    # 3) build context (concatenate top matches)
+    # chunk text is fetched for all top-k ids in one call
+    texts = await asyncio.to_thread(texts_for_matches, user_ns, matches)
+    context = build_context(matches, texts)
+
+    # 4) prompt the LLM 
+    message = await asyncio.to_thread(complete, context, q)
+    log_event(logger, "context_used", user_id=user_ns, matches=len(matches), context=context)
+    answer_cache.put_answer(user_ns, version, cache_q, PROMPT_VERSION, message)
 
     return {
         "session_id": req.session_id,
-        "message": response.output_text,
+        "message": message,
         
-    }
\ No newline at end of file
+    }
+
+
+@router.post("/agent/answer/batch")
+async def agent_answer_batch(request: Request, req: BatchQuestions):
+    """Answer many questions against one namespace.
+
+    All questions are embedded in one embeddings request, the Pinecone
+    queries run concurrently, chunk text for the union of all matches is
+    fetched once, and completions run BATCH_COMPLETION_CONCURRENCY at a time.
+    Results stream back as NDJSON, one line per question, in finishing order.
+    OpenAI calls use the batch lane so they never hold up interactive chat.
+    Questions with a cached answer for the current namespace version skip
+    all of it.
+    """
+    user_ns = request_user(request, req.user_id)
+    if not req.questions:
+        raise HTTPException(status_code=400, detail="questions is required")
+    if len(req.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"at most {BATCH_MAX_QUESTIONS} questions per batch")
+
+    questions = req.questions
+
+    # 0 answers already cached for this namespace version need no work at all
+    version = answer_cache.version(user_ns)
+    cached = {}
+    for i, q in enumerate(questions):
+        hit = answer_cache.get_answer(user_ns, version, cache_question(q, req.file_ids), PROMPT_VERSION)
+        if hit is not None:
+            cached[i] = hit
+    todo = [i for i in range(len(questions)) if i not in cached]
+
+    all_matches = {}
+    texts = {}
+    if todo:
+        # 1 one embeddings call for every remaining question
+        q_embs = await asyncio.to_thread(embed_texts, [questions[i] for i in todo], BATCH)
+
+        # 2 fan out the pinecone searches
+        results = await asyncio.gather(*[retrieve(user_ns, version, v, req.file_ids) for v in q_embs])
+        all_matches = dict(zip(todo, results))
+
+        # 3 chunks shared between questions are fetched once
+        unique = {m["id"]: m for matches in results for m in matches}
+        texts = await asyncio.to_thread(texts_for_matches, user_ns, list(unique.values()))
+
+    sem = asyncio.Semaphore(BATCH_COMPLETION_CONCURRENCY)
+
+    async def answer(i: int):
+        if i in cached:
+            return {"index": i, "question": questions[i], "message": cached[i], "cached": True}
+        async with sem:
+            try:
+                context = build_context(all_matches[i], texts)
+                message = await asyncio.to_thread(complete, context, questions[i], BATCH)
+                answer_cache.put_answer(user_ns, version, cache_question(questions[i], req.file_ids), PROMPT_VERSION, message)
+                return {"index": i, "question": questions[i], "message": message}
+            except Exception as e:
+                return {"index": i, "question": questions[i], "error": str(e)}
+
+    async def stream():
+        tasks = [asyncio.create_task(answer(i)) for i in range(len(questions))]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                item = await fut
+                item["session_id"] = req.session_id
+                yield json.dumps(item) + "\n"
+        finally:
+            # client went away: stop paying for the remaining completions
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.post("/agent/answer/multihop")
+async def agent_answer_multihop(request: Request, req: AgentQuestion):
+    """Tool-calling agent: the model can run several document searches per
+    turn (sub-queries, file filters) before answering."""
+    user_ns = request_user(request, req.user_id)
+
+    result = await run_agent(user_ns, req.content, file_ids=req.file_ids)
+
+    return {
+        "session_id": req.session_id,
+        "message": result["answer"],
+        "steps": result["steps"],
+        "searches": result["searches"],
+    }
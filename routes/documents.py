@@ -1,65 +1,171 @@
 # back_end/routes/documents.py
-from fastapi import APIRouter, UploadFile
-import uuid, os, logging
-from services.file_processing import extract_text_from_file_bytes
-from services.embeddings import client, embedding_model
-from services.pinecone_client import index
-from services.chunker import chunk_text_by_tokens, compute_chunk_hash              
-from services.supabase_client import supabase
+from fastapi import APIRouter, UploadFile, HTTPException, Request
+import uuid, os, logging, asyncio, hashlib
+from typing import Optional
+from services.extraction_pool import extraction_pool, ExtractionFailed
+from services.chunker import compute_chunk_hash
+from services.ingest_pipeline import extract_and_index, run_concurrently, delete_chunks, discard_partial
+from services.document_registry import registry, STATUS_READY, STATUS_FAILED
+from services.supabase_client import supabase, BUCKET
+from services.answer_cache import answer_cache
+from services.dedup import Deduper
+from services.doc_routing import delete_centroid
+from services.log_pipeline import log_event
+from middleware.auth import request_user
 from fastapi import Form
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+async def _ingest_upload(file: UploadFile, content: bytes, user_id: str, file_id: str, description: Optional[str],
+                         replacing: bool = False):
+    """Upload bytes to storage and index them under `file_id`.
+    Returns (path, chunk ids, dedup report).
 
-
-@router.post("/documents/upload")
-async def upload_document(description: str = Form(None), file: UploadFile = Form(...), user_id: str = Form(...)):
-
-    content = await file.read()
-
-    # Upload to Supabase Storage
+    A new document is registered up front and marked failed if the ingest
+    fails. When `replacing`, the existing record (storage path, hash,
+    status) is left alone until the caller finishes it, so a failed
+    replace leaves the old version in place."""
     path = f"{uuid.uuid4()}-{file.filename}"
+    # If a description was provided, store it with every chunk so it is returned with matches
+    if description:
+        decs = description
+    else:
+        decs = ""
+
+    content_hash = hashlib.sha256(content).hexdigest()
+    old_ids = registry.chunk_ids(user_id, file_id)
+    if not replacing:
+        registry.begin(user_id, file_id, file.filename, storage_path=path, content_hash=content_hash)
 
-    supabase.storage.from_("documents").upload(
+    # Upload to Supabase Storage (network only, independent of extraction).
+    # Shielded: a thread can't be cancelled, so on failure we wait for it
+    # and remove the object instead.
+    storage_upload = asyncio.ensure_future(asyncio.to_thread(
+        supabase.storage.from_(BUCKET).upload,
         path,
         content,
         {"content-type": file.content_type},
+    ))
+
+    # Extract -> chunk -> dedup -> embed & store in Pinecone, batches overlapping
+    deduper = Deduper(user_id)
+    indexing = extract_and_index(
+        lambda: extraction_pool.aextract_sections(file.filename, content, content_hash),
+        namespace=user_id,
+        make_id=lambda c: compute_chunk_hash(path, c[1], c[2]),
+        make_metadata=lambda c: {
+            "file_name": file.filename,
+            "file_id": file_id,
+            "locator": c[3],
+            "description": decs,
+        },
+        file_id=file_id,
+        deduper=deduper,
     )
 
-    # Extract text from the uploaded file bytes
-    text = extract_text_from_file_bytes(file.filename, content)
-    # If a description was provided, prepend it to the extracted text so it is included in embeddings
-    if description:
-        decs = description
-    else:
-        decs = ""
+    try:
+        _, chunk_ids = await run_concurrently(asyncio.shield(storage_upload), indexing)
+    except ExtractionFailed as e:
+        await _discard_upload(user_id, file_id, old_ids, path, storage_upload)
+        if not replacing:
+            registry.finish(user_id, file_id, STATUS_FAILED)
+        status = {"overloaded": 503, "unsupported": 415}.get(e.reason, 422)
+        raise HTTPException(status_code=status, detail=e.as_dict())
+    except BaseException:
+        await _discard_upload(user_id, file_id, old_ids, path, storage_upload)
+        if not replacing:
+            registry.finish(user_id, file_id, STATUS_FAILED)
+        raise
+    finally:
+        # vectors may have changed even if the ingest failed part-way
+        answer_cache.bump(user_id)
+    report = deduper.report()
+    log_event(logger, "ingest_dedup", file_id=file_id, **report)
+    return path, chunk_ids, report
+
+
+async def _discard_upload(user_id: str, file_id: str, keep, path: str, storage_upload: asyncio.Future):
+    """Undo what a failed ingest already wrote: its vectors/chunk text and
+    its storage object. Chunks in `keep` (the previous version) stay."""
+    await asyncio.wait([storage_upload])
+    try:
+        removed = await asyncio.to_thread(discard_partial, user_id, file_id, keep)
+        if removed:
+            logger.info("Removed %d chunks of failed ingest %s", removed, file_id)
+    except Exception as e:
+        logger.warning("Could not clean up failed ingest %s: %s", file_id, e)
+    if not storage_upload.cancelled() and storage_upload.exception() is None:
+        await asyncio.to_thread(_remove_from_storage, path)
+
+
+def _remove_from_storage(path: Optional[str]):
+    if not path:
+        return
+    try:
+        supabase.storage.from_(BUCKET).remove([path])
+    except Exception as e:
+        logger.warning("Failed to remove %s from storage: %s", path, e)
+
+
+@router.post("/documents/upload")
+async def upload_document(request: Request, description: str = Form(None), file: UploadFile = Form(...), user_id: str = Form(None)):
+    user_id = request_user(request, user_id)
+
+    content = await file.read()
+    file_id = str(uuid.uuid4())
+
+    path, chunk_ids, dedup = await _ingest_upload(file, content, user_id, file_id, description)
+    registry.finish(user_id, file_id, STATUS_READY)
+    logger.info("Uploaded %s: %d chunks", path, len(chunk_ids))
+
+    return {"message": "uploaded", "file_id": file_id, "chunks": len(chunk_ids), "dedup": dedup}
+
+
+@router.get("/documents")
+def list_documents(request: Request, user_id: Optional[str] = None):
+    return {"documents": registry.list(request_user(request, user_id))}
+
+
+@router.delete("/documents/{file_id}")
+def delete_document(request: Request, file_id: str, user_id: Optional[str] = None):
+    user_id = request_user(request, user_id)
+    doc = registry.get(user_id, file_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    deleted = delete_chunks(user_id, registry.chunk_ids(user_id, file_id))
+    delete_centroid(user_id, file_id)
+    _remove_from_storage(doc.get("storage_path"))
+    registry.delete(user_id, file_id)
+
+    return {"message": "deleted", "file_id": file_id, "chunks_deleted": deleted}
+
+
+@router.put("/documents/{file_id}")
+async def replace_document(request: Request, file_id: str, description: str = Form(None), file: UploadFile = Form(...), user_id: str = Form(None)):
+    user_id = request_user(request, user_id)
+    doc = registry.get(user_id, file_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    content = await file.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    if doc.get("content_hash") == content_hash and doc.get("status") == STATUS_READY:
+        return {"message": "unchanged", "file_id": file_id, "chunks": doc.get("chunk_count", 0)}
+
+    # New version is indexed first, so the document stays searchable during the
+    # replace; the old version's vectors and record are replaced once the new
+    # ones exist. A failed replace leaves the old version as it was.
+    old_ids = set(registry.chunk_ids(user_id, file_id))
+    path, chunk_ids, dedup = await _ingest_upload(file, content, user_id, file_id, description, replacing=True)
 
-    # Embed & store in Pinecone
-    chunks = chunk_text_by_tokens(text)
-
-    for chunk_text, start, end in chunks:
-        chunk_id = compute_chunk_hash(path, start, end)
-        embedding = client.embeddings.create(
-            model=embedding_model,
-            input=chunk_text
-        )
-        
-        index.upsert(
-            vectors=[
-                {
-                    "id": chunk_id,
-                    "values": embedding.data[0].embedding,
-                    "metadata": {
-                        "text": chunk_text,
-                        "file_name": file.filename,
-                        "description": decs
-                    }
-                }
-            ],
-            namespace=user_id
-        )
-
-    return {"message": "uploaded"}
+    stale = old_ids - set(chunk_ids)
+    deleted = await asyncio.to_thread(delete_chunks, user_id, stale)
+    registry.remove_chunks(user_id, file_id, stale)
+    registry.finish(user_id, file_id, STATUS_READY, file_name=file.filename, storage_path=path, content_hash=content_hash)
+    if doc.get("storage_path") != path:
+        _remove_from_storage(doc.get("storage_path"))
 
+    return {"message": "replaced", "file_id": file_id, "chunks": len(chunk_ids), "chunks_deleted": deleted, "dedup": dedup}
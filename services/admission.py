@@ -0,0 +1,343 @@
+# back_end/services/admission.py
+"""
+Tenant-fair admission control.
+
+HTTP: every request takes a slot from `scheduler` before its handler runs
+(middleware/admission.py). Slots are handed out by start-time fair queuing
+across tenants, weighted by TENANT_WEIGHTS, with a per-tenant cap on running
+and queued requests. A request that can't be admitted within
+ADMIT_MAX_WAIT_S, or that would overflow a queue, is rejected at once:
+429 when the tenant is over its own limits, 503 when the server as a whole
+is full. Both carry a Retry-After estimated from recent service times.
+While auth is bypassed the middleware keys tenants on the namespace the
+request resolves to (request_user). Requests that name no usable tenant
+are admitted with tenant_limits=False: they share only the server-wide
+limits, since one placeholder tenant would otherwise turn the per-tenant
+cap into a server-wide one.
+
+Celery: ingestion tasks take a lease from `ingest_leases`. A tenant may hold
+at most its weighted share of INGEST_SLOTS among the tenants currently
+ingesting (all of them when it is alone); tasks over the share are put back
+on the queue with a delay so other tenants' uploads run first. Leases live
+in Redis (ADMISSION_REDIS_URL, by default the Celery broker) so every
+worker process sees them; without Redis they are per process.
+"""
+import os
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+ADMIT_MAX_CONCURRENCY = int(os.getenv("ADMIT_MAX_CONCURRENCY", "64"))
+ADMIT_MAX_QUEUE = int(os.getenv("ADMIT_MAX_QUEUE", "256"))
+ADMIT_MAX_WAIT_S = float(os.getenv("ADMIT_MAX_WAIT_S", "10"))
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", "8"))
+TENANT_MAX_QUEUE = int(os.getenv("TENANT_MAX_QUEUE", "32"))
+INGEST_SLOTS = int(os.getenv("INGEST_SLOTS", "8"))
+INGEST_LEASE_TTL_S = int(os.getenv("INGEST_LEASE_TTL_S", "900"))
+INGEST_DEFER_S = float(os.getenv("INGEST_DEFER_S", "5"))
+# shared by every Celery child and worker; per-process leases can't be fair
+# under prefork, where each child runs one task at a time
+ADMISSION_REDIS_URL = os.getenv("ADMISSION_REDIS_URL", os.getenv("CELERY_BROKER_URL", ""))
+
+
+def _parse_weights(raw: str) -> Dict[str, float]:
+    # "tenant-a=3,tenant-b=0.5"; everyone else weighs 1
+    weights = {}
+    for part in (raw or "").split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            try:
+                weights[name.strip()] = max(0.01, float(value))
+            except ValueError:
+                logger.warning("Ignoring bad TENANT_WEIGHTS entry: %r", part)
+    return weights
+
+
+TENANT_WEIGHTS = _parse_weights(os.getenv("TENANT_WEIGHTS", ""))
+
+
+def weight(tenant: str) -> float:
+    return TENANT_WEIGHTS.get(tenant, 1.0)
+
+
+class Overloaded(Exception):
+    """status: 429 (tenant over its limits) or 503 (server full)."""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def as_dict(self) -> dict:
+        detail = "Too many requests, retry later" if self.status == 429 else "Server busy, retry later"
+        return {"detail": detail, "reason": self.reason, "retry_after": self.retry_after}
+
+
+class _Waiter:
+    __slots__ = ("tenant", "tag", "future", "limited")
+
+    def __init__(self, tenant: str, tag: float, future: asyncio.Future, limited: bool = True):
+        self.tenant = tenant
+        self.tag = tag
+        self.future = future
+        self.limited = limited
+
+
+class FairScheduler:
+    """Weighted start-time fair queuing of request slots. Runs on the event loop only."""
+
+    def __init__(
+        self,
+        max_concurrency: int = ADMIT_MAX_CONCURRENCY,
+        max_queue: int = ADMIT_MAX_QUEUE,
+        max_wait: float = ADMIT_MAX_WAIT_S,
+        tenant_concurrency: int = TENANT_MAX_CONCURRENCY,
+        tenant_queue: int = TENANT_MAX_QUEUE,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tenant_concurrency = max(1, tenant_concurrency)
+        self.tenant_queue = tenant_queue
+        self._queues: Dict[str, deque] = {}
+        self._running: Dict[str, int] = {}
+        self._finish: Dict[str, float] = {}
+        self._total = 0
+        self._queued = 0
+        self._vtime = 0.0
+        self._service_s = 1.0  # EWMA of handler time, for Retry-After
+        self._counts = {"admitted": 0, "waited": 0, "rejected_tenant": 0, "rejected_server": 0, "timed_out": 0}
+
+    # ---- estimates ----
+
+    def _wait_s(self, ahead: int, slots: int) -> float:
+        return self._service_s * ahead / max(1, slots)
+
+    def _retry_after(self, ahead: int, slots: int) -> int:
+        return max(1, math.ceil(self._wait_s(ahead + 1, slots)))
+
+    def _reject(self, status: int, reason: str, ahead: int, slots: int):
+        self._counts["rejected_tenant" if status == 429 else "rejected_server"] += 1
+        raise Overloaded(status, reason, self._retry_after(ahead, slots))
+
+    # ---- scheduling ----
+
+    def _dispatch(self):
+        while self._total < self.max_concurrency and self._queued:
+            best = None
+            for tenant, q in self._queues.items():
+                if q and (not q[0].limited or self._running.get(tenant, 0) < self.tenant_concurrency):
+                    if best is None or q[0].tag < best.tag:
+                        best = q[0]
+            if best is None:
+                return
+            q = self._queues[best.tenant]
+            q.popleft()
+            if not q:
+                del self._queues[best.tenant]
+            self._queued -= 1
+            self._vtime = max(self._vtime, best.tag)
+            self._running[best.tenant] = self._running.get(best.tenant, 0) + 1
+            self._total += 1
+            best.future.set_result(time.monotonic())
+
+    def _remove(self, waiter: _Waiter) -> bool:
+        q = self._queues.get(waiter.tenant)
+        if q is None or waiter not in q:
+            return False
+        q.remove(waiter)
+        if not q:
+            del self._queues[waiter.tenant]
+            if not self._running.get(waiter.tenant):
+                self._finish.pop(waiter.tenant, None)
+        self._queued -= 1
+        return True
+
+    async def acquire(self, tenant: str, cost: float = 1.0, tenant_limits: bool = True) -> float:
+        """Wait for a slot; returns the time spent queued. Raises Overloaded.
+        tenant_limits=False skips the per-tenant caps (placeholder tenants)."""
+        queued = len(self._queues.get(tenant, ()))
+        if tenant_limits:
+            running = self._running.get(tenant, 0)
+            if queued >= self.tenant_queue:
+                self._reject(429, "tenant_queue_full", queued + running, self.tenant_concurrency)
+            # fail fast instead of queuing for longer than a client will wait
+            if self._wait_s(queued, self.tenant_concurrency) > self.max_wait:
+                self._reject(429, "tenant_backlog", queued, self.tenant_concurrency)
+        if self._queued >= self.max_queue:
+            self._reject(503, "server_queue_full", self._queued, self.max_concurrency)
+        if self._wait_s(self._queued, self.max_concurrency) > self.max_wait:
+            self._reject(503, "server_backlog", self._queued, self.max_concurrency)
+
+        # start tag: a tenant's burst gets increasing tags, so other tenants
+        # interleave with it instead of queuing behind it
+        start = max(self._vtime, self._finish.get(tenant, 0.0))
+        self._finish[tenant] = start + cost / weight(tenant)
+        waiter = _Waiter(tenant, start, asyncio.get_running_loop().create_future(), tenant_limits)
+        self._queues.setdefault(tenant, deque()).append(waiter)
+        self._queued += 1
+        enqueued = time.monotonic()
+        self._dispatch()
+
+        if not waiter.future.done():
+            self._counts["waited"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except asyncio.TimeoutError:
+            if self._remove(waiter):
+                self._counts["timed_out"] += 1
+                raise Overloaded(503, "queue_timeout", self._retry_after(self._queued, self.max_concurrency))
+        except asyncio.CancelledError:
+            # client went away; give the slot back if it was already granted
+            if not self._remove(waiter):
+                self.release(tenant)
+            raise
+        self._counts["admitted"] += 1
+        return time.monotonic() - enqueued
+
+    def release(self, tenant: str, service_s: Optional[float] = None):
+        self._running[tenant] -= 1
+        self._total -= 1
+        if not self._running[tenant]:
+            del self._running[tenant]
+            if not self._queues.get(tenant):
+                # idle tenants don't keep state (or credit) around
+                self._queues.pop(tenant, None)
+                self._finish.pop(tenant, None)
+        if service_s is not None:
+            self._service_s = 0.9 * self._service_s + 0.1 * service_s
+        self._dispatch()
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._total,
+            "queued": self._queued,
+            "tenants_active": len(set(self._running) | {t for t, q in self._queues.items() if q}),
+            "service_s_avg": round(self._service_s, 3),
+            **self._counts,
+        }
+
+
+scheduler = FairScheduler()
+
+
+# ---- Celery ingestion ----
+
+class _LocalLeases:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: Dict[str, Dict[str, float]] = {}
+        self._active: Dict[str, float] = {}
+
+    def acquire(self, tenant: str, lease_id: str, slots: int, ttl: float, active_ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._active[tenant] = now + active_ttl
+            self._active = {t: exp for t, exp in self._active.items() if exp > now}
+            share = _share(tenant, slots, self._active)
+            held = {k: exp for k, exp in self._leases.get(tenant, {}).items() if exp > now}
+            if len(held) >= share:
+                self._leases[tenant] = held
+                return False
+            held[lease_id] = now + ttl
+            self._leases[tenant] = held
+            return True
+
+    def release(self, tenant: str, lease_id: str):
+        with self._lock:
+            self._leases.get(tenant, {}).pop(lease_id, None)
+
+
+class _RedisLeases:
+    """Leases are sorted-set members scored by expiry, so a killed worker's
+    lease lapses after the TTL instead of leaking a slot."""
+
+    _ACQUIRE = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then return 0 end
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return 1
+    """
+
+    def __init__(self, url: str, prefix: str = "ingest_leases"):
+        self.prefix = prefix
+        self._r = redis.Redis.from_url(url)
+        self._acquire = self._r.register_script(self._ACQUIRE)
+
+    def acquire(self, tenant: str, lease_id: str, slots: int, ttl: float, active_ttl: float) -> bool:
+        now = time.time()
+        active_key = f"{self.prefix}:active"
+        try:
+            pipe = self._r.pipeline()
+            pipe.zadd(active_key, {tenant: now + active_ttl})
+            pipe.zremrangebyscore(active_key, "-inf", now)
+            pipe.zrange(active_key, 0, -1)
+            active = {t.decode("utf-8"): 0 for t in pipe.execute()[2]}
+            share = _share(tenant, slots, active)
+            return bool(self._acquire(
+                keys=[f"{self.prefix}:{tenant}"],
+                args=[now, share, now + ttl, lease_id, int(ttl) + 60],
+            ))
+        except Exception as e:
+            # never stall ingestion because Redis is down
+            logger.warning("Redis ingest leases unavailable, admitting task: %s", e)
+            return True
+
+    def release(self, tenant: str, lease_id: str):
+        try:
+            self._r.zrem(f"{self.prefix}:{tenant}", lease_id)
+        except Exception as e:
+            logger.warning("Could not release ingest lease for %s: %s", tenant, e)
+
+
+def _share(tenant: str, slots: int, active) -> int:
+    total = sum(weight(t) for t in active) or weight(tenant)
+    return max(1, math.ceil(slots * weight(tenant) / total))
+
+
+class IngestLeases:
+    def __init__(self, slots: int = INGEST_SLOTS, ttl: float = INGEST_LEASE_TTL_S,
+                 defer_s: float = INGEST_DEFER_S, redis_url: Optional[str] = ADMISSION_REDIS_URL):
+        self.slots = max(1, slots)
+        self.ttl = ttl
+        self.defer_s = defer_s
+        self._backend = None
+        if redis_url and redis is not None:
+            try:
+                self._backend = _RedisLeases(redis_url)
+            except ValueError as e:
+                # e.g. an amqp:// broker URL picked up as the default
+                logger.warning("ADMISSION_REDIS_URL is not a Redis URL (%s); using local ingest leases", e)
+        elif redis_url:
+            logger.warning("ADMISSION_REDIS_URL set but redis is not installed; using local ingest leases")
+        if self._backend is None:
+            self._backend = _LocalLeases()
+
+    def acquire(self, tenant: str, lease_id: str) -> bool:
+        """True if `tenant` is within its fair share of ingest slots."""
+        # a deferred tenant stays "active" until its retry comes back round
+        return self._backend.acquire(tenant, lease_id, self.slots, self.ttl, self.defer_s * 3)
+
+    def release(self, tenant: str, lease_id: str):
+        self._backend.release(tenant, lease_id)
+
+    def defer_countdown(self) -> float:
+        # jitter so deferred tasks don't come back in lockstep
+        return self.defer_s * (1 + random.random())
+
+
+ingest_leases = IngestLeases()
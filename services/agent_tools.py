@@ -1,41 +1,212 @@
 # services/agent_tools.py
 
-from openai import OpenAI
 import os
-from services.embeddings import chunk_text
-from services.vector_adapter import adapter
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from services.embeddings import embed_text, embed_texts
+from services.doc_routing import search, cache_filter
+from services.chunk_store import texts_for_matches
+from services.answer_cache import answer_cache
+from services.rate_limiter import limiter, completion_tokens, INTERACTIVE
+from services.http_transport import get_openai
 from dotenv import load_dotenv
 load_dotenv()
 
-async def query_user_documents(user_id: str, query: str, top_k: int = 5):
+logger = logging.getLogger(__name__)
+
+AGENT_MODEL = os.getenv("AGENT_MODEL", "gpt-5.1")
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "4"))
+AGENT_TOKEN_BUDGET = int(os.getenv("AGENT_TOKEN_BUDGET", "30000"))
+AGENT_MAX_TOP_K = int(os.getenv("AGENT_MAX_TOP_K", "10"))
+
+
+async def search_documents(user_id: str, qvec: List[float], top_k: int = 5,
+                           file_ids: Optional[List[str]] = None) -> List[dict]:
+    """Top-k chunks for an already embedded query, optionally limited to some files.
+    Unlimited searches are routed to the closest documents first."""
+    flt = cache_filter(file_ids)
+    version = answer_cache.version(user_id)
+    matches = answer_cache.get_retrieval(user_id, version, qvec, top_k, flt)
+    if matches is None:
+        matches, _ = await search(user_id, qvec, top_k, file_ids)
+        matches = answer_cache.put_retrieval(user_id, version, qvec, top_k, flt, matches)
+    texts = await asyncio.to_thread(texts_for_matches, user_id, matches)
+    hits = []
+    for item in matches:
+        meta = item["metadata"] or {}
+        text = texts.get(item["id"]) or meta.get("excerpt")
+        if text:
+            hits.append({
+                "id": item["id"],
+                "score": item["score"],
+                "file_id": meta.get("file_id"),
+                "file_name": meta.get("file_name") or meta.get("filename"),
+                "text": text,
+            })
+    return hits
+
+
+async def query_user_documents(user_id: str, query: str, top_k: int = 5, file_ids: Optional[List[str]] = None):
     # 1️⃣ Embed the query
-    qvec = (await chunk_text([query]))[0]
+    qvec = await asyncio.to_thread(embed_text, query)
+
+    # 2️⃣ Query vector DB for top relevant chunks, 3️⃣ fetch their text
+    hits = await search_documents(user_id, qvec, top_k=top_k, file_ids=file_ids)
+    return [h["text"] for h in hits]
+
+
+QUERY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "query_user_documents",
+        "description": (
+            "Semantic search over the user's uploaded documents. Returns the most relevant "
+            "chunks with their file name and file_id. Issue several calls in one turn to "
+            "search different sub-questions at once; pass file_ids to search only those files."
+        ),
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "What to search for."},
+                "file_ids": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Optional: only search these files.",
+                },
+                "top_k": {"type": "integer", "description": "Number of chunks, default 5."},
+            },
+            "required": ["query"],
+        },
+    },
+}
+
+NO_ANSWER = "I don't see this in uploaded documents."
+AGENT_SYSTEM_PROMPT = (
+    "You answer questions about the user's uploaded documents. Use the query_user_documents "
+    "tool to find evidence; when a question has several parts, call the tool for each part "
+    "in the same turn. Answer only from retrieved content. If the answer is not present, "
+    f"say \"{NO_ANSWER}\" Answer concisely without markdown."
+)
+
+
+class _ToolCache:
+    """Tool results for one agent run, so repeated sub-queries cost nothing."""
+
+    def __init__(self):
+        self._hits: Dict[Tuple, List[dict]] = {}
+
+    @staticmethod
+    def key(args: dict) -> Tuple:
+        return (
+            " ".join(str(args.get("query", "")).lower().split()),
+            tuple(sorted(args.get("file_ids") or [])),
+            args["top_k"],
+        )
+
+    async def run(self, user_id: str, calls: List[dict]) -> List[List[dict]]:
+        """Run one turn's tool calls: one embeddings request for every uncached
+        query, then all Pinecone searches concurrently."""
+        keys = [self.key(c) for c in calls]
+        todo = {}
+        for k, c in zip(keys, calls):
+            if not c["query"]:
+                self._hits[k] = []
+            elif k not in self._hits and k not in todo:
+                todo[k] = c
+        if todo:
+            pending = list(todo.items())
+            vecs = await asyncio.to_thread(embed_texts, [c["query"] for _, c in pending], INTERACTIVE)
+            results = await asyncio.gather(*[
+                search_documents(user_id, v, top_k=c["top_k"], file_ids=c.get("file_ids"))
+                for (_, c), v in zip(pending, vecs)
+            ])
+            for (k, _), hits in zip(pending, results):
+                self._hits[k] = hits
+        return [self._hits[k] for k in keys]
+
+
+def _parse_args(raw: str) -> dict:
+    try:
+        args = json.loads(raw or "{}")
+    except ValueError:
+        args = {}
+    if not isinstance(args, dict):
+        args = {}
+    try:
+        top_k = int(args.get("top_k") or 5)
+    except (TypeError, ValueError):
+        top_k = 5
+    args["top_k"] = max(1, min(top_k, AGENT_MAX_TOP_K))
+    args["query"] = str(args.get("query") or "")
+    return args
+
+
+def _format_hits(hits: List[dict]) -> str:
+    return json.dumps([
+        {"file_name": h["file_name"], "file_id": h["file_id"], "text": h["text"]} for h in hits
+    ])
+
+
+openai = get_openai()
 
-    # 2️⃣ Query vector DB for top relevant chunks
-    res = await adapter.query(namespace=user_id, vector=qvec, top_k=top_k)
 
-    # 3️⃣ Fetch actual text content if needed
-    documents = []
-    for item in res["matches"]:
-        # item["metadata"] contains storage_ref, chunk_index, excerpt
-        documents.append(item["metadata"]["excerpt"])
-    return documents
+async def run_agent(user_id: str, question: str, max_steps: int = AGENT_MAX_STEPS,
+                    token_budget: int = AGENT_TOKEN_BUDGET, file_ids: Optional[List[str]] = None) -> dict:
+    """Tool-calling loop over query_user_documents.
 
+    Each turn the model may request several searches; they are embedded in a
+    single request and run concurrently, so a multi-hop question costs about
+    one round-trip per hop. Stops after `max_steps` turns or once
+    `token_budget` total tokens are spent, then forces a final answer.
+    """
+    messages = [
+        {"role": "system", "content": AGENT_SYSTEM_PROMPT},
+        {"role": "user", "content": question},
+    ]
+    if file_ids:
+        messages.append({"role": "system", "content": f"Only search these file_ids: {json.dumps(file_ids)}"})
 
+    cache = _ToolCache()
+    tokens_used = 0
+    searches = 0
 
+    for step in range(max_steps + 1):
+        final_turn = step == max_steps or tokens_used >= token_budget
+        response = await limiter.acall(
+            openai.chat.completions.create,
+            model=AGENT_MODEL,
+            messages=messages,
+            tools=[QUERY_TOOL],
+            tool_choice="none" if final_turn else "auto",
+            parallel_tool_calls=True,
+            priority=INTERACTIVE,
+            tokens=completion_tokens(messages),
+        )
+        if response.usage:
+            tokens_used += response.usage.total_tokens
+        msg = response.choices[0].message
+        if final_turn or not msg.tool_calls:
+            # content is None on tool-call turns, and on refusals / filtered output
+            answer = msg.content if msg.content is not None else getattr(msg, "refusal", None) or NO_ANSWER
+            return {"answer": answer, "steps": step + 1, "searches": searches, "tokens": tokens_used}
 
+        turn = msg.model_dump(exclude_none=True)
+        # assistant tool-call turns carry no text; send an explicit null
+        turn["content"] = msg.content
+        messages.append(turn)
+        calls = [_parse_args(tc.function.arguments) for tc in msg.tool_calls]
+        if file_ids:
+            # the client pinned files; the model can narrow but not widen them
+            for c in calls:
+                c["file_ids"] = [f for f in (c.get("file_ids") or file_ids) if f in file_ids] or list(file_ids)
+        results = await cache.run(user_id, calls)
+        searches += len(calls)
+        for tc, hits in zip(msg.tool_calls, results):
+            messages.append({"role": "tool", "tool_call_id": tc.id, "content": _format_hits(hits)})
 
-openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 async def agent_answer(user_id: str, question: str):
-    docs = await query_user_documents(user_id, question, top_k=5)
-    context = "\n\n".join(docs)
-
-    # Pass context + question to your LLM
-    prompt = f"Context:\n{context}\n\nQuestion: {question}"
-    response = await openai.chat.completions.create(
-        model="gpt-5.1",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
-    return response.choices[0].message.content
+    result = await run_agent(user_id, question)
+    return result["answer"]
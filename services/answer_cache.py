@@ -0,0 +1,269 @@
+# back_end/services/answer_cache.py
+"""
+Retrieval + answer cache with exact per-namespace invalidation.
+
+Two levels:
+- retrieval: (namespace, query embedding hash, top_k, filter) -> matches
+- answers:   (namespace, normalized question, prompt version) -> answer
+
+Every key includes the namespace's current version. Every ingest / delete
+path calls `bump(namespace)`, so entries from before a change are simply
+never looked up again (they age out of the LRU / Redis TTL). No TTL guessing
+about freshness.
+
+CACHE_BACKEND=memory keeps everything in-process, so a bump in one uvicorn
+or Celery worker is invisible to the others. Its entries therefore expire
+after CACHE_MEMORY_TTL_S, which bounds how long another process can serve a
+stale answer. Use CACHE_BACKEND=redis whenever more than one process serves
+or ingests (several uvicorn workers, Celery); versions are then shared and
+the long CACHE_TTL_S only garbage-collects old versions.
+
+Pinecone is eventually consistent: a query right after an upsert can miss
+the new vectors. Nothing is cached for CACHE_BUMP_GRACE_S after a bump, so
+such pre-consistency results never land under the new version.
+"""
+import os
+import json
+import struct
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", os.getenv("CELERY_BROKER_URL", ""))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# only garbage-collects entries of old versions; never needed for freshness
+CACHE_TTL_S = int(os.getenv("CACHE_TTL_S", str(7 * 24 * 3600)))
+# memory backend only: bounds staleness across processes that share no versions
+CACHE_MEMORY_TTL_S = int(os.getenv("CACHE_MEMORY_TTL_S", "60"))
+# no puts this long after a bump, while the index catches up with the upsert
+CACHE_BUMP_GRACE_S = float(os.getenv("CACHE_BUMP_GRACE_S", "10"))
+CACHE_PREFIX = "qa_cache"
+
+
+class MemoryBackend:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_MEMORY_TTL_S):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._versions = {}
+        self._bumped_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if time.monotonic() >= expires:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def version(self, namespace: str) -> int:
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def bumped_at(self, namespace: str) -> float:
+        with self._lock:
+            return self._bumped_at.get(namespace, 0.0)
+
+    def bump(self, namespace: str) -> int:
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            self._bumped_at[namespace] = time.time()
+            return self._versions[namespace]
+
+
+class RedisBackend:
+    def __init__(self, url: str = CACHE_REDIS_URL, ttl: int = CACHE_TTL_S):
+        self._r = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._r.get(f"{CACHE_PREFIX}:{key}")
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str):
+        self._r.set(f"{CACHE_PREFIX}:{key}", value, ex=self.ttl)
+
+    def version(self, namespace: str) -> int:
+        value = self._r.get(f"{CACHE_PREFIX}:version:{namespace}")
+        return int(value) if value is not None else 0
+
+    def bumped_at(self, namespace: str) -> float:
+        value = self._r.get(f"{CACHE_PREFIX}:bumped_at:{namespace}")
+        return float(value) if value is not None else 0.0
+
+    def bump(self, namespace: str) -> int:
+        pipe = self._r.pipeline()
+        pipe.incr(f"{CACHE_PREFIX}:version:{namespace}")
+        pipe.set(f"{CACHE_PREFIX}:bumped_at:{namespace}", time.time(), ex=self.ttl)
+        return int(pipe.execute()[0])
+
+
+def embedding_hash(vector: List[float]) -> str:
+    # half precision, so float noise between identical embedding calls
+    # still maps to the same key
+    return hashlib.sha256(struct.pack(f"{len(vector)}e", *vector)).hexdigest()
+
+
+def normalize_question(question: Any) -> str:
+    if not isinstance(question, str):
+        question = json.dumps(question, sort_keys=True)
+    return " ".join(question.lower().split())
+
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _plain_match(m) -> dict:
+    return {"id": m["id"], "score": m["score"], "metadata": dict(m["metadata"] or {})}
+
+
+class AnswerCache:
+    def __init__(self, backend, bump_grace_s: float = CACHE_BUMP_GRACE_S):
+        self.backend = backend
+        self.bump_grace_s = bump_grace_s
+        self._lock = threading.Lock()
+        self.stats = {"retrieval_hits": 0, "retrieval_misses": 0, "answer_hits": 0, "answer_misses": 0,
+                      "bumps": 0, "settling_skips": 0, "errors": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    # The cache must never break a request; backend errors count as misses.
+    def _get(self, key: str) -> Optional[str]:
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Cache get failed: %s", e)
+            return None
+
+    def _settled(self, namespace: str) -> bool:
+        """False within bump_grace_s of the last bump, when the index may not show the change yet."""
+        if self.bump_grace_s <= 0:
+            return True
+        try:
+            settled = time.time() - self.backend.bumped_at(namespace) >= self.bump_grace_s
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Cache bump time lookup failed: %s", e)
+            return False
+        if not settled:
+            self._count("settling_skips")
+        return settled
+
+    def _set(self, key: str, value: str):
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Cache set failed: %s", e)
+
+    def version(self, namespace: str) -> int:
+        try:
+            return self.backend.version(namespace)
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Cache version lookup failed: %s", e)
+            return -1
+
+    def bump(self, namespace: str):
+        """Invalidate everything cached for `namespace`. Call after any change to its vectors."""
+        try:
+            self.backend.bump(namespace)
+            self._count("bumps")
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Cache version bump failed for %s: %s", namespace, e)
+
+    # ---- retrieval ----
+
+    def _retrieval_key(self, namespace: str, version: int, vector: List[float], top_k: int,
+                       filter: Optional[dict]) -> str:
+        return f"r:{namespace}:{version}:{_digest(embedding_hash(vector), top_k, filter)}"
+
+    def get_retrieval(self, namespace: str, version: int, vector: List[float], top_k: int,
+                      filter: Optional[dict] = None) -> Optional[List[dict]]:
+        if version < 0:
+            return None
+        value = self._get(self._retrieval_key(namespace, version, vector, top_k, filter))
+        self._count("retrieval_hits" if value is not None else "retrieval_misses")
+        return json.loads(value) if value is not None else None
+
+    def put_retrieval(self, namespace: str, version: int, vector: List[float], top_k: int,
+                      filter: Optional[dict], matches) -> List[dict]:
+        """Store matches; returns them as plain dicts (the cached shape)."""
+        plain = [_plain_match(m) for m in matches]
+        if version >= 0 and self._settled(namespace):
+            self._set(self._retrieval_key(namespace, version, vector, top_k, filter), json.dumps(plain))
+        return plain
+
+    # ---- answers ----
+
+    def _answer_key(self, namespace: str, version: int, question: Any, prompt_version: str) -> str:
+        return f"a:{namespace}:{version}:{_digest(normalize_question(question), prompt_version)}"
+
+    def get_answer(self, namespace: str, version: int, question: Any, prompt_version: str) -> Optional[str]:
+        if version < 0:
+            return None
+        value = self._get(self._answer_key(namespace, version, question, prompt_version))
+        self._count("answer_hits" if value is not None else "answer_misses")
+        return value
+
+    def put_answer(self, namespace: str, version: int, question: Any, prompt_version: str, answer: str):
+        if version >= 0 and answer and self._settled(namespace):
+            self._set(self._answer_key(namespace, version, question, prompt_version), answer)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            s = dict(self.stats)
+        for level in ("retrieval", "answer"):
+            total = s[f"{level}_hits"] + s[f"{level}_misses"]
+            s[f"{level}_hit_rate"] = round(s[f"{level}_hits"] / total, 3) if total else 0.0
+        s["backend"] = type(self.backend).__name__
+        return s
+
+
+def _make_backend():
+    if CACHE_BACKEND == "redis":
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis but the redis package is not installed")
+        return RedisBackend()
+    if CACHE_BACKEND != "memory":
+        raise RuntimeError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND}")
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        logger.warning("CACHE_BACKEND=memory with WEB_CONCURRENCY>1: bumps are per process, "
+                       "answers may be up to %ss stale; use CACHE_BACKEND=redis", CACHE_MEMORY_TTL_S)
+    return MemoryBackend()
+
+
+answer_cache = AnswerCache(_make_backend())
+
+
+def prompt_version(*parts: str) -> str:
+    """Short fingerprint of everything that shapes an answer besides the context."""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:12]
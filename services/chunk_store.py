@@ -0,0 +1,158 @@
+# back_end/services/chunk_store.py
+"""
+Chunk text store keyed by (namespace, chunk_id).
+
+Pinecone vectors only carry small metadata (file name, offsets, ...); the
+chunk text itself lives here and is bulk-fetched for the top-k ids after a
+query. Backends:
+
+- sqlite (default): a local file, fine for a single host running API +
+  Celery. CHUNK_STORE_PATH sets the location.
+- supabase: a shared `chunk_texts` table for multi-host deployments:
+
+    create table chunk_texts (
+        namespace text not null,
+        chunk_id  text not null,
+        text      text not null,
+        primary key (namespace, chunk_id)
+    );
+"""
+import os
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STORE_BACKEND = os.getenv("CHUNK_STORE_BACKEND", "sqlite")
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", "data/chunk_texts.sqlite3")
+CHUNK_STORE_TABLE = os.getenv("CHUNK_STORE_TABLE", "chunk_texts")
+
+# sqlite's default limit on bound parameters is 999 on older builds
+_SQLITE_BATCH = 500
+_SUPABASE_BATCH = 200
+
+
+class SQLiteChunkStore:
+    def __init__(self, path: str = CHUNK_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_texts ("
+            " namespace TEXT NOT NULL,"
+            " chunk_id TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " PRIMARY KEY (namespace, chunk_id)"
+            ") WITHOUT ROWID"
+        )
+
+    def put_many(self, namespace: str, texts: Dict[str, str]):
+        rows = [(namespace, cid, t) for cid, t in texts.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunk_texts (namespace, chunk_id, text) VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_many(self, namespace: str, ids: Iterable[str]) -> Dict[str, str]:
+        ids = list(ids)
+        out = {}
+        with self._lock:
+            for i in range(0, len(ids), _SQLITE_BATCH):
+                batch = ids[i:i+_SQLITE_BATCH]
+                marks = ",".join("?" * len(batch))
+                cur = self._conn.execute(
+                    f"SELECT chunk_id, text FROM chunk_texts WHERE namespace = ? AND chunk_id IN ({marks})",
+                    [namespace, *batch],
+                )
+                out.update(cur.fetchall())
+        return out
+
+    def delete_many(self, namespace: str, ids: Iterable[str]):
+        ids = list(ids)
+        with self._lock:
+            for i in range(0, len(ids), _SQLITE_BATCH):
+                batch = ids[i:i+_SQLITE_BATCH]
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(
+                    f"DELETE FROM chunk_texts WHERE namespace = ? AND chunk_id IN ({marks})",
+                    [namespace, *batch],
+                )
+
+
+class SupabaseChunkStore:
+    def __init__(self, table: str = CHUNK_STORE_TABLE):
+        from services.http_transport import get_supabase
+        self.table = table
+        self._sb = get_supabase()
+
+    def put_many(self, namespace: str, texts: Dict[str, str]):
+        rows = [{"namespace": namespace, "chunk_id": cid, "text": t} for cid, t in texts.items()]
+        for i in range(0, len(rows), _SUPABASE_BATCH):
+            self._sb.table(self.table).upsert(rows[i:i+_SUPABASE_BATCH]).execute()
+
+    def get_many(self, namespace: str, ids: Iterable[str]) -> Dict[str, str]:
+        ids = list(ids)
+        out = {}
+        for i in range(0, len(ids), _SUPABASE_BATCH):
+            res = (
+                self._sb.table(self.table)
+                .select("chunk_id, text")
+                .eq("namespace", namespace)
+                .in_("chunk_id", ids[i:i+_SUPABASE_BATCH])
+                .execute()
+            )
+            out.update({r["chunk_id"]: r["text"] for r in (res.data or [])})
+        return out
+
+    def delete_many(self, namespace: str, ids: Iterable[str]):
+        ids = list(ids)
+        for i in range(0, len(ids), _SUPABASE_BATCH):
+            (
+                self._sb.table(self.table)
+                .delete()
+                .eq("namespace", namespace)
+                .in_("chunk_id", ids[i:i+_SUPABASE_BATCH])
+                .execute()
+            )
+
+
+def _make_store():
+    if CHUNK_STORE_BACKEND == "supabase":
+        return SupabaseChunkStore()
+    if CHUNK_STORE_BACKEND != "sqlite":
+        raise RuntimeError(f"Unknown CHUNK_STORE_BACKEND: {CHUNK_STORE_BACKEND}")
+    return SQLiteChunkStore()
+
+
+chunk_store = _make_store()
+
+
+def texts_for_matches(namespace: str, matches: List[dict]) -> Dict[str, str]:
+    """Chunk text for each match id in one bulk fetch.
+
+    Vectors ingested before the store existed still have the text in their
+    metadata; those are used as-is.
+    """
+    out = {}
+    missing = []
+    for m in matches:
+        legacy = (m.get("metadata") or {}).get("text")
+        if legacy:
+            out[m["id"]] = legacy
+        else:
+            missing.append(m["id"])
+    if missing:
+        out.update(chunk_store.get_many(namespace, missing))
+    return out
@@ -1,6 +1,6 @@
 # back_end/services/chunker.py
 import os
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 from datetime import datetime
 import hashlib
 
@@ -20,37 +20,85 @@ def _count_tokens(text: str) -> int:
 
 def chunk_text_by_tokens(text: str, chunk_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[Tuple[str, int, int]]:
     """Return list of tuples: (chunk_text, start_token_index, end_token_index)"""
+    return list(iter_chunks_by_tokens(text, chunk_tokens, overlap))
+
+def iter_chunks_by_tokens(text: str, chunk_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> Iterator[Tuple[str, int, int]]:
+    """Same chunks as chunk_text_by_tokens, yielded one at a time so callers
+    can start embedding before the whole document has been decoded."""
     if not text:
-        return []
+        return
 
     if TOKEN_ENCODER:
         tokens = TOKEN_ENCODER.encode(text)
         n = len(tokens)
-        chunks = []
         start = 0
         while start < n:
             end = min(start + chunk_tokens, n)
             chunk_tokens_list = tokens[start:end]
             chunk_text = TOKEN_ENCODER.decode(chunk_tokens_list)
-            chunks.append((chunk_text, start, end))
+            yield (chunk_text, start, end)
             if end == n:
                 break
             start = end - overlap
-        return chunks
+        return
 
     # fallback: split by paragraphs
     paras = [p for p in text.split("\n\n") if p.strip()]
-    chunks = []
     buffer = ""
     for p in paras:
         if _count_tokens(buffer + " " + p) <= chunk_tokens or not buffer:
             buffer = (buffer + "\n\n" + p).strip()
         else:
-            chunks.append((buffer, 0, 0))
+            yield (buffer, 0, 0)
             buffer = p
     if buffer:
-        chunks.append((buffer, 0, 0))
-    return chunks
+        yield (buffer, 0, 0)
+
+def iter_chunks_from_sections(sections: Iterable[Tuple[str, str]], chunk_tokens: int = CHUNK_TOKENS,
+                              overlap: int = CHUNK_OVERLAP) -> Iterator[Tuple[str, int, int, str]]:
+    """Chunk a stream of (section_text, locator) records as they arrive.
+
+    Sections are joined with blank lines, as in the full-text path, and chunks
+    may span sections. Yields (chunk_text, start_token, end_token, locator)
+    where locator names the section(s) the chunk came from, e.g. "page 3" or
+    "page 3 - page 4".
+    """
+    if not TOKEN_ENCODER:
+        # no tokenizer: fall back to paragraph chunking of the joined text
+        joined = "\n\n".join(t for t, _ in sections if t and t.strip())
+        for chunk_text, start, end in iter_chunks_by_tokens(joined, chunk_tokens, overlap):
+            yield (chunk_text, start, end, "")
+        return
+
+    sep = TOKEN_ENCODER.encode("\n\n")
+    step = max(1, chunk_tokens - overlap)
+    buf: List[int] = []
+    base = 0          # global token index of buf[0]
+    marks = []        # (global token index where a section starts, locator)
+
+    def emit(n: int):
+        start, end = base, base + n
+        locs = [loc for i, (pos, loc) in enumerate(marks)
+                if pos < end and (i + 1 == len(marks) or marks[i + 1][0] > start)]
+        label = locs[0] if len(locs) <= 1 or locs[0] == locs[-1] else f"{locs[0]} - {locs[-1]}"
+        return (TOKEN_ENCODER.decode(buf[:n]), start, end, label)
+
+    for text, locator in sections:
+        if not text or not text.strip():
+            continue
+        if buf or base:
+            buf.extend(sep)
+        marks.append((base + len(buf), locator))
+        buf.extend(TOKEN_ENCODER.encode(text))
+        # emit only when strictly over, so the last chunk is never a pure overlap
+        while len(buf) > chunk_tokens:
+            yield emit(chunk_tokens)
+            del buf[:step]
+            base += step
+            while len(marks) > 1 and marks[1][0] <= base:
+                marks.pop(0)
+    if buf:
+        yield emit(len(buf))
 
 def compute_chunk_hash(file_id: str, start: int, end: int) -> str:
     h = hashlib.sha256()
@@ -0,0 +1,270 @@
+# back_end/services/dedup.py
+"""
+Near-duplicate chunk detection between chunking and embedding.
+
+Every chunk gets a MinHash signature over word 3-shingles (DEDUP_NUM_PERM
+permutations). LSH banding finds candidates, and a candidate counts as a
+duplicate when the estimated Jaccard similarity is at least
+DEDUP_THRESHOLD. Repeated headers, footers, disclaimers and template pages
+then cost one embedding instead of one per copy.
+
+- Within a document, the first copy is canonical. With DEDUP_MODE=skip
+  (default) later copies are not stored at all. With DEDUP_MODE=reuse they
+  are stored under their own id with the canonical chunk's vector.
+- Across the namespace (DEDUP_CROSS_NAMESPACE=1), signatures of stored
+  chunks are kept in a local SQLite table. A match reuses the vector
+  already in Pinecone (one fetch instead of an embedding). Such chunks are
+  always stored, never skipped, so deleting the other document doesn't
+  take them with it.
+
+DEDUP_MODE=off disables the stage.
+"""
+import os
+import re
+import math
+import struct
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEDUP_MODE = os.getenv("DEDUP_MODE", "skip")  # skip | reuse | off
+DEDUP_CROSS_NAMESPACE = os.getenv("DEDUP_CROSS_NAMESPACE", "0") == "1"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64"))
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "16"))
+DEDUP_STORE_PATH = os.getenv("DEDUP_STORE_PATH", "data/chunk_signatures.sqlite3")
+# same setting as services/embeddings.py, read here so dedup runs without an OpenAI client
+EMBED_BATCH = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+SHINGLE_WORDS = 3
+# candidates checked per chunk; the bands of boilerplate can match many chunks
+MAX_CANDIDATES = 50
+
+SCOPE_DOCUMENT = "document"
+SCOPE_NAMESPACE = "namespace"
+
+_PRIME = 4294967311  # smallest prime above 2**32
+_WORD = re.compile(r"\w+")
+_SIG = struct.Struct(f"!{DEDUP_NUM_PERM}Q")
+
+_rng = random.Random(1)
+# a < 2**32 keeps a * x + b inside uint64 for 32-bit shingle hashes
+_A = [_rng.randrange(1, 1 << 32) for _ in range(DEDUP_NUM_PERM)]
+_B = [_rng.randrange(0, _PRIME) for _ in range(DEDUP_NUM_PERM)]
+if np is not None:
+    _A_NP = np.array(_A, dtype=np.uint64)[:, None]
+    _B_NP = np.array(_B, dtype=np.uint64)[:, None]
+
+
+def _shingles(text: str) -> List[int]:
+    words = _WORD.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        grams = [" ".join(words)]
+    else:
+        grams = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    # stable across processes, unlike hash()
+    return [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "big") for g in grams]
+
+
+def minhash(text: str) -> Tuple[int, ...]:
+    hashes = _shingles(text)
+    if np is not None:
+        x = np.array(hashes, dtype=np.uint64)[None, :]
+        return tuple(int(v) for v in ((_A_NP * x + _B_NP) % _PRIME).min(axis=1))
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in zip(_A, _B))
+
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the shingle sets."""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def band_keys(sig: Sequence[int], bands: int = DEDUP_BANDS) -> List[str]:
+    packed = _SIG.pack(*sig)
+    width = len(sig) // bands * 8
+    return [
+        f"{i}:{hashlib.blake2b(packed[i * width:(i + 1) * width], digest_size=8).hexdigest()}"
+        for i in range(bands)
+    ]
+
+
+class SignatureStore:
+    """MinHash signatures of stored chunks per namespace (SQLite, one host)."""
+
+    def __init__(self, path: str = DEDUP_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_signatures ("
+            " namespace TEXT NOT NULL, chunk_id TEXT NOT NULL, sig BLOB NOT NULL,"
+            " PRIMARY KEY (namespace, chunk_id)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_bands ("
+            " namespace TEXT NOT NULL, band TEXT NOT NULL, chunk_id TEXT NOT NULL,"
+            " PRIMARY KEY (namespace, band, chunk_id)) WITHOUT ROWID"
+        )
+
+    def put_many(self, namespace: str, sigs: Dict[str, Tuple[int, ...]]):
+        if not sigs:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunk_signatures (namespace, chunk_id, sig) VALUES (?, ?, ?)",
+                    [(namespace, cid, _SIG.pack(*sig)) for cid, sig in sigs.items()],
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO chunk_bands (namespace, band, chunk_id) VALUES (?, ?, ?)",
+                    [(namespace, band, cid) for cid, sig in sigs.items() for band in band_keys(sig)],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def candidates(self, namespace: str, sig: Tuple[int, ...]) -> Dict[str, Tuple[int, ...]]:
+        bands = band_keys(sig)
+        marks = ",".join("?" * len(bands))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT s.chunk_id, s.sig FROM chunk_signatures s JOIN ("
+                f" SELECT DISTINCT chunk_id FROM chunk_bands WHERE namespace = ? AND band IN ({marks}) LIMIT ?"
+                f") b ON b.chunk_id = s.chunk_id WHERE s.namespace = ?",
+                [namespace, *bands, MAX_CANDIDATES, namespace],
+            ).fetchall()
+        return {cid: _SIG.unpack(blob) for cid, blob in rows}
+
+    def delete_many(self, namespace: str, ids: Iterable[str]):
+        rows = [(namespace, cid) for cid in ids]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("DELETE FROM chunk_signatures WHERE namespace = ? AND chunk_id = ?", rows)
+                self._conn.executemany("DELETE FROM chunk_bands WHERE namespace = ? AND chunk_id = ?", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+signature_store = SignatureStore() if DEDUP_CROSS_NAMESPACE else None
+
+
+class Deduper:
+    """Dedup state for one ingest: which chunks are new, skipped or reuse a vector."""
+
+    def __init__(self, namespace: str, mode: str = DEDUP_MODE, cross_namespace: bool = DEDUP_CROSS_NAMESPACE,
+                 threshold: float = DEDUP_THRESHOLD, store: Optional[SignatureStore] = None):
+        self.namespace = namespace
+        self.mode = mode
+        self.threshold = threshold
+        self.store = (store or signature_store) if cross_namespace and mode != "off" else None
+        self._bands: Dict[str, List[str]] = defaultdict(list)
+        self._sigs: Dict[str, Tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"chunks": 0, "embedded": 0, "skipped": 0, "reused_document": 0, "reused_namespace": 0,
+                      "embedding_requests": 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _best(self, sig: Tuple[int, ...], candidates: Dict[str, Tuple[int, ...]]) -> Optional[str]:
+        best, best_sim = None, self.threshold
+        for cid, other in candidates.items():
+            sim = similarity(sig, other)
+            if sim >= best_sim:
+                best, best_sim = cid, sim
+        return best
+
+    def check(self, chunk_id: str, text: str) -> Optional[Tuple[str, str]]:
+        """(canonical_id, scope) if `text` nearly duplicates an earlier chunk,
+        else None and the chunk becomes a canonical candidate itself.
+        Must be called in chunk order from one thread."""
+        self._count("chunks")
+        if self.mode == "off":
+            return None
+        sig = minhash(text)
+        bands = band_keys(sig)
+
+        local = {cid: self._sigs[cid] for b in bands for cid in self._bands.get(b, ())}
+        canonical = self._best(sig, local)
+        if canonical is not None:
+            return canonical, SCOPE_DOCUMENT
+
+        self._sigs[chunk_id] = sig
+        for b in bands:
+            self._bands[b].append(chunk_id)
+
+        if self.store is not None:
+            try:
+                canonical = self._best(sig, self.store.candidates(self.namespace, sig))
+            except Exception as e:
+                logger.warning("Signature lookup failed, embedding chunk: %s", e)
+                canonical = None
+            if canonical is not None and canonical != chunk_id:
+                return canonical, SCOPE_NAMESPACE
+        return None
+
+    def split(self, batch: List, make_id) -> Tuple[List[Tuple], List[Tuple]]:
+        """Split chunks into (new [(chunk, id)], reused [(chunk, id, canonical_id, scope)]).
+        Skipped duplicates are dropped."""
+        new, reused = [], []
+        for c in batch:
+            cid = make_id(c)
+            dup = self.check(cid, c[0])
+            if dup is None:
+                new.append((c, cid))
+            elif dup[1] == SCOPE_DOCUMENT and self.mode == "skip":
+                self._count("skipped")
+            else:
+                reused.append((c, cid, *dup))
+        return new, reused
+
+    def embedded(self, n: int):
+        self._count("embedded", n)
+        self._count("embedding_requests", math.ceil(n / EMBED_BATCH))
+
+    def reused(self, scope: str, n: int = 1):
+        self._count("reused_document" if scope == SCOPE_DOCUMENT else "reused_namespace", n)
+
+    def remember(self, ids: Iterable[str]):
+        """Make stored chunks available to later ingests in the namespace."""
+        if self.store is None:
+            return
+        sigs = {cid: self._sigs[cid] for cid in ids if cid in self._sigs}
+        try:
+            self.store.put_many(self.namespace, sigs)
+        except Exception as e:
+            logger.warning("Could not store chunk signatures: %s", e)
+
+    def report(self) -> dict:
+        with self._lock:
+            s = dict(self.stats)
+        saved = s["skipped"] + s["reused_document"] + s["reused_namespace"]
+        s["dedup_ratio"] = round(saved / s["chunks"], 3) if s["chunks"] else 0.0
+        s["embedding_inputs_saved"] = saved
+        s["embedding_requests_saved"] = max(0, math.ceil(s["chunks"] / EMBED_BATCH) - s["embedding_requests"])
+        return s
+
+
+def forget(namespace: str, ids: Iterable[str]):
+    """Drop signatures of deleted chunks."""
+    if signature_store is not None:
+        signature_store.delete_many(namespace, ids)
@@ -0,0 +1,184 @@
+# back_end/services/doc_routing.py
+"""
+Two-stage retrieval: route a query to its top documents, then search only
+their chunks.
+
+Every ingest keeps one summary vector per document (the normalized mean of
+its chunk vectors) in a side namespace, `<namespace>#docs`, with
+id = file_id. User ids may not contain "#" (middleware/auth.request_user),
+so it can't collide with a user's own namespace. A query first searches that
+namespace for the ROUTE_TOP_DOCS closest documents, then runs the chunk
+search with a `file_id $in [...]` filter. Tenants with no more documents
+than ROUTE_TOP_DOCS, or routed searches that come back short (e.g.
+documents ingested before summaries existed), fall back to the flat
+namespace search. Backfill those with
+
+    python -m services.doc_routing <namespace> [<namespace> ...]
+
+Callers can pin a question to specific files; pinned searches skip routing.
+"""
+import os
+import math
+import logging
+import argparse
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from services.pinecone_client import index
+from services.pinecone_adapter import adapter
+
+logger = logging.getLogger(__name__)
+
+# off by default: summary vectors are always stored, so routing can be
+# switched on per deployment once bench_routing shows it keeps recall
+DOC_ROUTING = os.getenv("DOC_ROUTING", "0") == "1"
+ROUTE_TOP_DOCS = int(os.getenv("ROUTE_TOP_DOCS", "8"))
+# user ids can't contain it, so no user namespace ends in DOC_NAMESPACE_SUFFIX
+NAMESPACE_SEP = "#"
+DOC_NAMESPACE_SUFFIX = f"{NAMESPACE_SEP}docs"
+
+
+def doc_namespace(namespace: str) -> str:
+    return f"{namespace}{DOC_NAMESPACE_SUFFIX}"
+
+
+def file_filter(file_ids: Optional[Iterable[str]]) -> Optional[dict]:
+    # sorted, so the same files give the same retrieval cache key
+    file_ids = sorted(set(file_ids or []))
+    return {"file_id": {"$in": file_ids}} if file_ids else None
+
+
+def cache_filter(file_ids: Optional[Iterable[str]] = None) -> dict:
+    """Retrieval cache filter for `search`: routed results depend on the
+    routing settings, so changing them doesn't serve stale matches."""
+    return file_filter(file_ids) or {"route_top_docs": ROUTE_TOP_DOCS if DOC_ROUTING else 0}
+
+
+class Centroid:
+    """Running sum of a document's chunk vectors."""
+
+    def __init__(self):
+        self.sum = None
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, vectors: Iterable[List[float]]):
+        vectors = list(vectors)
+        if not vectors:
+            return
+        with self._lock:
+            if np is not None:
+                total = np.asarray(vectors, dtype=np.float64).sum(axis=0)
+                self.sum = total if self.sum is None else self.sum + total
+            else:
+                if self.sum is None:
+                    self.sum = [0.0] * len(vectors[0])
+                for v in vectors:
+                    for i, x in enumerate(v):
+                        self.sum[i] += x
+            self.count += len(vectors)
+
+    def vector(self) -> Optional[List[float]]:
+        if not self.count:
+            return None
+        if np is not None:
+            return (self.sum / (np.linalg.norm(self.sum) or 1.0)).tolist()
+        norm = math.sqrt(sum(x * x for x in self.sum)) or 1.0
+        return [x / norm for x in self.sum]
+
+
+def upsert_centroid(namespace: str, file_id: str, centroid: Centroid, file_name: str = ""):
+    """Store the document's summary vector. A document with no chunks (e.g.
+    a replacement without text) loses the one a previous version left."""
+    vec = centroid.vector()
+    if vec is None:
+        delete_centroid(namespace, file_id)
+        return
+    index.upsert(
+        vectors=[{"id": file_id, "values": vec,
+                  "metadata": {"file_id": file_id, "file_name": file_name, "chunks": centroid.count}}],
+        namespace=doc_namespace(namespace),
+    )
+
+
+def delete_centroid(namespace: str, file_id: str):
+    try:
+        index.delete(ids=[file_id], namespace=doc_namespace(namespace))
+    except Exception as e:
+        logger.warning("Could not delete summary vector for %s: %s", file_id, e)
+
+
+def backfill_centroids(namespace: str, docs: Iterable[Tuple[str, str, List[str]]]) -> int:
+    """Summary vectors for documents ingested before routing existed.
+    `docs` yields (file_id, file_name, chunk_ids)."""
+    # ingest_pipeline imports this module
+    from services.ingest_pipeline import fetch_vectors
+    n = 0
+    for file_id, file_name, chunk_ids in docs:
+        centroid = Centroid()
+        centroid.add(fetch_vectors(namespace, list(chunk_ids)).values())
+        upsert_centroid(namespace, file_id, centroid, file_name)
+        n += bool(centroid.count)
+    return n
+
+
+def backfill_namespace(namespace: str) -> int:
+    """(Re)build the summary vector of every ready document in `namespace`
+    from the registry. Returns how many were stored."""
+    from services.document_registry import registry, STATUS_READY
+    docs = (
+        (d["file_id"], d.get("file_name") or "", registry.chunk_ids(namespace, d["file_id"]))
+        for d in registry.list(namespace) if d.get("status") == STATUS_READY
+    )
+    return backfill_centroids(namespace, docs)
+
+
+async def _query(namespace: str, vector: List[float], top_k: int, filter: Optional[dict] = None):
+    res = await adapter.query(namespace, vector, top_k, filter)
+    return res.get("matches", [])
+
+
+async def route(namespace: str, qvec: List[float], top_docs: int = ROUTE_TOP_DOCS) -> Optional[List[str]]:
+    """file_ids of the documents closest to the query, or None when routing
+    would not narrow the search (the tenant has no more than `top_docs`)."""
+    docs = await _query(doc_namespace(namespace), qvec, top_docs + 1)
+    if len(docs) <= top_docs:
+        return None
+    return [d["id"] for d in docs[:top_docs]]
+
+
+async def search(namespace: str, qvec: List[float], top_k: int, file_ids: Optional[List[str]] = None,
+                 routing: bool = DOC_ROUTING, top_docs: int = ROUTE_TOP_DOCS) -> Tuple[list, Dict]:
+    """Chunk matches for a query vector, plus how they were found:
+    {"mode": "pinned" | "routed" | "flat", "file_ids": [...]}."""
+    if file_ids:
+        matches = await _query(namespace, qvec, top_k, file_filter(file_ids))
+        return matches, {"mode": "pinned", "file_ids": list(file_ids)}
+    if routing:
+        try:
+            routed = await route(namespace, qvec, top_docs)
+        except Exception as e:
+            logger.warning("Document routing failed, searching the whole namespace: %s", e)
+            routed = None
+        if routed:
+            matches = await _query(namespace, qvec, top_k, file_filter(routed))
+            if len(matches) >= top_k:
+                return matches, {"mode": "routed", "file_ids": routed}
+    return await _query(namespace, qvec, top_k), {"mode": "flat", "file_ids": []}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Backfill document summary vectors from the registry")
+    ap.add_argument("namespaces", nargs="+", help="user namespaces to backfill")
+    args = ap.parse_args()
+    for namespace in args.namespaces:
+        print(f"{namespace}: {backfill_namespace(namespace)} summary vectors")
+
+
+if __name__ == "__main__":
+    main()
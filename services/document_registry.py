@@ -0,0 +1,226 @@
+# back_end/services/document_registry.py
+"""
+Document registry: which chunk ids belong to which file.
+
+Every ingest path records the document (name, storage path, content hash,
+ingest time) and the ids of the vectors it upserted, so a document can be
+listed, deleted or replaced with batched deletes instead of scanning the
+namespace. Backends mirror services/chunk_store.py: sqlite by default,
+Supabase tables when DOC_REGISTRY_BACKEND=supabase:
+
+    create table document_registry (
+        namespace    text not null,
+        file_id      text not null,
+        file_name    text,
+        storage_path text,
+        content_hash text,
+        status       text,
+        chunk_count  integer default 0,
+        created_at   timestamptz,
+        updated_at   timestamptz,
+        primary key (namespace, file_id)
+    );
+    create table document_chunks (
+        namespace text not null,
+        file_id   text not null,
+        chunk_id  text not null,
+        primary key (namespace, file_id, chunk_id)
+    );
+"""
+import os
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DOC_REGISTRY_BACKEND = os.getenv("DOC_REGISTRY_BACKEND", "sqlite")
+DOC_REGISTRY_PATH = os.getenv("DOC_REGISTRY_PATH", "data/document_registry.sqlite3")
+
+STATUS_INGESTING = "ingesting"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+_BATCH = 500
+# columns finish() may update
+_DOC_FIELDS = ("file_name", "storage_path", "content_hash")
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+class SQLiteDocumentRegistry:
+    def __init__(self, path: str = DOC_REGISTRY_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS document_registry ("
+            " namespace TEXT NOT NULL, file_id TEXT NOT NULL, file_name TEXT,"
+            " storage_path TEXT, content_hash TEXT, status TEXT,"
+            " chunk_count INTEGER DEFAULT 0, created_at TEXT, updated_at TEXT,"
+            " PRIMARY KEY (namespace, file_id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS document_chunks ("
+            " namespace TEXT NOT NULL, file_id TEXT NOT NULL, chunk_id TEXT NOT NULL,"
+            " PRIMARY KEY (namespace, file_id, chunk_id)) WITHOUT ROWID"
+        )
+
+    def begin(self, namespace: str, file_id: str, file_name: str, storage_path: Optional[str] = None,
+              content_hash: Optional[str] = None):
+        """Create or refresh the document row; existing chunk ids are kept."""
+        now = _now()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO document_registry (namespace, file_id, file_name, storage_path, content_hash,"
+                " status, chunk_count, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)"
+                " ON CONFLICT(namespace, file_id) DO UPDATE SET file_name=excluded.file_name,"
+                " storage_path=excluded.storage_path, content_hash=excluded.content_hash,"
+                " status=excluded.status, updated_at=excluded.updated_at",
+                (namespace, file_id, file_name, storage_path, content_hash, STATUS_INGESTING, now, now),
+            )
+
+    def add_chunks(self, namespace: str, file_id: str, chunk_ids: Iterable[str]):
+        rows = [(namespace, file_id, cid) for cid in chunk_ids]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO document_chunks (namespace, file_id, chunk_id) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def remove_chunks(self, namespace: str, file_id: str, chunk_ids: Iterable[str]):
+        ids = list(chunk_ids)
+        with self._lock:
+            for i in range(0, len(ids), _BATCH):
+                batch = ids[i:i+_BATCH]
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(
+                    f"DELETE FROM document_chunks WHERE namespace = ? AND file_id = ? AND chunk_id IN ({marks})",
+                    [namespace, file_id, *batch],
+                )
+
+    def finish(self, namespace: str, file_id: str, status: str = STATUS_READY, **fields):
+        """Set the final status and chunk count. `fields` (file_name,
+        storage_path, content_hash) replace the stored ones, e.g. once a
+        replacement version is ready."""
+        fields = {k: v for k, v in fields.items() if k in _DOC_FIELDS}
+        sets = "".join(f", {k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE document_registry SET status = ?, updated_at = ?{sets}, chunk_count = ("
+                " SELECT COUNT(*) FROM document_chunks WHERE namespace = ? AND file_id = ?)"
+                " WHERE namespace = ? AND file_id = ?",
+                (status, _now(), *fields.values(), namespace, file_id, namespace, file_id),
+            )
+
+    def get(self, namespace: str, file_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM document_registry WHERE namespace = ? AND file_id = ?", (namespace, file_id)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list(self, namespace: str) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM document_registry WHERE namespace = ? ORDER BY created_at", (namespace,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def chunk_ids(self, namespace: str, file_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM document_chunks WHERE namespace = ? AND file_id = ?", (namespace, file_id)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def delete(self, namespace: str, file_id: str):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM document_chunks WHERE namespace = ? AND file_id = ?", (namespace, file_id))
+            self._conn.execute("DELETE FROM document_registry WHERE namespace = ? AND file_id = ?", (namespace, file_id))
+            self._conn.execute("COMMIT")
+
+
+class SupabaseDocumentRegistry:
+    def __init__(self, docs_table: str = "document_registry", chunks_table: str = "document_chunks"):
+        from services.http_transport import get_supabase
+        self._sb = get_supabase()
+        self.docs_table = docs_table
+        self.chunks_table = chunks_table
+
+    def begin(self, namespace: str, file_id: str, file_name: str, storage_path: Optional[str] = None,
+              content_hash: Optional[str] = None):
+        now = _now()
+        row = {
+            "namespace": namespace, "file_id": file_id, "file_name": file_name,
+            "storage_path": storage_path, "content_hash": content_hash,
+            "status": STATUS_INGESTING, "updated_at": now,
+        }
+        if self.get(namespace, file_id) is None:
+            row["created_at"] = now
+            row["chunk_count"] = 0
+        self._sb.table(self.docs_table).upsert(row).execute()
+
+    def add_chunks(self, namespace: str, file_id: str, chunk_ids: Iterable[str]):
+        rows = [{"namespace": namespace, "file_id": file_id, "chunk_id": cid} for cid in chunk_ids]
+        for i in range(0, len(rows), _BATCH):
+            self._sb.table(self.chunks_table).upsert(rows[i:i+_BATCH]).execute()
+
+    def remove_chunks(self, namespace: str, file_id: str, chunk_ids: Iterable[str]):
+        ids = list(chunk_ids)
+        for i in range(0, len(ids), _BATCH):
+            (
+                self._sb.table(self.chunks_table).delete()
+                .eq("namespace", namespace).eq("file_id", file_id)
+                .in_("chunk_id", ids[i:i+_BATCH]).execute()
+            )
+
+    def finish(self, namespace: str, file_id: str, status: str = STATUS_READY, **fields):
+        count = len(self.chunk_ids(namespace, file_id))
+        fields = {k: v for k, v in fields.items() if k in _DOC_FIELDS}
+        (
+            self._sb.table(self.docs_table)
+            .update({"status": status, "chunk_count": count, "updated_at": _now(), **fields})
+            .eq("namespace", namespace).eq("file_id", file_id).execute()
+        )
+
+    def get(self, namespace: str, file_id: str) -> Optional[dict]:
+        res = (
+            self._sb.table(self.docs_table).select("*")
+            .eq("namespace", namespace).eq("file_id", file_id).execute()
+        )
+        return res.data[0] if res.data else None
+
+    def list(self, namespace: str) -> List[dict]:
+        res = self._sb.table(self.docs_table).select("*").eq("namespace", namespace).order("created_at").execute()
+        return res.data or []
+
+    def chunk_ids(self, namespace: str, file_id: str) -> List[str]:
+        res = (
+            self._sb.table(self.chunks_table).select("chunk_id")
+            .eq("namespace", namespace).eq("file_id", file_id).execute()
+        )
+        return [r["chunk_id"] for r in (res.data or [])]
+
+    def delete(self, namespace: str, file_id: str):
+        self._sb.table(self.chunks_table).delete().eq("namespace", namespace).eq("file_id", file_id).execute()
+        self._sb.table(self.docs_table).delete().eq("namespace", namespace).eq("file_id", file_id).execute()
+
+
+def _make_registry():
+    if DOC_REGISTRY_BACKEND == "supabase":
+        return SupabaseDocumentRegistry()
+    if DOC_REGISTRY_BACKEND != "sqlite":
+        raise RuntimeError(f"Unknown DOC_REGISTRY_BACKEND: {DOC_REGISTRY_BACKEND}")
+    return SQLiteDocumentRegistry()
+
+
+registry = _make_registry()
@@ -1,24 +1,28 @@
 import tiktoken
-from openai import OpenAI
 from services.pinecone_client import index
+from services.chunk_store import chunk_store
+from services.document_registry import registry, STATUS_READY
+from services.answer_cache import answer_cache
 import uuid
-import os, time
+import os
 from dotenv import load_dotenv
 from typing import List
 import logging
+from services.rate_limiter import limiter, INTERACTIVE, BATCH
+from services.http_transport import get_openai
+from services.log_pipeline import log_event
 
 
 
 load_dotenv()
-client = OpenAI()
+client = get_openai()
 embedding_model = os.getenv("EMBEDDING_MODEL")
-BATCH = int(os.getenv("EMBED_BATCH_SIZE", "64"))
-logging.basicConfig(level=logging.INFO)
+EMBED_BATCH = int(os.getenv("EMBED_BATCH_SIZE", "64"))
 logger = logging.getLogger(__name__)
 
 
-def embed_text(text: str, file_name: str = "") -> List[float]:
-    response =client.embeddings.create(model=embedding_model, input=text)
+def embed_text(text: str, file_name: str = "", priority: str = INTERACTIVE) -> List[float]:
+    response = limiter.embeddings(client, embedding_model, text, priority=priority)
     return response.data[0].embedding
 
 
@@ -26,7 +30,7 @@ def create_embeddings(chunks: list[str]):
     embeddings = []
 
     for chunk in chunks:
-        emb = embed_text(chunk)
+        emb = embed_text(chunk, priority=BATCH)
         embeddings.append(emb)
 
     return embeddings
@@ -44,19 +48,18 @@ def chunk_text(text: str, max_tokens=400):
     return chunks
 
 def store_chunks_in_pinecone(chunks, file_name, user_id, doc_name):
+    registry.begin(user_id, doc_name, file_name)
     for chunk in chunks:
         emb = create_embeddings(chunk)
         vector_id = str(uuid.uuid4())
 
-    print("Embedding length:", len(emb))
-    print("Upserting into Pinecone...")
-
+    chunk_store.put_many(user_id, {vector_id: chunk})
+    registry.add_chunks(user_id, doc_name, [vector_id])
     response = index.upsert(
                     vectors=[
                         {"id": vector_id,
                         "values": emb,
-                        "metadata": {"text": chunk,
-                                     "file_name": file_name}
+                        "metadata": {"file_name": file_name}
                         }],
                     namespace=user_id  
                     )
@@ -65,23 +68,18 @@ def store_chunks_in_pinecone(chunks, file_name, user_id, doc_name):
 
 
 
-    print("Pinecone upsert response:", response)
+    log_event(logger, "chunk_upserted", file_name=file_name, vector_id=vector_id, dims=len(emb),
+              upserted=getattr(response, "upserted_count", None))
+    registry.finish(user_id, doc_name, STATUS_READY)
+    answer_cache.bump(user_id)
 
     return {"status": "chunks_stored"}, logger.info(f"Stored {len(chunks)} chunks for document {doc_name}")
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
-    """Batch texts -> embeddings (simple batching + retry)"""
+def embed_texts(texts: List[str], priority: str = BATCH) -> List[List[float]]:
+    """Batch texts -> embeddings (batching; rate limits + retry in the shared limiter)"""
     out = []
-    for i in range(0, len(texts), BATCH):
-        batch = texts[i:i+BATCH]
-        for attempt in range(3):
-            try:
-                resp = client.embeddings.create(model=embedding_model, input=batch)
-                out.extend([d["embedding"] for d in resp["data"]])
-                break
-            except Exception as e:
-                wait = 2 ** attempt
-                time.sleep(wait)
-                if attempt == 2:
-                    raise
+    for i in range(0, len(texts), EMBED_BATCH):
+        batch = texts[i:i+EMBED_BATCH]
+        resp = limiter.embeddings(client, embedding_model, batch, priority=priority)
+        out.extend([d.embedding for d in resp.data])
     return out
\ No newline at end of file
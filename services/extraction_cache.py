@@ -0,0 +1,128 @@
+# back_end/services/extraction_cache.py
+"""
+Persistent cache of extracted text.
+
+Keyed by sha256 of the file bytes + file type + EXTRACTOR_VERSION, so Celery
+retries, duplicate uploads and re-ingestion after a chunking change skip
+parsing. Sections (text + page/slide locator) are stored as a
+zlib-compressed JSON list; the cache is bounded by EXTRACT_CACHE_MAX_MB and
+evicts least recently used entries.
+
+Only results with text are cached. An empty result may come from a
+transient problem (e.g. a killed or timed-out parser that returned
+nothing), and caching it would pin that file's hash to "no text" until
+eviction. Failed extractions raise and are never cached.
+"""
+import os
+import json
+import zlib
+import time
+import sqlite3
+import logging
+import threading
+from typing import List, Optional
+
+from services.file_processing import EXTRACTOR_VERSION, Section
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_CACHE_PATH = os.getenv("EXTRACT_CACHE_PATH", "data/extraction_cache.sqlite3")
+EXTRACT_CACHE_MAX_MB = int(os.getenv("EXTRACT_CACHE_MAX_MB", "1024"))
+
+
+def cache_key(content_hash: str, filename: str) -> str:
+    # the parser is picked from the file type, so the same bytes under
+    # another extension can extract differently
+    ext = os.path.splitext(filename or "")[1].lower()
+    return f"{content_hash}:{ext}:{EXTRACTOR_VERSION}"
+
+
+def has_text(sections: List[Section]) -> bool:
+    return any(s.text.strip() for s in sections)
+
+
+class ExtractionCache:
+    def __init__(self, path: str = EXTRACT_CACHE_PATH, max_bytes: int = EXTRACT_CACHE_MAX_MB * 1024 * 1024):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_cache ("
+            " key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL,"
+            " pages INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS extraction_cache_lru ON extraction_cache (last_access)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM extraction_cache").fetchone()[0]
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[List[Section]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM extraction_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE extraction_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.stats["hits"] += 1
+        try:
+            sections = [Section(t, loc) for t, loc in json.loads(zlib.decompress(row[0]))]
+        except (zlib.error, ValueError, TypeError) as e:
+            logger.warning("Dropping corrupt extraction cache entry %s: %s", key, e)
+            self.delete(key)
+            return None
+        if not has_text(sections):
+            # stored before empty results were skipped; extract again
+            self.delete(key)
+            return None
+        return sections
+
+    def put(self, key: str, sections: List[Section]):
+        if not has_text(sections):
+            return
+        data = zlib.compress(json.dumps([list(s) for s in sections]).encode("utf-8"), 6)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM extraction_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, data, size, pages, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), len(sections), time.time()),
+            )
+            self._size += len(data) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # evict down to 90% so we don't evict on every put at the boundary
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute("SELECT key, size FROM extraction_cache ORDER BY last_access").fetchall()
+        doomed = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            doomed.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM extraction_cache WHERE key = ?", doomed)
+        self.stats["evictions"] += len(doomed)
+
+    def delete(self, key: str):
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM extraction_cache WHERE key = ?", (key,)).fetchone()
+            if old:
+                self._conn.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+                self._size -= old[0]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / total, 3) if total else 0.0,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+extraction_cache = ExtractionCache()
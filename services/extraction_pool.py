@@ -0,0 +1,372 @@
+# back_end/services/extraction_pool.py
+"""
+Isolated text extraction.
+
+PyMuPDF / python-docx / python-pptx / pandas run in separate worker
+processes so a malformed or huge file can't pin a CPU, exhaust memory or
+hang the API process. Each job has a wall-clock limit (the worker is
+killed and replaced on timeout) and each worker an address-space limit
+(RLIMIT_AS), and is recycled after EXTRACT_MAX_JOBS_PER_WORKER jobs or once
+its RSS grows past the limit. Failures come back as ExtractionFailed with a
+reason instead of taking the caller down.
+
+Workers are plain subprocesses (`python -m services.extraction_pool`)
+talking length-prefixed pickles over stdin/stdout, so the pool also works
+inside Celery's daemonic prefork children, where multiprocessing can't
+start child processes.
+
+A job that hasn't reached a worker within EXTRACT_MAX_QUEUE_WAIT_S is
+cancelled and fails as "overloaded". Async callers use
+`aextract_sections`, which waits on the event loop instead of holding a
+thread of the shared `to_thread` executor for the whole queue wait.
+
+Results are cached by content hash (services/extraction_cache.py), so a
+file that was parsed once is never sent to a worker again.
+"""
+import os
+import sys
+import time
+import asyncio
+import pickle
+import queue
+import select
+import struct
+import logging
+import threading
+import hashlib
+import subprocess
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import List, Optional
+
+from services.extraction_cache import extraction_cache, cache_key
+from services.file_processing import Section, UnsupportedFormat
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_POOL_SIZE = int(os.getenv("EXTRACT_POOL_SIZE", "2"))  # 0 = extract in-process
+EXTRACT_TIMEOUT_S = float(os.getenv("EXTRACT_TIMEOUT_S", "120"))
+EXTRACT_MAX_MEMORY_MB = int(os.getenv("EXTRACT_MAX_MEMORY_MB", "2048"))
+EXTRACT_MAX_JOBS_PER_WORKER = int(os.getenv("EXTRACT_MAX_JOBS_PER_WORKER", "50"))
+EXTRACT_MAX_QUEUE = int(os.getenv("EXTRACT_MAX_QUEUE", "100"))
+# how long a job may wait for a worker before it is given up as overloaded
+EXTRACT_MAX_QUEUE_WAIT_S = float(os.getenv("EXTRACT_MAX_QUEUE_WAIT_S", "30"))
+
+_HEADER = struct.Struct("!Q")
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ExtractionFailed(Exception):
+    """reason: timeout | memory | crashed | unsupported | error | overloaded"""
+
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+        self.detail = detail
+
+    def as_dict(self) -> dict:
+        return {"error": "extraction_failed", "reason": self.reason, "detail": self.detail}
+
+
+# ---- framing ----
+
+def _write_frame(fd: int, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    view = memoryview(_HEADER.pack(len(data)) + data)
+    while view:
+        n = os.write(fd, view)
+        view = view[n:]
+
+
+def _read_exact(fd: int, n: int, deadline: Optional[float]) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                raise TimeoutError
+        chunk = os.read(fd, min(n - len(buf), 1 << 20))
+        if not chunk:
+            raise EOFError
+        buf += chunk
+    return bytes(buf)
+
+
+def _read_frame(fd: int, deadline: Optional[float] = None):
+    (size,) = _HEADER.unpack(_read_exact(fd, _HEADER.size, deadline))
+    return pickle.loads(_read_exact(fd, size, deadline))
+
+
+# ---- worker process ----
+
+def _worker_main():
+    # protocol goes over a private copy of stdout; anything the parsers print
+    # ends up on stderr instead of corrupting a frame
+    in_fd = sys.stdin.fileno()
+    out_fd = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    try:
+        import resource
+        limit = EXTRACT_MAX_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning("Could not set extraction memory limit: %s", e)
+
+    from services.file_processing import extract_sections_from_file_bytes
+
+    for _ in range(EXTRACT_MAX_JOBS_PER_WORKER):
+        try:
+            job_id, filename, content = _read_frame(in_fd)
+        except EOFError:
+            return
+        try:
+            sections = extract_sections_from_file_bytes(filename, content)
+            _write_frame(out_fd, (job_id, "ok", [tuple(s) for s in sections]))
+        except UnsupportedFormat as e:
+            _write_frame(out_fd, (job_id, "unsupported", str(e)))
+        except MemoryError:
+            _write_frame(out_fd, (job_id, "memory", f"exceeded {EXTRACT_MAX_MEMORY_MB} MB"))
+        except Exception as e:
+            _write_frame(out_fd, (job_id, "error", f"{type(e).__name__}: {e}"))
+
+
+def _rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return 0.0
+
+
+def _pct_ms(sorted_values, p: float) -> float:
+    return round(sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))] * 1000, 1)
+
+
+# ---- parent side ----
+
+class _Worker:
+    def __init__(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = _ROOT + os.pathsep + env.get("PYTHONPATH", "")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "services.extraction_pool"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=_ROOT,
+            env=env,
+        )
+        self.jobs = 0
+
+    def run(self, job_id: int, filename: str, content: bytes, timeout: float):
+        _write_frame(self.proc.stdin.fileno(), (job_id, filename, content))
+        self.jobs += 1
+        return _read_frame(self.proc.stdout.fileno(), time.monotonic() + timeout)
+
+    def worn_out(self) -> bool:
+        return (
+            self.jobs >= EXTRACT_MAX_JOBS_PER_WORKER
+            or _rss_mb(self.proc.pid) > EXTRACT_MAX_MEMORY_MB * 0.8
+        )
+
+    def stop(self, kill: bool = False):
+        try:
+            if kill:
+                self.proc.kill()
+            else:
+                self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.proc.kill()
+        for f in (self.proc.stdin, self.proc.stdout):
+            try:
+                f.close()
+            except Exception:
+                pass
+
+
+class ExtractionPool:
+    def __init__(self, size: int = EXTRACT_POOL_SIZE, timeout: float = EXTRACT_TIMEOUT_S,
+                 max_queue: int = EXTRACT_MAX_QUEUE, max_queue_wait: float = EXTRACT_MAX_QUEUE_WAIT_S):
+        self.size = size
+        self.timeout = timeout
+        self.max_queue_wait = max_queue_wait
+        self._jobs: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._next_id = 0
+        self._in_flight = 0
+        self._durations = deque(maxlen=200)
+        self._counts = {"ok": 0, "timeout": 0, "memory": 0, "crashed": 0, "unsupported": 0, "error": 0,
+                        "overloaded": 0, "workers_started": 0, "workers_recycled": 0}
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.size):
+                t = threading.Thread(target=self._slot, name=f"extract-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _slot(self):
+        worker = None
+        while True:
+            job_id, filename, content, fut, enqueued = self._jobs.get()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._in_flight += 1
+            start = time.monotonic()
+            try:
+                if worker is None:
+                    worker = _Worker()
+                    self._count("workers_started")
+                try:
+                    _, status, payload = worker.run(job_id, filename, content, self.timeout)
+                except TimeoutError:
+                    worker.stop(kill=True)
+                    worker = None
+                    status, payload = "timeout", f"exceeded {self.timeout:.0f}s"
+                except (EOFError, OSError, pickle.UnpicklingError) as e:
+                    # died mid-job: segfault in a parser, OOM kill, ...
+                    code = worker.proc.poll()
+                    worker.stop(kill=True)
+                    worker = None
+                    status, payload = "crashed", f"worker exited ({code}): {type(e).__name__}"
+
+                if worker is not None and (status == "memory" or worker.worn_out()):
+                    worker.stop()
+                    worker = None
+                    self._count("workers_recycled")
+
+                self._count(status)
+                if status == "ok":
+                    fut.set_result([Section(*s) for s in payload])
+                else:
+                    logger.warning("Extraction of %s failed: %s (%s)", filename, status, payload)
+                    fut.set_exception(ExtractionFailed(status, payload))
+            except Exception as e:
+                logger.exception("Extraction pool error: %s", e)
+                fut.set_exception(ExtractionFailed("error", str(e)))
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._durations.append((time.monotonic() - enqueued, time.monotonic() - start))
+
+    def submit(self, filename: str, content: bytes) -> Future:
+        fut: Future = Future()
+        if self.size <= 0:
+            # in-process mode for local development
+            from services.file_processing import extract_sections_from_file_bytes
+            try:
+                fut.set_result(extract_sections_from_file_bytes(filename, content))
+            except UnsupportedFormat as e:
+                fut.set_exception(ExtractionFailed("unsupported", str(e)))
+            except Exception as e:
+                fut.set_exception(ExtractionFailed("error", str(e)))
+            return fut
+
+        self._start()
+        with self._lock:
+            self._next_id += 1
+            job_id = self._next_id
+        try:
+            self._jobs.put_nowait((job_id, filename, content, fut, time.monotonic()))
+        except queue.Full:
+            self._count("overloaded")
+            raise ExtractionFailed("overloaded", "extraction queue is full")
+        return fut
+
+    def _cache_key(self, filename: str, content: bytes, content_hash: Optional[str]) -> str:
+        return cache_key(content_hash or hashlib.sha256(content).hexdigest(), filename)
+
+    def _queue_timeout(self, fut: Future):
+        # still queued: drop the job (its slot skips cancelled futures)
+        if fut.cancel():
+            self._count("overloaded")
+            raise ExtractionFailed("overloaded", f"no extraction worker free within {self.max_queue_wait:.0f}s")
+
+    def extract_sections(self, filename: str, content: bytes, content_hash: Optional[str] = None) -> List[Section]:
+        """Sections of a file, from the cache or a worker process.
+        Raises ExtractionFailed. Blocks; see aextract_sections."""
+        key = self._cache_key(filename, content, content_hash)
+        sections = extraction_cache.get(key)
+        if sections is not None:
+            return sections
+        fut = self.submit(filename, content)
+        try:
+            sections = fut.result(timeout=self.max_queue_wait)
+        except FutureTimeout:
+            self._queue_timeout(fut)
+            # already running; the worker itself is killed at self.timeout
+            sections = fut.result()
+        extraction_cache.put(key, sections)
+        return sections
+
+    async def aextract_sections(self, filename: str, content: bytes,
+                                content_hash: Optional[str] = None) -> List[Section]:
+        """extract_sections for the event loop: no thread is held while the
+        job waits for or runs in a worker."""
+        key = self._cache_key(filename, content, content_hash)
+        sections = await asyncio.to_thread(extraction_cache.get, key)
+        if sections is not None:
+            return sections
+        if self.size <= 0:
+            # in-process mode extracts inside submit()
+            fut = await asyncio.to_thread(self.submit, filename, content)
+        else:
+            fut = self.submit(filename, content)
+        done = asyncio.wrap_future(fut)
+        try:
+            sections = await asyncio.wait_for(asyncio.shield(done), self.max_queue_wait)
+        except asyncio.TimeoutError:
+            self._queue_timeout(fut)
+            sections = await done
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        await asyncio.to_thread(extraction_cache.put, key, sections)
+        return sections
+
+    def extract(self, filename: str, content: bytes, content_hash: Optional[str] = None) -> str:
+        return "\n\n".join(s.text for s in self.extract_sections(filename, content, content_hash))
+
+    def cached_sections(self, filename: str, content_hash: str) -> Optional[List[Section]]:
+        """Sections for content already seen, without needing its bytes."""
+        return extraction_cache.get(cache_key(content_hash, filename))
+
+    def stats(self) -> dict:
+        with self._lock:
+            durations = list(self._durations)
+            out = {
+                "workers": self.size,
+                "queue_depth": self._jobs.qsize(),
+                "in_flight": self._in_flight,
+                **self._counts,
+            }
+        out["cache"] = extraction_cache.snapshot()
+        if durations:
+            total = sorted(d[0] for d in durations)
+            run = sorted(d[1] for d in durations)
+            out["job_ms_p50"] = _pct_ms(run, 0.5)
+            out["job_ms_p95"] = _pct_ms(run, 0.95)
+            out["total_ms_p95"] = _pct_ms(total, 0.95)
+        return out
+
+
+extraction_pool = ExtractionPool()
+
+
+if __name__ == "__main__":
+    _worker_main()
@@ -1,84 +1,234 @@
 # back_end/services/file_processing.py
+"""
+Extractor registry.
+
+The format is detected from the file's signature (magic bytes), with the
+extension only as a tie-breaker for plain text vs CSV. Every extractor is a
+generator of Section(text, locator) records, e.g. ("...", "page 3"),
+("...", "slide 2 notes"), ("...", "table 1 row 4"), so the chunker can
+consume a document incrementally and chunks can cite where they came from.
+
+New formats plug in with @register("kind", ...) without touching the
+upload route or the Celery task.
+"""
 import io
+import zipfile
 import logging
-from typing import Optional, Tuple, List
-import fitz  # PyMuPDF
-import docx
-import pandas as pd
-import pptx
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf_bytes(b: bytes) -> str:
-    text_parts = []
-    try:
-        doc = fitz.open(stream=b, filetype="pdf")
-        for page in doc:
-            text = page.get_text("text")
-            if text:
-                text_parts.append(text)
-    except Exception as e:
-        logger.exception("PDF extraction failed: %s", e)
-    return "\n\n".join(text_parts)
+# Bump whenever extraction output changes so cached results are not reused.
+EXTRACTOR_VERSION = "3"
+
+CSV_ROWS_PER_SECTION = 200
+
+
+class Section(NamedTuple):
+    text: str
+    locator: str
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+Extractor = Callable[[bytes], Iterator[Section]]
+_EXTRACTORS: Dict[str, Extractor] = {}
 
-def extract_text_from_docx_bytes(b: bytes) -> str:
-    try:
-        bio = io.BytesIO(b)
-        doc = docx.Document(bio)
-        paragraphs = [p.text for p in doc.paragraphs if p.text]
-        return "\n\n".join(paragraphs)
-    except Exception as e:
-        logger.exception("DOCX extraction failed: %s", e)
-        return ""
-
-def extract_text_from_txt_bytes(b: bytes) -> str:
-    try:
-        return b.decode("utf-8", errors="ignore")
-    except Exception:
-        return str(b)
 
-def extract_text_from_csv_bytes(b: bytes) -> str:
+def register(kind: str):
+    def deco(fn: Extractor) -> Extractor:
+        _EXTRACTORS[kind] = fn
+        return fn
+    return deco
+
+
+# ---- detection ----
+
+_OLE_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_ZIP_SIGNATURES = (b"PK\x03\x04", b"PK\x05\x06")
+# zip member that identifies each OOXML flavour
+_OOXML_MARKERS = (
+    ("word/document.xml", "docx"),
+    ("ppt/presentation.xml", "pptx"),
+    ("xl/workbook.xml", "xlsx"),
+)
+
+
+_TEXT_BOMS = (b"\xef\xbb\xbf", b"\xff\xfe", b"\xfe\xff")
+_UTF16_BOMS = (b"\xff\xfe", b"\xfe\xff")
+# control bytes other than \t \n \f \r; text in any 8-bit encoding has few
+_CONTROL = bytes(b for b in range(32) if b not in (9, 10, 12, 13)) + b"\x7f"
+MAX_CONTROL_RATIO = 0.1
+
+
+def _looks_binary(head: bytes) -> bool:
+    # not "is it UTF-8": cp1252 / latin-1 text is fine, it is decoded leniently
+    if not head or head.startswith(_TEXT_BOMS):
+        return False
+    if b"\x00" in head:
+        return True
+    control = len(head) - len(head.translate(None, _CONTROL))
+    return control / len(head) > MAX_CONTROL_RATIO
+
+
+def decode_text(b: bytes) -> str:
+    """Text of a file in an unknown encoding: UTF-16 by BOM, else UTF-8,
+    else cp1252 (which also covers ASCII-compatible latin-1 text)."""
+    if b.startswith(_UTF16_BOMS):
+        return b.decode("utf-16", errors="replace")
     try:
-        df = pd.read_csv(io.BytesIO(b))
-        rows = []
-        for i, r in df.iterrows():
-            rows.append(" | ".join([f"{c}:{r[c]}" for c in df.columns]))
-        return "\n".join(rows)
-    except Exception:
+        return b.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return b.decode("cp1252", errors="replace")
+
+
+def detect_format(filename: str, content: bytes) -> str:
+    head = content[:4096]
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(_ZIP_SIGNATURES):
         try:
-            return b.decode("utf-8", errors="ignore")
-        except:
-            return ""
-        
-def extract_text_from_pptx_bytes(b: bytes) -> str:
+            names = set(zipfile.ZipFile(io.BytesIO(content)).namelist())
+        except zipfile.BadZipFile:
+            names = set()
+        for marker, kind in _OOXML_MARKERS:
+            if marker in names:
+                return kind
+        return "zip"
+    if head.startswith(_OLE_SIGNATURE):
+        # legacy .doc / .ppt / .xls; python-docx / python-pptx can't read these
+        return "ole"
+    if _looks_binary(head):
+        return "binary"
+    if (filename or "").lower().endswith(".csv"):
+        return "csv"
+    return "text"
+
+
+# ---- extractors ----
+
+@register("pdf")
+def _pdf_sections(b: bytes) -> Iterator[Section]:
+    import fitz  # PyMuPDF
+    doc = fitz.open(stream=b, filetype="pdf")
     try:
-        bio = io.BytesIO(b)
-        presentation = pptx.Presentation(bio)
-        text_runs = []
-        for slide in presentation.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text_runs.append(shape.text)
-        return "\n\n".join(text_runs)
-    except Exception as e:
-        logger.exception("PPTX extraction failed: %s", e)
-        return ""
-
-def extract_text_from_file_bytes(filename: str, content_bytes: Optional[bytes] = None ) -> str:
-    #fname = filename.filename
-    lower = filename.lower()
-    if lower.endswith(".pdf"):
-        return extract_text_from_pdf_bytes(content_bytes)
-    if lower.endswith(".docx") or lower.endswith(".doc"):
-        return extract_text_from_docx_bytes(content_bytes)
-    if lower.endswith(".csv"):
-        return extract_text_from_csv_bytes(content_bytes)
-    if lower.endswith(".txt"):
-        return extract_text_from_txt_bytes(content_bytes)
-    if lower.endswith(".pptx") or lower.endswith(".ppt"):
-        return extract_text_from_pptx_bytes(content_bytes)
-    # default
+        for i, page in enumerate(doc, start=1):
+            text = page.get_text("text")
+            if text and text.strip():
+                yield Section(text, f"page {i}")
+    finally:
+        doc.close()
+
+
+def _row_text(cells: List[str]) -> str:
+    # merged cells repeat their text in every grid cell they span
+    out = []
+    for c in cells:
+        c = c.strip()
+        if c and (not out or out[-1] != c):
+            out.append(c)
+    return " | ".join(out)
+
+
+@register("docx")
+def _docx_sections(b: bytes) -> Iterator[Section]:
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    doc = docx.Document(io.BytesIO(b))
+    para_no = 0
+    table_no = 0
+    # walk the body in document order so tables stay next to their text
+    for child in doc.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            para_no += 1
+            text = Paragraph(child, doc).text
+            if text.strip():
+                yield Section(text, f"paragraph {para_no}")
+        elif tag == "tbl":
+            table_no += 1
+            for r, row in enumerate(Table(child, doc).rows, start=1):
+                text = _row_text([cell.text for cell in row.cells])
+                if text:
+                    yield Section(text, f"table {table_no} row {r}")
+
+
+def _shape_texts(shapes) -> Iterator[str]:
+    for shape in shapes:
+        if hasattr(shape, "shapes"):  # group shape
+            yield from _shape_texts(shape.shapes)
+        elif getattr(shape, "has_table", False):
+            for row in shape.table.rows:
+                text = _row_text([cell.text for cell in row.cells])
+                if text:
+                    yield text
+        elif hasattr(shape, "text") and shape.text.strip():
+            yield shape.text
+
+
+@register("pptx")
+def _pptx_sections(b: bytes) -> Iterator[Section]:
+    import pptx
+    presentation = pptx.Presentation(io.BytesIO(b))
+    for i, slide in enumerate(presentation.slides, start=1):
+        text = "\n\n".join(_shape_texts(slide.shapes))
+        if text:
+            yield Section(text, f"slide {i}")
+        if slide.has_notes_slide:
+            notes = slide.notes_slide.notes_text_frame
+            if notes is not None and notes.text.strip():
+                yield Section(notes.text, f"slide {i} notes")
+
+
+@register("csv")
+def _csv_sections(b: bytes) -> Iterator[Section]:
+    import pandas as pd
     try:
-        return content_bytes.decode("utf-8", errors="ignore")
-    except:
-        return ""
\ No newline at end of file
+        reader = pd.read_csv(io.StringIO(decode_text(b)), chunksize=CSV_ROWS_PER_SECTION)
+        first = 1
+        for df in reader:
+            rows = [" | ".join([f"{c}:{r[c]}" for c in df.columns]) for _, r in df.iterrows()]
+            if rows:
+                yield Section("\n".join(rows), f"rows {first}-{first + len(rows) - 1}")
+            first += len(rows)
+    except (ValueError, pd.errors.ParserError, UnicodeDecodeError):
+        # not really CSV; index it as text
+        yield from _text_sections(b)
+
+
+@register("text")
+def _text_sections(b: bytes) -> Iterator[Section]:
+    text = decode_text(b)
+    if text.strip():
+        yield Section(text, "text")
+
+
+# ---- public API ----
+
+def iter_sections(filename: str, content_bytes: bytes) -> Iterator[Section]:
+    """Sections of a file in document order. Raises UnsupportedFormat."""
+    if not content_bytes:
+        return iter(())
+    kind = detect_format(filename, content_bytes)
+    extractor = _EXTRACTORS.get(kind)
+    if extractor is None:
+        if kind == "ole":
+            raise UnsupportedFormat("legacy Office format (.doc/.ppt/.xls); save it as .docx/.pptx/.xlsx")
+        raise UnsupportedFormat(f"unsupported file format: {kind}")
+    return extractor(content_bytes)
+
+
+def extract_sections_from_file_bytes(filename: str, content_bytes: Optional[bytes] = None) -> List[Section]:
+    return list(iter_sections(filename, content_bytes))
+
+
+def extract_text_from_file_bytes(filename: str, content_bytes: Optional[bytes] = None) -> str:
+    return "\n\n".join(s.text for s in iter_sections(filename, content_bytes))
+
+
+def supported_formats() -> Tuple[str, ...]:
+    return tuple(_EXTRACTORS)
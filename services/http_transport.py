@@ -0,0 +1,223 @@
+# back_end/services/http_transport.py
+"""
+Process-wide outbound transport.
+
+OpenAI, Supabase and Pinecone clients are built once per process here and
+shared by every route, service and Celery task, so each upstream gets one
+keep-alive pool instead of one per module. Supabase is the exception: its
+clients set auth headers and base_url on the httpx client they are given,
+so each URL/key pair gets a pool of its own. httpx pools are tuned per
+upstream (max connections, keep-alive size/expiry) and use HTTP/2 when the
+`h2` package is installed. `pool_stats()` reports requests, new TCP
+connections and TLS handshakes per upstream so pool reuse can be checked in
+production (a healthy pool has connections << requests).
+"""
+import os
+import hashlib
+import threading
+import logging
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv, find_dotenv
+
+try:
+    import h2  # noqa: F401  (httpx needs it for http2=True)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+load_dotenv(find_dotenv())
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT_S = float(os.getenv("HTTP_TIMEOUT_S", "60"))
+HTTP_KEEPALIVE_EXPIRY_S = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_S", "90"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1" and HTTP2_AVAILABLE
+PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", "8"))
+
+# (max_connections, max_keepalive_connections) per upstream
+UPSTREAM_LIMITS = {
+    "openai": (int(os.getenv("OPENAI_MAX_CONNECTIONS", "64")), int(os.getenv("OPENAI_MAX_KEEPALIVE", "32"))),
+    "supabase": (int(os.getenv("SUPABASE_MAX_CONNECTIONS", "32")), int(os.getenv("SUPABASE_MAX_KEEPALIVE", "16"))),
+    "default": (int(os.getenv("HTTP_MAX_CONNECTIONS", "32")), int(os.getenv("HTTP_MAX_KEEPALIVE", "16"))),
+}
+
+_lock = threading.Lock()
+_http_clients: Dict[str, httpx.Client] = {}
+_metrics: Dict[str, Dict[str, int]] = {}
+# counters are bumped from every request thread
+_metrics_lock = threading.Lock()
+_openai = None
+_openai_sdk_retries = None
+_supabase: Dict[str, object] = {}
+_pinecone = None
+_pinecone_indexes: Dict[str, object] = {}
+
+
+def _counter(upstream: str) -> Dict[str, int]:
+    with _metrics_lock:
+        m = _metrics.get(upstream)
+        if m is None:
+            m = _metrics[upstream] = {"requests": 0, "connections_opened": 0, "tls_handshakes": 0, "errors": 0}
+        return m
+
+
+def _make_hooks(upstream: str):
+    m = _counter(upstream)
+
+    def bump(key: str):
+        with _metrics_lock:
+            m[key] += 1
+
+    def trace(event_name: str, info: dict):
+        # httpcore trace events; only fire when a new connection is set up
+        if event_name == "connection.connect_tcp.complete":
+            bump("connections_opened")
+        elif event_name == "connection.start_tls.complete":
+            bump("tls_handshakes")
+
+    def on_request(request: httpx.Request):
+        bump("requests")
+        request.extensions["trace"] = trace
+
+    def on_response(response: httpx.Response):
+        if response.status_code >= 500:
+            bump("errors")
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def http_client(upstream: str = "default", pool: str = "") -> httpx.Client:
+    """Shared httpx.Client for one upstream, or for one `pool` of it when
+    callers must not share headers (limits still come from `upstream`)."""
+    name = f"{upstream}:{pool}" if pool else upstream
+    client = _http_clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _http_clients.get(name)
+        if client is None:
+            max_conn, max_keepalive = UPSTREAM_LIMITS.get(upstream, UPSTREAM_LIMITS["default"])
+            client = httpx.Client(
+                http2=HTTP2_ENABLED,
+                limits=httpx.Limits(
+                    max_connections=max_conn,
+                    max_keepalive_connections=max_keepalive,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_S,
+                ),
+                timeout=httpx.Timeout(HTTP_TIMEOUT_S, connect=10.0),
+                event_hooks=_make_hooks(name),
+            )
+            _http_clients[name] = client
+    return client
+
+
+def get_openai(sdk_retries: bool = False):
+    """Shared OpenAI client. Its retries are left to services.rate_limiter,
+    so calls that don't go through `limiter` should pass sdk_retries=True:
+    same connection pool, with the SDK's default retries."""
+    global _openai, _openai_sdk_retries
+    if _openai is None:
+        from openai import OpenAI
+        with _lock:
+            if _openai is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("OPENAI_API_KEY environment variable not set")
+                _openai = OpenAI(api_key=api_key, http_client=http_client("openai"), max_retries=0)
+    if not sdk_retries:
+        return _openai
+    if _openai_sdk_retries is None:
+        from openai import DEFAULT_MAX_RETRIES
+        with _lock:
+            if _openai_sdk_retries is None:
+                _openai_sdk_retries = _openai.with_options(max_retries=DEFAULT_MAX_RETRIES)
+    return _openai_sdk_retries
+
+
+def get_supabase(key: Optional[str] = None):
+    """Shared Supabase client (service role by default)."""
+    from supabase import create_client
+    url = os.getenv("SUPABASE_URL")
+    key = key or os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        raise RuntimeError("Set Supabase env vars")
+    client = _supabase.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _supabase.get(key)
+        if client is None:
+            options = None
+            try:
+                # newer supabase-py accepts a caller-owned httpx client; it sets
+                # this key's headers on it, so the pool is per URL/key, and the
+                # pool name is a digest so keys never show up in pool_stats
+                from supabase import ClientOptions
+                pool = hashlib.sha256(f"{url}|{key}".encode("utf-8")).hexdigest()[:12]
+                options = ClientOptions(httpx_client=http_client("supabase", pool))
+            except (ImportError, TypeError):
+                options = None
+            if options is not None:
+                client = create_client(url, key, options=options)
+            else:
+                client = create_client(url, key)
+            _supabase[key] = client
+    return client
+
+
+def get_pinecone():
+    global _pinecone
+    if _pinecone is None:
+        from pinecone import Pinecone
+        with _lock:
+            if _pinecone is None:
+                _pinecone = Pinecone(api_key=os.getenv("PINECONE_API_KEY"), pool_threads=PINECONE_POOL_THREADS)
+    return _pinecone
+
+
+def get_pinecone_index(name: Optional[str] = None):
+    """Shared Pinecone Index handle (one connection pool per index name)."""
+    name = name or os.getenv("PINECONE_INDEX")
+    idx = _pinecone_indexes.get(name)
+    if idx is not None:
+        return idx
+    pc = get_pinecone()
+    with _lock:
+        idx = _pinecone_indexes.get(name)
+        if idx is None:
+            idx = pc.Index(name, pool_threads=PINECONE_POOL_THREADS)
+            _pinecone_indexes[name] = idx
+    return idx
+
+
+def pool_stats() -> dict:
+    """Per-upstream request / connection counters plus current pool size."""
+    with _metrics_lock:
+        snapshot = {upstream: dict(m) for upstream, m in _metrics.items()}
+    out = {}
+    for upstream, stats in snapshot.items():
+        try:
+            # httpcore internals, best effort: left out if they change shape
+            pool = getattr(getattr(_http_clients.get(upstream), "_transport", None), "_pool", None)
+            conns = getattr(pool, "connections", None)
+            if conns is not None:
+                conns = list(conns)
+                stats.update(pool_connections=len(conns), pool_idle=sum(1 for c in conns if c.is_idle()))
+        except Exception:
+            pass
+        if stats["requests"]:
+            stats["reuse_ratio"] = round(1 - stats["connections_opened"] / stats["requests"], 3)
+        out[upstream] = stats
+    out["http2"] = HTTP2_ENABLED
+    return out
+
+
+def close_all():
+    with _lock:
+        for client in _http_clients.values():
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning("Closing http client failed: %s", e)
+        _http_clients.clear()
@@ -0,0 +1,264 @@
+# back_end/services/ingest_pipeline.py
+"""
+Concurrent ingest pipeline used by /documents/upload.
+
+Stages overlap instead of running back to back:
+
+    storage upload  ─────────────────────────────┐
+    extract ──> chunk ──> embed batch ──> upsert ┴─> done
+                     └──> embed batch ──> upsert
+                     └──> ...
+
+The storage upload only needs the raw bytes, so it runs alongside
+extraction. Chunks are pulled off the streaming chunker in embedding-sized
+batches and each batch is embedded + upserted as soon as it exists, with
+at most EMBED_CONCURRENCY batches in flight. Chunk text goes to the
+chunk store, not Pinecone metadata.
+
+With a Deduper (services/dedup.py), near-duplicate chunks are dropped or
+stored with an existing vector before they reach the embedding stage.
+Each document's summary vector for query routing (services/doc_routing.py)
+is accumulated from the batches and stored once they are all upserted.
+"""
+import os
+import asyncio
+import logging
+from itertools import islice
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from services.chunker import iter_chunks_from_sections
+from services.file_processing import Section
+from services.embeddings import embed_texts, EMBED_BATCH
+from services.pinecone_client import index
+from services.chunk_store import chunk_store
+from services.document_registry import registry
+from services.answer_cache import answer_cache
+from services.dedup import Deduper, SCOPE_DOCUMENT, forget
+from services.doc_routing import Centroid, upsert_centroid
+from services.rate_limiter import BATCH
+
+logger = logging.getLogger(__name__)
+
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+# Pinecone accepts at most 1000 ids per delete call
+DELETE_BATCH = 1000
+
+# (chunk_text, start_token, end_token, locator)
+Chunk = Tuple[str, int, int, str]
+
+
+def _take(it: Iterator[Chunk], n: int) -> List[Chunk]:
+    return list(islice(it, n))
+
+
+def fetch_vectors(namespace: str, ids: List[str]) -> Dict[str, List[float]]:
+    """Stored vectors by id; ids Pinecone doesn't have are left out."""
+    out = {}
+    for i in range(0, len(ids), 100):
+        res = index.fetch(ids=ids[i:i+100], namespace=namespace)
+        vectors = res.get("vectors", {}) if isinstance(res, dict) else res.vectors
+        for cid, v in vectors.items():
+            out[cid] = v["values"] if isinstance(v, dict) else v.values
+    return out
+
+
+def vectors_for(
+    namespace: str,
+    new: List[Tuple[Chunk, str]],
+    reused: List[Tuple],
+    deduper: Deduper,
+    known: Dict[str, List[float]],
+) -> List[Tuple[Chunk, str, List[float]]]:
+    """(chunk, id, vector) rows for one deduplicated batch (see Deduper.split).
+
+    New chunks are embedded. Duplicates of chunks stored by earlier ingests
+    reuse the vector fetched from Pinecone, or are embedded again if it has
+    since been deleted. Duplicates within the document take their
+    canonical's vector from this batch or from `known`.
+    """
+    from_ns = [r for r in reused if r[3] != SCOPE_DOCUMENT]
+    fetched = fetch_vectors(namespace, [r[2] for r in from_ns]) if from_ns else {}
+    to_embed = new + [(c, i) for c, i, canonical, _ in from_ns if canonical not in fetched]
+    vectors = embed_texts([c[0] for c, _ in to_embed], BATCH) if to_embed else []
+    deduper.embedded(len(to_embed))
+
+    rows = [(c, i, vec) for (c, i), vec in zip(to_embed, vectors)]
+    for c, i, canonical, scope in from_ns:
+        if canonical in fetched:
+            rows.append((c, i, fetched[canonical]))
+            deduper.reused(scope)
+    by_id = {**known, **{i: vec for _, i, vec in rows}}
+    for c, i, canonical, scope in reused:
+        if scope == SCOPE_DOCUMENT:
+            rows.append((c, i, by_id[canonical]))
+            deduper.reused(scope)
+    return rows
+
+
+async def embed_and_upsert(
+    chunks: Iterable[Chunk],
+    namespace: str,
+    make_id: Callable[[Chunk], str],
+    make_metadata: Callable[[Chunk], dict],
+    file_id: Optional[str] = None,
+    batch_size: int = EMBED_BATCH,
+    concurrency: int = EMBED_CONCURRENCY,
+    deduper: Optional[Deduper] = None,
+) -> List[str]:
+    """Embed + upsert chunks batch by batch while the iterator is still producing.
+
+    When `file_id` is given, each batch's ids are recorded in the document
+    registry before the upsert, and the document's summary vector is stored
+    at the end. Returns the ids upserted.
+    """
+    it = iter(chunks)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    tasks = []
+    loop = asyncio.get_running_loop()
+    # vector of every canonical chunk (with a deduper), resolved once its batch is embedded
+    vectors_by_id: Dict[str, asyncio.Future] = {}
+    centroid = Centroid()
+    file_name = ""
+    # set on failure: batches stop before their next write
+    stopping = asyncio.Event()
+
+    async def run_batch(new: List[Tuple[Chunk, str]], reused: List[Tuple]) -> List[str]:
+        try:
+            if deduper is None:
+                vectors = await asyncio.to_thread(embed_texts, [c[0] for c, _ in new], BATCH)
+                rows = [(c, i, vec) for (c, i), vec in zip(new, vectors)]
+            else:
+                # canonicals from earlier batches; same-batch ones resolve in vectors_for
+                here = {i for _, i in new} | {r[1] for r in reused}
+                known = {}
+                for _, _, canonical, scope in reused:
+                    if scope == SCOPE_DOCUMENT and canonical not in here:
+                        known[canonical] = await vectors_by_id[canonical]
+                rows = await asyncio.to_thread(vectors_for, namespace, new, reused, deduper, known)
+                for _, i, vec in rows:
+                    fut = vectors_by_id.get(i)
+                    if fut is not None and not fut.done():
+                        fut.set_result(vec)
+            if not rows or stopping.is_set():
+                # every chunk in the batch was a skipped duplicate, or the ingest failed
+                return []
+
+            nonlocal file_name
+            file_name = file_name or make_metadata(rows[0][0]).get("file_name", "")
+            await asyncio.to_thread(centroid.add, [vec for _, _, vec in rows])
+
+            ids = [i for _, i, _ in rows]
+            # text first, so a query never sees a vector whose text is missing
+            await asyncio.to_thread(chunk_store.put_many, namespace, {i: c[0] for c, i, _ in rows})
+            # and registered before upsert, so a failed ingest can still be deleted
+            if file_id:
+                await asyncio.to_thread(registry.add_chunks, namespace, file_id, ids)
+            if stopping.is_set():
+                return []
+            upserts = [
+                {"id": i, "values": vec, "metadata": make_metadata(c)}
+                for c, i, vec in rows
+            ]
+            await asyncio.to_thread(index.upsert, vectors=upserts, namespace=namespace)
+            if deduper:
+                await asyncio.to_thread(deduper.remember, ids)
+            return ids
+        finally:
+            sem.release()
+
+    def plan(batch: List[Chunk]) -> Tuple[List[Tuple[Chunk, str]], List[Tuple]]:
+        if deduper is None:
+            return [(c, make_id(c)) for c in batch], []
+        return deduper.split(batch, make_id)
+
+    try:
+        while True:
+            # wait for a free slot before decoding more chunks, so a slow
+            # embedding stage applies backpressure to the chunker
+            await sem.acquire()
+            started = False
+            try:
+                failed = next((t for t in tasks if t.done() and not t.cancelled() and t.exception()), None)
+                if failed is not None:
+                    # stop chunking as soon as a batch has failed
+                    raise failed.exception()
+                batch = await asyncio.to_thread(_take, it, batch_size)
+                if not batch:
+                    break
+                new, reused = await asyncio.to_thread(plan, batch)
+                if deduper:
+                    # later duplicates within the document wait on these vectors
+                    for i in [i for _, i in new] + [r[1] for r in reused if r[3] != SCOPE_DOCUMENT]:
+                        vectors_by_id[i] = loop.create_future()
+                tasks.append(asyncio.create_task(run_batch(new, reused)))
+                started = True
+            finally:
+                # run_batch releases its own slot
+                if not started:
+                    sem.release()
+        id_batches = await asyncio.gather(*tasks)
+    except BaseException:
+        stopping.set()
+        for fut in vectors_by_id.values():
+            if not fut.done():
+                fut.cancel()
+        # cancelling wouldn't stop a write already running in a thread; let
+        # them finish so every id they wrote is in the registry before the
+        # caller cleans up (see discard_partial)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    if file_id:
+        await asyncio.to_thread(upsert_centroid, namespace, file_id, centroid, file_name)
+    return [i for ids in id_batches for i in ids]
+
+
+async def run_concurrently(*aws: Awaitable):
+    """Like asyncio.gather, but cancels the other stages as soon as one fails
+    and waits for them to wind down before raising."""
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    for t in done:
+        if t.exception() is not None:
+            for p in pending:
+                p.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise t.exception()
+    return [t.result() for t in tasks]
+
+
+async def extract_and_index(
+    extract: Callable[[], Awaitable[Iterable[Section]]],
+    namespace: str,
+    make_id: Callable[[Chunk], str],
+    make_metadata: Callable[[Chunk], dict],
+    file_id: Optional[str] = None,
+    deduper: Optional[Deduper] = None,
+) -> List[str]:
+    # awaited on the loop (e.g. extraction_pool.aextract_sections), so a
+    # queued extraction doesn't hold a to_thread worker
+    sections = await extract()
+    return await embed_and_upsert(
+        iter_chunks_from_sections(sections), namespace, make_id, make_metadata, file_id=file_id, deduper=deduper
+    )
+
+
+def discard_partial(namespace: str, file_id: str, keep: Iterable[str] = ()) -> int:
+    """Delete what a failed ingest of `file_id` already wrote: every chunk
+    the registry lists for it except `keep` (the previous version's)."""
+    keep = set(keep)
+    ids = [i for i in registry.chunk_ids(namespace, file_id) if i not in keep]
+    if ids:
+        delete_chunks(namespace, ids)
+        registry.remove_chunks(namespace, file_id, ids)
+    return len(ids)
+
+
+def delete_chunks(namespace: str, chunk_ids: Iterable[str]) -> int:
+    """Delete vectors and their chunk text by id, in Pinecone-sized batches."""
+    ids = list(chunk_ids)
+    for i in range(0, len(ids), DELETE_BATCH):
+        index.delete(ids=ids[i:i+DELETE_BATCH], namespace=namespace)
+    chunk_store.delete_many(namespace, ids)
+    forget(namespace, ids)
+    answer_cache.bump(namespace)
+    return len(ids)
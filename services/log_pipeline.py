@@ -0,0 +1,209 @@
+# back_end/services/log_pipeline.py
+"""
+Non-blocking structured logging.
+
+`setup_logging()` puts a QueueHandler on the root logger; a background
+QueueListener thread formats records as one JSON object per line and writes
+them to stderr. A request thread only builds the record and does a
+put_nowait, so slow stdout / log shipping never adds request latency. When
+the queue is full records are dropped and counted instead of blocking.
+
+`log_event(logger, "event_name", **fields)` is for hot paths:
+- sampled per event (LOG_SAMPLE="context_used=0.01,chunk_upserted=0.1")
+- fields named like document content (context, text, chunk, prompt, ...)
+  are replaced by their length and a short hash unless LOG_REDACT=0
+- every string field is capped at LOG_MAX_FIELD_CHARS and the message at
+  LOG_MAX_MESSAGE_CHARS
+Redaction, truncation and JSON encoding happen on the listener thread.
+
+The listener thread does not survive a fork (Celery prefork, gunicorn), so a
+forked child gets a fresh queue and listener of its own.
+"""
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "512"))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "4096"))
+LOG_REDACT = os.getenv("LOG_REDACT", "1") != "0"
+
+# third-party loggers that are too chatty below WARNING
+NOISY_LOGGERS = ("httpx", "httpcore", "hpack", "urllib3", "openai", "multipart", "pinecone")
+
+REDACTED_FIELDS = frozenset({"context", "text", "chunk", "chunks", "content", "document", "prompt", "answer", "question"})
+
+
+def _parse_rates(raw: str) -> Dict[str, float]:
+    rates = {}
+    for part in (raw or "").split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            try:
+                rates[name.strip()] = min(1.0, max(0.0, float(value)))
+            except ValueError:
+                pass
+    return rates
+
+
+LOG_SAMPLE = _parse_rates(os.getenv("LOG_SAMPLE", "context_used=0.01"))
+
+_stats = {"enqueued": 0, "dropped": 0, "sampled_out": 0}
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+_setup_args: tuple = ()
+
+
+# ---- request-thread side ----
+
+class _DroppingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only what can't cross threads safely is resolved here; formatting
+        # happens on the listener thread
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            _stats["enqueued"] += 1
+        except queue.Full:
+            _stats["dropped"] += 1
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO,
+              sample: Optional[float] = None, **fields: Any):
+    """Structured, sampled log record. `fields` are redacted/capped off-thread."""
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_SAMPLE.get(event, 1.0) if sample is None else sample
+    if rate < 1.0 and random.random() >= rate:
+        _stats["sampled_out"] += 1
+        return
+    fields["event"] = event
+    if rate < 1.0:
+        fields["sample_rate"] = rate
+    logger.log(level, event, extra={"fields": fields})
+
+
+# ---- listener-thread side ----
+
+def _redact(value: Any) -> dict:
+    s = value if isinstance(value, str) else json.dumps(value, default=str)
+    return {"redacted": True, "chars": len(s), "sha256": hashlib.sha256(s.encode("utf-8", "replace")).hexdigest()[:12]}
+
+
+def _cap(value: Any, limit: int) -> Any:
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}...(+{len(value) - limit} chars)"
+    if isinstance(value, (list, tuple)):
+        items = [_cap(v, limit) for v in value[:20]]
+        if len(value) > 20:
+            items.append(f"...(+{len(value) - 20} items)")
+        return items
+    if isinstance(value, dict):
+        return {k: _cap(v, limit) for k, v in list(value.items())[:50]}
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return _cap(str(value), limit)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redact: bool = LOG_REDACT, max_field_chars: int = LOG_MAX_FIELD_CHARS,
+                 max_message_chars: int = LOG_MAX_MESSAGE_CHARS):
+        super().__init__()
+        self.redact = redact
+        self.max_field_chars = max_field_chars
+        self.max_message_chars = max_message_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _cap(record.getMessage(), self.max_message_chars),
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            if self.redact and key in REDACTED_FIELDS:
+                out[key] = _redact(value)
+            else:
+                out[key] = _cap(value, self.max_field_chars)
+        if record.exc_text:
+            out["exc"] = _cap(record.exc_text, self.max_message_chars)
+        return json.dumps(out, default=str, ensure_ascii=False)
+
+
+class TextFormatter(JsonFormatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = json.loads(super().format(record))
+        head = f"{data.pop('ts')} {data.pop('level')} {data.pop('logger')}: {data.pop('msg')}"
+        return f"{head} {json.dumps(data, ensure_ascii=False)}" if data else head
+
+
+def setup_logging(level: str = LOG_LEVEL, stream=None):
+    """Route all logging through the queue. Safe to call more than once."""
+    global _listener, _setup_args
+    with _setup_lock:
+        if _listener is not None:
+            return
+        _setup_args = (level, stream)
+        q: "queue.Queue" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        sink = logging.StreamHandler(stream or sys.stderr)
+        sink.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(_DroppingQueueHandler(q))
+        root.setLevel(level)
+        for name in NOISY_LOGGERS:
+            logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+        _listener = QueueListener(q, sink, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records; called at exit."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _restart_after_fork():
+    # the child inherits the handler, queue and _listener, but not the
+    # listener thread: without this its records queue up and are dropped
+    global _listener, _setup_lock
+    _setup_lock = threading.Lock()
+    if _listener is None:
+        return
+    _listener = None
+    _stats.update(enqueued=0, dropped=0, sampled_out=0)
+    setup_logging(*_setup_args)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def log_stats() -> dict:
+    return {**_stats, "queue_size": LOG_QUEUE_SIZE}
@@ -1,7 +1,8 @@
 # app/services/pinecone_adapter.py
 import os
-from pinecone import Pinecone, ServerlessSpec
+import asyncio
 from dotenv import load_dotenv
+from services.http_transport import get_pinecone_index
 
 load_dotenv()
 
@@ -16,8 +17,8 @@ PINECONE_REGION = os.getenv("PINECONE_ENV", "us-east-1")
 #if not (PINECONE_API_KEY and PINECONE_ENV and PINECONE_INDEX):
 #    raise RuntimeError("Set PINECONE_API_KEY, PINECONE_ENV, PINECONE_INDEX")
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(PINECONE_INDEX_NAME)
+# same pooled handle as services.pinecone_client
+index = get_pinecone_index(PINECONE_INDEX_NAME)
 
 class PineconeAdapter:
     def __init__(self):
@@ -28,8 +29,8 @@ class PineconeAdapter:
         vectors: list of {id: str, values: List[float], metadata: dict}
         Uses Pinecone namespace = tenant_id
         """
-        # pinecone client is sync but fast; call directly
-        self.index.upsert(vectors=vectors, namespace=namespace)
+        # pinecone client is sync; keep it off the event loop
+        await asyncio.to_thread(self.index.upsert, vectors=vectors, namespace=namespace)
         return {"status": "ok"}
 
     async def query(self, namespace: str, vector: list[float], top_k: int = 5, filter: dict = None):
@@ -42,5 +43,8 @@ class PineconeAdapter:
         )
         if filter:
             q["filter"] = filter
-        res = self.index.query(**q)
+        res = await asyncio.to_thread(self.index.query, **q)
         return res
+
+
+adapter = PineconeAdapter()
@@ -1,15 +1,14 @@
-from pinecone import Pinecone
 import os
 from pinecone import ServerlessSpec
 from dotenv import find_dotenv, load_dotenv
+from services.http_transport import get_pinecone, get_pinecone_index
 
 load_dotenv(find_dotenv())
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+pc = get_pinecone()
 index_name=os.getenv("PINECONE_INDEX")
 index_dim=os.getenv("INDEX_DIM")
 
 INDEX_NAME = index_name
-index = pc.Index(INDEX_NAME)
 
 # Create index if not exists
 if index_name not in [i["name"] for i in pc.list_indexes()]:
@@ -22,4 +21,4 @@ if index_name not in [i["name"] for i in pc.list_indexes()]:
         )
     )
 
-index = pc.Index(index_name)
\ No newline at end of file
+index = get_pinecone_index(index_name)
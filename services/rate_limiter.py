@@ -0,0 +1,348 @@
+# back_end/services/rate_limiter.py
+"""
+Shared limiter for outbound OpenAI calls.
+
+Every embedding / completion call goes through `limiter.call(...)` so the
+process stays inside the account's requests-per-minute and tokens-per-minute
+budget. Interactive traffic (chat, agent answers) has its own lane and is
+always admitted ahead of batch traffic (ingestion). Concurrency is adjusted
+with AIMD: +1 slot per window of successful calls, halved on a 429 and
+shrunk when latency goes above target. Retry-After hints from the server
+pause the whole lane instead of each thread sleeping blindly.
+
+Set OPENAI_LIMITER_REDIS_URL to share the RPM/TPM budget between processes
+(API workers + Celery workers); otherwise the budget is per process.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Optional, Union
+
+try:
+    import tiktoken
+    TOKEN_ENCODER = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    TOKEN_ENCODER = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "3000"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "1000000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_MIN_CONCURRENCY = int(os.getenv("OPENAI_MIN_CONCURRENCY", "1"))
+OPENAI_LATENCY_TARGET_S = float(os.getenv("OPENAI_LATENCY_TARGET_S", "20"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_LIMITER_REDIS_URL = os.getenv("OPENAI_LIMITER_REDIS_URL")
+# Completions don't know their output size up front; reserve this much.
+DEFAULT_COMPLETION_TOKENS = int(os.getenv("OPENAI_DEFAULT_COMPLETION_TOKENS", "1024"))
+
+
+def count_tokens(value: Union[str, Iterable[Any], None]) -> int:
+    """Token count for a string, a list of strings or a list of chat messages."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        if TOKEN_ENCODER:
+            return len(TOKEN_ENCODER.encode(value, disallowed_special=()))
+        # ~4 chars per token is OpenAI's own rule of thumb
+        return max(1, len(value) // 4)
+    if isinstance(value, dict):
+        return count_tokens(value.get("content")) + 4
+    total = 0
+    for item in value:
+        if isinstance(item, (str, dict, list, tuple)):
+            total += count_tokens(item)
+    return total
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code
+
+
+def _is_rate_limited(exc: BaseException) -> bool:
+    return _status_code(exc) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if _is_rate_limited(exc):
+        return True
+    code = _status_code(exc)
+    if code is not None:
+        return code >= 500 or code == 408
+    # connection errors / timeouts have no status code
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, if it said so."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms is not None:
+            return float(ms) / 1000.0
+        s = headers.get("retry-after")
+        if s is not None:
+            return float(s)
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class _LocalBudget:
+    """Token buckets for RPM and TPM, refilled continuously."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self, tokens: int) -> float:
+        """Take 1 request + `tokens` from the budget. Returns 0 on success,
+        otherwise the number of seconds until the budget can cover it."""
+        with self._lock:
+            return self._take(tokens)
+
+    def _take(self, tokens: int) -> float:
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+        # a single request bigger than the whole minute budget would never fit
+        tokens = min(tokens, self.tpm)
+        if self._requests >= 1 and self._tokens >= tokens:
+            self._requests -= 1
+            self._tokens -= tokens
+            return 0.0
+        wait_req = max(0.0, (1 - self._requests) * 60.0 / self.rpm)
+        wait_tok = max(0.0, (tokens - self._tokens) * 60.0 / self.tpm)
+        return max(wait_req, wait_tok, 0.01)
+
+
+class _RedisBudget:
+    """Fixed one-minute windows shared by every process using the same Redis."""
+
+    def __init__(self, url: str, rpm: int, tpm: int, prefix: str = "openai_limiter"):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.prefix = prefix
+        self._r = redis.Redis.from_url(url)
+
+    def try_take(self, tokens: int) -> float:
+        now = time.time()
+        window = int(now // 60)
+        req_key = f"{self.prefix}:{window}:req"
+        tok_key = f"{self.prefix}:{window}:tok"
+        tokens = min(tokens, self.tpm)
+        try:
+            pipe = self._r.pipeline()
+            pipe.incrby(req_key, 1)
+            pipe.incrby(tok_key, tokens)
+            pipe.expire(req_key, 120)
+            pipe.expire(tok_key, 120)
+            used_req, used_tok, _, _ = pipe.execute()
+            if used_req <= self.rpm and used_tok <= self.tpm:
+                return 0.0
+            # over budget: give the reservation back and wait for the next window
+            pipe = self._r.pipeline()
+            pipe.decrby(req_key, 1)
+            pipe.decrby(tok_key, tokens)
+            pipe.execute()
+            return max(0.05, (window + 1) * 60 - now)
+        except Exception as e:
+            # never block OpenAI traffic because Redis is down
+            logger.warning("Redis limiter unavailable, admitting request: %s", e)
+            return 0.0
+
+
+class OpenAILimiter:
+    def __init__(
+        self,
+        rpm: int = OPENAI_RPM,
+        tpm: int = OPENAI_TPM,
+        max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+        min_concurrency: int = OPENAI_MIN_CONCURRENCY,
+        latency_target: float = OPENAI_LATENCY_TARGET_S,
+        max_retries: int = OPENAI_MAX_RETRIES,
+        redis_url: Optional[str] = OPENAI_LIMITER_REDIS_URL,
+    ):
+        if redis_url and redis is not None:
+            self._budget = _RedisBudget(redis_url, rpm, tpm)
+        else:
+            if redis_url:
+                logger.warning("OPENAI_LIMITER_REDIS_URL set but redis is not installed; using a local budget")
+            self._budget = _LocalBudget(rpm, tpm)
+
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.latency_target = latency_target
+        self.max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._waiting = {INTERACTIVE: 0, BATCH: 0}
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+
+        self.stats = {"calls": 0, "rate_limited": 0, "retries": 0, "waited_s": 0.0}
+
+    # ---- admission ----
+
+    def _acquire(self, priority: str, tokens: int):
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+        try:
+            while True:
+                with self._cond:
+                    while True:
+                        now = time.monotonic()
+                        if now < self._paused_until:
+                            self._cond.wait(self._paused_until - now)
+                            continue
+                        # batch only runs when no interactive caller is queued
+                        if priority == BATCH and self._waiting[INTERACTIVE] > 0:
+                            self._cond.wait(0.5)
+                            continue
+                        if self._in_flight >= int(self._limit):
+                            self._cond.wait(0.5)
+                            continue
+                        break
+                    # hold the slot while asking the budget, so a Redis round
+                    # trip doesn't keep every other caller out of the lock
+                    self._in_flight += 1
+                delay = self._budget.try_take(tokens)
+                if delay <= 0:
+                    return
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+                    self._cond.wait(delay)
+        finally:
+            with self._cond:
+                self._waiting[priority] -= 1
+                self.stats["waited_s"] += time.monotonic() - start
+
+    def _count(self, key: str):
+        with self._cond:
+            self.stats[key] += 1
+
+    def _release(self, latency: Optional[float], rate_limited: bool, retry_after: Optional[float]):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+                # multiplicative decrease, at most once per second so a burst of
+                # 429s from the same moment doesn't collapse the limit to 1
+                if now - self._last_decrease > 1.0:
+                    self._limit = max(self.min_concurrency, self._limit / 2)
+                    self._last_decrease = now
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+            elif latency is not None:
+                if latency > self.latency_target:
+                    # slow but still cooling down from the last decrease: hold
+                    if now - self._last_decrease > self.latency_target:
+                        self._limit = max(self.min_concurrency, self._limit * 0.75)
+                        self._last_decrease = now
+                else:
+                    # additive increase: about +1 per `limit` successful calls
+                    self._limit = min(self.max_concurrency, self._limit + 1.0 / max(self._limit, 1.0))
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str = INTERACTIVE, tokens: int = 0):
+        """Hold one concurrency slot for a call made outside `call()`."""
+        self._acquire(priority, tokens)
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            limited = _is_rate_limited(e)
+            self._release(None, limited, _retry_after(e) if limited else None)
+            raise
+        self._release(time.monotonic() - start, False, None)
+
+    # ---- calls ----
+
+    def call(self, fn: Callable, *args, priority: str = INTERACTIVE, tokens: int = 0, **kwargs):
+        """Run `fn(*args, **kwargs)` inside the budget, retrying 429/5xx."""
+        for attempt in range(self.max_retries + 1):
+            self._acquire(priority, tokens)
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                limited = _is_rate_limited(e)
+                hint = _retry_after(e)
+                self._release(None, limited, hint)
+                if not _is_retryable(e) or attempt == self.max_retries:
+                    raise
+                self._count("retries")
+                wait = hint if hint is not None else min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+                logger.warning(
+                    "OpenAI call failed (%s), retry %d/%d in %.1fs",
+                    type(e).__name__, attempt + 1, self.max_retries, wait,
+                )
+                if hint is None or not limited:
+                    # limited + hint already paused the lane for everyone
+                    time.sleep(wait)
+                continue
+            self._release(time.monotonic() - start, False, None)
+            self._count("calls")
+            return result
+
+    async def acall(self, fn: Callable, *args, priority: str = INTERACTIVE, tokens: int = 0, **kwargs):
+        """Async wrapper for sync OpenAI clients; waits off the event loop."""
+        return await asyncio.to_thread(self.call, fn, *args, priority=priority, tokens=tokens, **kwargs)
+
+    def embeddings(self, client, model: str, input, priority: str = INTERACTIVE):
+        return self.call(
+            client.embeddings.create,
+            model=model,
+            input=input,
+            priority=priority,
+            tokens=count_tokens(input),
+        )
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "waiting_interactive": self._waiting[INTERACTIVE],
+                "waiting_batch": self._waiting[BATCH],
+                "paused_for_s": max(0.0, self._paused_until - time.monotonic()),
+                **dict(self.stats),
+            }
+
+
+def completion_tokens(prompt, max_tokens: Optional[int] = None) -> int:
+    """Budget estimate for a completion: prompt tokens + reserved output."""
+    return count_tokens(prompt) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+limiter = OpenAILimiter()
@@ -1,6 +1,6 @@
 # back_end/services/supabase_client.py
 import os
-from supabase import create_client
+from services.http_transport import get_supabase
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,7 +11,7 @@ BUCKET = os.getenv("SUPABASE_BUCKET", "documents")
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise RuntimeError("Set Supabase env vars")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase = get_supabase(SUPABASE_KEY)
 
 def upload_file_to_supabase(path: str, content: bytes, content_type: str):
     bucket = supabase.storage.from_(BUCKET)
@@ -1,5 +1,5 @@
 import os
-from supabase import create_client, Client
+from services.http_transport import get_supabase
 from uuid import uuid4
 from dotenv import load_dotenv
 
@@ -9,7 +9,7 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+supabase = get_supabase(SUPABASE_SERVICE_KEY)
 
 async def upload_to_supabase(file, filename):
     bucket = "documents"
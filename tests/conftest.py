@@ -0,0 +1,6 @@
+# back_end/tests/conftest.py
+import os
+import sys
+
+# modules import each other as `services.x`, relative to back_end/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,115 @@
+# back_end/tests/test_admission.py
+import asyncio
+
+import pytest
+
+from services.admission import FairScheduler, IngestLeases, Overloaded
+
+
+def make_scheduler(**kw):
+    kw.setdefault("max_wait", 5)
+    return FairScheduler(**kw)
+
+
+def test_tenants_interleave_instead_of_queuing_behind_a_burst():
+    async def run():
+        sched = make_scheduler(max_concurrency=1, tenant_concurrency=1)
+        await sched.acquire("a")
+        order = []
+
+        async def one(tenant):
+            await sched.acquire(tenant)
+            order.append(tenant)
+            await asyncio.sleep(0)
+            sched.release(tenant)
+
+        burst = [asyncio.create_task(one("a")) for _ in range(3)]
+        await asyncio.sleep(0)
+        late = asyncio.create_task(one("b"))
+        await asyncio.sleep(0)
+        sched.release("a")
+        await asyncio.gather(*burst, late)
+        return order
+
+    order = asyncio.run(run())
+    assert order.index("b") <= 1
+
+
+def test_tenant_over_its_queue_gets_429_others_still_admitted():
+    async def run():
+        sched = make_scheduler(max_concurrency=4, tenant_concurrency=1, tenant_queue=1)
+        await sched.acquire("a")
+        waiting = asyncio.create_task(sched.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as exc:
+            await sched.acquire("a")
+        await sched.acquire("b")
+        sched.release("a")
+        await waiting
+        return exc.value, sched.snapshot()
+
+    err, snap = asyncio.run(run())
+    assert err.status == 429
+    assert err.reason == "tenant_queue_full"
+    assert err.retry_after >= 1
+    assert err.as_dict()["detail"].startswith("Too many requests")
+    assert snap["rejected_tenant"] == 1
+
+
+def test_full_server_sheds_with_503():
+    async def run():
+        sched = make_scheduler(max_concurrency=1, max_queue=1)
+        await sched.acquire("a")
+        waiting = asyncio.create_task(sched.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as exc:
+            await sched.acquire("c")
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        return exc.value, sched
+
+    err, sched = asyncio.run(run())
+    assert err.status == 503
+    assert err.reason == "server_queue_full"
+    assert err.as_dict()["detail"].startswith("Server busy")
+    # the rejected and the cancelled tenants leave no queues behind
+    assert set(sched._queues) == set()
+
+
+def test_queue_timeout_is_503():
+    async def run():
+        sched = make_scheduler(max_concurrency=1, max_wait=0.05)
+        await sched.acquire("a")
+        with pytest.raises(Overloaded) as exc:
+            await sched.acquire("b")
+        return exc.value, sched
+
+    err, sched = asyncio.run(run())
+    assert err.status == 503
+    assert err.reason == "queue_timeout"
+    assert sched.snapshot()["queued"] == 0
+    assert "b" not in sched._queues
+
+
+def test_placeholder_tenant_is_not_capped_per_tenant():
+    async def run():
+        sched = make_scheduler(max_concurrency=8, tenant_concurrency=2, tenant_queue=0)
+        for _ in range(8):
+            await sched.acquire("test-tenant", tenant_limits=False)
+        return sched.snapshot()
+
+    snap = asyncio.run(run())
+    assert snap["running"] == 8
+    assert snap["rejected_tenant"] == 0
+
+
+def test_ingest_leases_split_slots_between_active_tenants():
+    leases = IngestLeases(slots=4, redis_url=None)
+    assert all(leases.acquire("a", f"a{i}") for i in range(4))
+    assert not leases.acquire("a", "a4")
+    # b becomes active: it gets its share while a is over its own
+    assert leases.acquire("b", "b0")
+    assert leases.acquire("b", "b1")
+    assert not leases.acquire("a", "a5")
+    leases.release("a", "a0")
+    assert not leases.acquire("a", "a6")
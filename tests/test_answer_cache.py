@@ -0,0 +1,81 @@
+# back_end/tests/test_answer_cache.py
+import time
+
+from services.answer_cache import AnswerCache, MemoryBackend
+
+VEC = [0.1, 0.2, 0.3]
+MATCHES = [{"id": "c1", "score": 0.9, "metadata": {"file_id": "f1"}}]
+
+
+def make_cache(ttl=60, grace=0):
+    return AnswerCache(MemoryBackend(max_entries=100, ttl=ttl), bump_grace_s=grace)
+
+
+def test_bump_invalidates_namespace_only():
+    cache = make_cache()
+    for ns in ("alice", "bob"):
+        v = cache.version(ns)
+        cache.put_retrieval(ns, v, VEC, 5, None, MATCHES)
+        cache.put_answer(ns, v, "What is X?", "p1", "X is y.")
+
+    cache.bump("alice")
+    v = cache.version("alice")
+    assert cache.get_retrieval("alice", v, VEC, 5, None) is None
+    assert cache.get_answer("alice", v, "what is  x?", "p1") is None
+
+    v = cache.version("bob")
+    assert cache.get_retrieval("bob", v, VEC, 5, None) == MATCHES
+    assert cache.get_answer("bob", v, "what is  x?", "p1") == "X is y."
+
+
+def test_key_includes_filter_and_prompt_version():
+    cache = make_cache()
+    cache.put_retrieval("ns", 0, VEC, 5, {"file_id": "a"}, MATCHES)
+    cache.put_answer("ns", 0, "q", "p1", "answer")
+    assert cache.get_retrieval("ns", 0, VEC, 5, {"file_id": "b"}) is None
+    assert cache.get_retrieval("ns", 0, VEC, 10, {"file_id": "a"}) is None
+    assert cache.get_answer("ns", 0, "q", "p2") is None
+
+
+def test_memory_entries_expire(monkeypatch):
+    cache = make_cache(ttl=60)
+    cache.put_answer("ns", 0, "q", "p1", "answer")
+    assert cache.get_answer("ns", 0, "q", "p1") == "answer"
+
+    # another process may have bumped; the TTL bounds how long this copy is served
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get_answer("ns", 0, "q", "p1") is None
+
+
+def test_no_puts_during_bump_grace(monkeypatch):
+    cache = make_cache(grace=10)
+    cache.bump("ns")
+    v = cache.version("ns")
+    cache.put_retrieval("ns", v, VEC, 5, None, MATCHES)
+    cache.put_answer("ns", v, "q", "p1", "stale")
+    assert cache.get_retrieval("ns", v, VEC, 5, None) is None
+    assert cache.get_answer("ns", v, "q", "p1") is None
+    assert cache.snapshot()["settling_skips"] == 2
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    cache.put_answer("ns", v, "q", "p1", "fresh")
+    assert cache.get_answer("ns", v, "q", "p1") == "fresh"
+
+
+def test_backend_errors_count_as_misses():
+    class Broken(MemoryBackend):
+        def get(self, key):
+            raise ConnectionError("down")
+
+        def version(self, namespace):
+            raise ConnectionError("down")
+
+    cache = AnswerCache(Broken(), bump_grace_s=0)
+    v = cache.version("ns")
+    assert v == -1
+    cache.put_answer("ns", v, "q", "p1", "answer")
+    assert cache.get_answer("ns", v, "q", "p1") is None
+    assert cache.get_answer("ns", 0, "q", "p1") is None
+    assert cache.snapshot()["errors"] == 2
@@ -0,0 +1,98 @@
+# back_end/tests/test_dedup.py
+import random
+
+import pytest
+
+from services import dedup
+from services.dedup import (
+    SCOPE_DOCUMENT, SCOPE_NAMESPACE, Deduper, SignatureStore, minhash, similarity,
+)
+
+_rng = random.Random(3)
+VOCAB = [f"w{i}" for i in range(2000)]
+
+
+def text(n=120):
+    return " ".join(_rng.choice(VOCAB) for _ in range(n))
+
+
+def chunks(texts):
+    return [(t, {"page": i}) for i, t in enumerate(texts)]
+
+
+def page_id(c):
+    return f"c{c[1]['page']}"
+
+
+def test_similarity_tracks_overlap():
+    a = text()
+    near = a + " one more"
+    assert similarity(minhash(a), minhash(a)) == 1.0
+    assert similarity(minhash(a), minhash(near)) >= 0.9
+    assert similarity(minhash(a), minhash(text())) < 0.3
+
+
+def test_minhash_ignores_case_and_spacing():
+    a = text()
+    assert minhash(a) == minhash("  " + a.upper().replace(" ", "\n"))
+
+
+@pytest.mark.skipif(dedup.np is None, reason="numpy not installed")
+def test_numpy_and_python_minhash_agree(monkeypatch):
+    a = text()
+    fast = minhash(a)
+    monkeypatch.setattr(dedup, "np", None)
+    assert minhash(a) == fast
+
+
+def test_skip_mode_drops_later_copies():
+    footer = text()
+    batch = chunks([text(), footer, text(), footer + " page 2"])
+    d = Deduper("ns", mode="skip", cross_namespace=False)
+    new, reused = d.split(batch, page_id)
+    assert [cid for _, cid in new] == ["c0", "c1", "c2"]
+    assert reused == []
+    report = d.report()
+    assert report["skipped"] == 1
+    assert report["dedup_ratio"] == 0.25
+
+
+def test_reuse_mode_points_copies_at_the_first():
+    footer = text()
+    batch = chunks([footer, text(), footer])
+    d = Deduper("ns", mode="reuse", cross_namespace=False)
+    new, reused = d.split(batch, page_id)
+    assert [cid for _, cid in new] == ["c0", "c1"]
+    assert [(cid, canonical, scope) for _, cid, canonical, scope in reused] == [("c2", "c0", SCOPE_DOCUMENT)]
+
+
+def test_off_mode_keeps_everything():
+    same = text()
+    batch = chunks([same, same])
+    d = Deduper("ns", mode="off", cross_namespace=False)
+    new, reused = d.split(batch, page_id)
+    assert len(new) == 2 and reused == []
+
+
+def test_cross_namespace_reuses_stored_chunks_only_in_that_namespace(tmp_path):
+    store = SignatureStore(str(tmp_path / "sigs.sqlite3"))
+    shared = text()
+
+    first = Deduper("ns", cross_namespace=True, store=store)
+    new, _ = first.split(chunks([shared]), lambda c: "doc1-0")
+    first.remember([cid for _, cid in new])
+
+    again = Deduper("ns", cross_namespace=True, store=store)
+    new, reused = again.split(chunks([shared]), lambda c: "doc2-0")
+    assert new == []
+    assert [(cid, canonical, scope) for _, cid, canonical, scope in reused] == [("doc2-0", "doc1-0", SCOPE_NAMESPACE)]
+
+    other = Deduper("other", cross_namespace=True, store=store)
+    new, reused = other.split(chunks([shared]), lambda c: "doc3-0")
+    assert len(new) == 1 and reused == []
+
+    # deleted chunks can no longer be reused
+    store.delete_many("ns", ["doc1-0"])
+    later = Deduper("ns", cross_namespace=True, store=store)
+    new, reused = later.split(chunks([shared]), lambda c: "doc4-0")
+    assert len(new) == 1 and reused == []
@@ -0,0 +1,196 @@
+# back_end/tests/test_doc_routing.py
+import asyncio
+import importlib
+import math
+import sys
+import types
+
+import pytest
+
+
+class FakeIndex:
+    """Exact dot-product search over in-memory namespaces, Pinecone-shaped."""
+
+    def __init__(self):
+        self.namespaces = {}
+        self.queries = []
+        self.fail_namespaces = set()
+
+    def upsert(self, vectors, namespace):
+        ns = self.namespaces.setdefault(namespace, {})
+        for v in vectors:
+            ns[v["id"]] = (v["values"], v.get("metadata") or {})
+
+    def delete(self, ids, namespace):
+        for i in ids:
+            self.namespaces.get(namespace, {}).pop(i, None)
+
+    def query(self, vector, top_k, include_metadata=True, namespace="", filter=None):
+        self.queries.append((namespace, filter))
+        if namespace in self.fail_namespaces:
+            raise ConnectionError("index unavailable")
+        allowed = set(filter["file_id"]["$in"]) if filter else None
+        rows = [
+            {"id": i, "score": sum(a * b for a, b in zip(vector, values)), "metadata": meta}
+            for i, (values, meta) in self.namespaces.get(namespace, {}).items()
+            if allowed is None or meta.get("file_id") in allowed
+        ]
+        rows.sort(key=lambda r: -r["score"])
+        return {"matches": rows[:top_k]}
+
+
+class FakeAdapter:
+    def __init__(self, index):
+        self.index = index
+
+    async def query(self, namespace, vector, top_k=5, filter=None):
+        return self.index.query(vector=vector, top_k=top_k, namespace=namespace, filter=filter)
+
+
+class FakeRegistry:
+    def __init__(self, docs, chunks):
+        self.docs = docs
+        self.chunks = chunks
+
+    def list(self, namespace):
+        return self.docs
+
+    def chunk_ids(self, namespace, file_id):
+        return self.chunks[file_id]
+
+
+def install_fakes(monkeypatch, fakes):
+    for name, attrs in fakes.items():
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        monkeypatch.setitem(sys.modules, name, mod)
+
+
+@pytest.fixture
+def routing(monkeypatch):
+    """services.doc_routing on a fake index (the real clients connect at import)."""
+    index = FakeIndex()
+    install_fakes(monkeypatch, {
+        "services.pinecone_client": {"index": index},
+        "services.pinecone_adapter": {"adapter": FakeAdapter(index)},
+    })
+    monkeypatch.delitem(sys.modules, "services.doc_routing", raising=False)
+    module = importlib.import_module("services.doc_routing")
+    yield module, index
+    sys.modules.pop("services.doc_routing", None)
+
+
+def unit(i, dims=8):
+    v = [0.0] * dims
+    v[i % dims] = 1.0
+    return v
+
+
+def add_docs(index, namespace, doc_namespace, n_docs, chunks_per_doc=3):
+    """Document d's chunks point along axis d, and so does its summary vector."""
+    for d in range(n_docs):
+        file_id = f"f{d}"
+        index.upsert([{"id": f"{file_id}:{c}", "values": unit(d), "metadata": {"file_id": file_id}}
+                      for c in range(chunks_per_doc)], namespace)
+        index.upsert([{"id": file_id, "values": unit(d), "metadata": {"file_id": file_id}}], doc_namespace)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_routes_to_closest_documents(routing):
+    dr, index = routing
+    add_docs(index, "alice", dr.doc_namespace("alice"), n_docs=6)
+    matches, how = run(dr.search("alice", unit(2), top_k=3, routing=True, top_docs=2))
+    assert how["mode"] == "routed"
+    assert how["file_ids"][0] == "f2"
+    assert {m["metadata"]["file_id"] for m in matches} == {"f2"}
+    assert index.queries[0] == (dr.doc_namespace("alice"), None)
+    assert index.queries[1] == ("alice", dr.file_filter(how["file_ids"]))
+
+
+def test_small_namespace_searches_flat(routing):
+    dr, index = routing
+    add_docs(index, "alice", dr.doc_namespace("alice"), n_docs=2)
+    _, how = run(dr.search("alice", unit(0), top_k=3, routing=True, top_docs=2))
+    assert how["mode"] == "flat"
+    assert index.queries[-1] == ("alice", None)
+
+
+def test_short_routed_result_falls_back_to_flat(routing):
+    dr, index = routing
+    add_docs(index, "alice", dr.doc_namespace("alice"), n_docs=6, chunks_per_doc=1)
+    matches, how = run(dr.search("alice", unit(0), top_k=4, routing=True, top_docs=2))
+    assert how["mode"] == "flat"
+    assert len(matches) == 4
+
+
+def test_routing_failure_falls_back_to_flat(routing):
+    dr, index = routing
+    add_docs(index, "alice", dr.doc_namespace("alice"), n_docs=6)
+    index.fail_namespaces.add(dr.doc_namespace("alice"))
+    matches, how = run(dr.search("alice", unit(0), top_k=3, routing=True, top_docs=2))
+    assert how["mode"] == "flat"
+    assert len(matches) == 3
+
+
+def test_pinned_and_unrouted_searches_skip_the_doc_namespace(routing):
+    dr, index = routing
+    add_docs(index, "alice", dr.doc_namespace("alice"), n_docs=6)
+    matches, how = run(dr.search("alice", unit(0), top_k=3, file_ids=["f4"], routing=True))
+    assert how == {"mode": "pinned", "file_ids": ["f4"]}
+    assert {m["metadata"]["file_id"] for m in matches} == {"f4"}
+    _, how = run(dr.search("alice", unit(0), top_k=3, routing=False))
+    assert how["mode"] == "flat"
+    assert all(ns == "alice" for ns, _ in index.queries)
+
+
+def test_doc_namespace_cannot_be_a_user_namespace(routing):
+    dr, _ = routing
+    # request_user rejects user ids containing the separator
+    assert dr.NAMESPACE_SEP in dr.doc_namespace("alice")
+
+
+def test_cache_filter_ignores_file_id_order(routing):
+    dr, _ = routing
+    assert dr.cache_filter(["b", "a", "b"]) == dr.cache_filter(["a", "b"])
+    assert dr.cache_filter() != dr.cache_filter(["a"])
+
+
+def test_centroid_is_normalized_mean(routing):
+    dr, _ = routing
+    c = dr.Centroid()
+    c.add([[3.0, 0.0], [0.0, 4.0]])
+    c.add(iter([[3.0, 0.0]]))
+    vec = c.vector()
+    assert c.count == 3
+    assert vec == pytest.approx([6 / math.hypot(6, 4), 4 / math.hypot(6, 4)])
+    assert dr.Centroid().vector() is None
+
+
+def test_empty_document_drops_its_old_summary(routing):
+    dr, index = routing
+    add_docs(index, "alice", dr.doc_namespace("alice"), n_docs=1)
+    dr.upsert_centroid("alice", "f0", dr.Centroid(), "empty.pdf")
+    assert "f0" not in index.namespaces[dr.doc_namespace("alice")]
+
+
+def test_backfill_namespace_rebuilds_ready_documents(routing, monkeypatch):
+    dr, index = routing
+    vectors = {"f0:0": [1.0, 0.0], "f0:1": [1.0, 0.0], "f1:0": [0.0, 1.0]}
+    registry = FakeRegistry(
+        docs=[{"file_id": "f0", "file_name": "a.pdf", "status": "ready"},
+              {"file_id": "f1", "file_name": "b.pdf", "status": "failed"}],
+        chunks={"f0": ["f0:0", "f0:1"], "f1": ["f1:0"]},
+    )
+    install_fakes(monkeypatch, {
+        "services.document_registry": {"registry": registry, "STATUS_READY": "ready"},
+        "services.ingest_pipeline": {"fetch_vectors": lambda ns, ids: {i: vectors[i] for i in ids}},
+    })
+
+    assert dr.backfill_namespace("alice") == 1
+    stored = index.namespaces[dr.doc_namespace("alice")]
+    assert set(stored) == {"f0"}
+    assert stored["f0"][0] == pytest.approx([1.0, 0.0])
+    assert stored["f0"][1]["chunks"] == 2
@@ -0,0 +1,81 @@
+# back_end/tests/test_extraction_pool.py
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# the module-level cache is opened at import; keep it out of data/
+os.environ.setdefault("EXTRACT_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "extraction_cache.sqlite3"))
+
+from services import extraction_pool as ep  # noqa: E402
+from services.extraction_pool import ExtractionFailed, ExtractionPool  # noqa: E402
+
+
+class MemoryCache:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def put(self, key, sections):
+        self.data[key] = sections
+
+    def snapshot(self):
+        return {"entries": len(self.data)}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    c = MemoryCache()
+    monkeypatch.setattr(ep, "extraction_cache", c)
+    return c
+
+
+def stalled_pool(**kw):
+    """A pool whose workers never pick anything up, as when all are busy."""
+    pool = ExtractionPool(size=1, **kw)
+    pool._start = lambda: None
+    return pool
+
+
+def test_async_extract_gives_up_on_queue_wait(cache):
+    pool = stalled_pool(max_queue_wait=0.05)
+
+    async def run():
+        with pytest.raises(ExtractionFailed) as exc:
+            await pool.aextract_sections("a.txt", b"hello")
+        return exc.value
+
+    err = asyncio.run(run())
+    assert err.reason == "overloaded"
+    assert pool.stats()["overloaded"] == 1
+    # the job is cancelled, so a worker that frees up later skips it
+    *_, fut, _ = pool._jobs.get_nowait()
+    assert fut.cancelled()
+
+
+def test_sync_extract_gives_up_on_queue_wait(cache):
+    pool = stalled_pool(max_queue_wait=0.05)
+    with pytest.raises(ExtractionFailed) as exc:
+        pool.extract_sections("a.txt", b"hello")
+    assert exc.value.reason == "overloaded"
+
+
+def test_full_queue_is_overloaded(cache):
+    pool = stalled_pool(max_queue=1)
+    pool.submit("a.txt", b"a")
+    with pytest.raises(ExtractionFailed) as exc:
+        pool.submit("b.txt", b"b")
+    assert exc.value.reason == "overloaded"
+
+
+def test_async_extract_in_process_and_cached(cache):
+    pool = ExtractionPool(size=0)
+    sections = asyncio.run(pool.aextract_sections("a.txt", b"hello world"))
+    assert [s.text for s in sections] == ["hello world"]
+    assert len(cache.data) == 1
+    # served from the cache: the pool is not asked again
+    pool.submit = None
+    assert asyncio.run(pool.aextract_sections("a.txt", b"hello world")) == sections
@@ -0,0 +1,78 @@
+# back_end/tests/test_file_processing.py
+import io
+import os
+import zipfile
+
+import pytest
+
+from services.file_processing import (
+    UnsupportedFormat, decode_text, detect_format, extract_sections_from_file_bytes,
+)
+
+
+def _zip(*names):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        for name in names:
+            z.writestr(name, "<xml/>")
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("filename, content, kind", [
+    ("a.pdf", b"%PDF-1.7\n...", "pdf"),
+    ("a.docx", _zip("[Content_Types].xml", "word/document.xml"), "docx"),
+    ("a.pptx", _zip("ppt/presentation.xml"), "pptx"),
+    ("a.zip", _zip("notes.txt"), "zip"),
+    ("a.doc", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + b"\x00" * 64, "ole"),
+    ("a.txt", "plain UTF-8 text, café".encode("utf-8"), "text"),
+    ("a.csv", b"name,city\nana,lisbon\n", "csv"),
+])
+def test_detects_by_signature(filename, content, kind):
+    assert detect_format(filename, content) == kind
+
+
+def test_extension_does_not_override_signature():
+    assert detect_format("report.txt", b"%PDF-1.4\n") == "pdf"
+
+
+def test_cp1252_text_is_not_binary():
+    content = "Résumé – naïve café, “quoted”\n".encode("cp1252") * 50
+    assert detect_format("notes.txt", content) == "text"
+    assert detect_format("table.csv", b"name,city\n" + "José,Málaga\n".encode("cp1252")) == "csv"
+
+
+def test_utf16_with_bom_is_text():
+    content = "hello wörld\n".encode("utf-16")
+    assert content.startswith((b"\xff\xfe", b"\xfe\xff"))
+    assert detect_format("a.txt", content) == "text"
+    [section] = extract_sections_from_file_bytes("a.txt", content)
+    assert "hello wörld" in section.text
+
+
+def test_utf8_bom_is_stripped():
+    assert decode_text(b"\xef\xbb\xbfhello") == "hello"
+
+
+def test_cp1252_is_decoded_not_dropped():
+    [section] = extract_sections_from_file_bytes("a.txt", "café – ok".encode("cp1252"))
+    assert section.text == "café – ok"
+
+
+def test_multibyte_char_cut_at_sample_boundary_is_text():
+    content = b"a" * 4095 + "é".encode("utf-8") + b" more text"
+    assert detect_format("a.txt", content) == "text"
+
+
+@pytest.mark.parametrize("content", [
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR",
+    b"\x1f\x8b\x08\x00" + os.urandom(200),
+    bytes(range(1, 9)) * 100,  # control bytes, no NULs
+])
+def test_binary_is_rejected(content):
+    assert detect_format("a.txt", content) == "binary"
+    with pytest.raises(UnsupportedFormat):
+        extract_sections_from_file_bytes("a.txt", content)
+
+
+def test_empty_file_has_no_sections():
+    assert extract_sections_from_file_bytes("a.txt", b"") == []
@@ -0,0 +1,140 @@
+# back_end/tests/test_rate_limiter.py
+import threading
+import time
+
+import pytest
+
+from services.rate_limiter import BATCH, INTERACTIVE, OpenAILimiter, _LocalBudget
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def make_limiter(**kw):
+    kw.setdefault("redis_url", None)
+    return OpenAILimiter(**kw)
+
+
+def test_local_budget_refuses_past_rpm():
+    budget = _LocalBudget(rpm=2, tpm=1000)
+    assert budget.try_take(10) == 0
+    assert budget.try_take(10) == 0
+    assert budget.try_take(10) > 0
+
+
+def test_retries_rate_limited_calls(monkeypatch):
+    lim = make_limiter(max_retries=3)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RateLimited()
+        return "ok"
+
+    # no Retry-After hint, so retries back off with jittered sleeps
+    monkeypatch.setattr(time, "sleep", lambda s: None)
+    assert lim.call(fn) == "ok"
+    snap = lim.snapshot()
+    assert snap["calls"] == 1
+    assert snap["retries"] == 2
+    assert snap["rate_limited"] == 2
+    assert snap["in_flight"] == 0
+
+
+def test_client_errors_are_not_retried():
+    lim = make_limiter()
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        raise BadRequest()
+
+    with pytest.raises(BadRequest):
+        lim.call(fn)
+    assert len(attempts) == 1
+    assert lim.snapshot()["in_flight"] == 0
+
+
+def test_interactive_admitted_before_batch():
+    lim = make_limiter(max_concurrency=1, min_concurrency=1)
+    order = []
+    release = threading.Event()
+
+    def hold():
+        with lim.slot(INTERACTIVE):
+            release.wait(5)
+
+    def run(priority):
+        lim.call(lambda: order.append(priority), priority=priority)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    while lim.snapshot()["in_flight"] == 0:
+        time.sleep(0.001)
+    batch = threading.Thread(target=run, args=(BATCH,))
+    batch.start()
+    while lim.snapshot()["waiting_batch"] == 0:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=run, args=(INTERACTIVE,))
+    interactive.start()
+    while lim.snapshot()["waiting_interactive"] == 0:
+        time.sleep(0.001)
+    release.set()
+    for t in (holder, batch, interactive):
+        t.join(5)
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_budget_io_runs_outside_the_lock():
+    lim = make_limiter()
+    entered, unblock = threading.Event(), threading.Event()
+
+    class SlowBudget:
+        def try_take(self, tokens):
+            entered.set()
+            unblock.wait(5)
+            return 0.0
+
+    lim._budget = SlowBudget()
+    t = threading.Thread(target=lim.call, args=(lambda: None,))
+    t.start()
+    assert entered.wait(5)
+    # the slow budget call must not hold the condition lock
+    assert lim._cond.acquire(timeout=1)
+    lim._cond.release()
+    unblock.set()
+    t.join(5)
+    assert lim.snapshot()["calls"] == 1
+
+
+def test_stats_are_exact_under_concurrency():
+    lim = make_limiter(max_concurrency=8)
+    threads = [threading.Thread(target=lambda: [lim.call(lambda: None) for _ in range(50)]) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    snap = lim.snapshot()
+    assert snap["calls"] == 400
+    assert snap["in_flight"] == 0
+
+
+def test_slow_calls_never_raise_the_limit():
+    lim = make_limiter(max_concurrency=16, latency_target=1.0)
+    lim._acquire(INTERACTIVE, 0)
+    lim._release(5.0, False, None)
+    after_decrease = lim._limit
+    assert after_decrease < 16
+    # still cooling down: a second slow call must hold the limit, not raise it
+    lim._acquire(INTERACTIVE, 0)
+    lim._release(5.0, False, None)
+    assert lim._limit == after_decrease
+    lim._acquire(INTERACTIVE, 0)
+    lim._release(0.1, False, None)
+    assert lim._limit > after_decrease
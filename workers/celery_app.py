@@ -1,12 +1,19 @@
 # back_end/workers/celery_app.py
-import os, uuid, logging
-from celery import Celery
+import os, uuid, logging, hashlib
+from celery import Celery, signals
 from datetime import datetime
-from services.file_processing import extract_text_from_file_bytes
-from services.chunker import chunk_text_by_tokens
-from services.embeddings import embed_texts
+from services.extraction_pool import extraction_pool, ExtractionFailed
+from services.chunker import iter_chunks_from_sections
+from services.ingest_pipeline import vectors_for, discard_partial
+from services.dedup import Deduper
+from services.doc_routing import Centroid, upsert_centroid
 from services.pinecone_client import index
-from services.supabase_client import supabase
+from services.supabase_client import supabase, BUCKET
+from services.chunk_store import chunk_store
+from services.document_registry import registry, STATUS_READY, STATUS_FAILED
+from services.answer_cache import answer_cache
+from services.admission import ingest_leases
+from services.log_pipeline import setup_logging, shutdown_logging, log_event
 
 CELERY_BROKER = os.getenv("CELERY_BROKER_URL")
 CELERY_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
@@ -15,55 +22,114 @@ celery = Celery("ingest", broker=CELERY_BROKER, backend=CELERY_BACKEND)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+
+# Connecting this signal stops Celery from installing its own handlers;
+# workers log through the same JSON queue pipeline as the API.
+@signals.setup_logging.connect
+def _setup_logging(**kwargs):
+    setup_logging()
+
+
+# Prefork children get their own listener at fork (services/log_pipeline.py)
+# but leave through os._exit, which skips atexit: flush them explicitly.
+@signals.worker_process_shutdown.connect
+def _flush_logging(**kwargs):
+    shutdown_logging()
+
 @celery.task(bind=True, max_retries=3, acks_late=True)
-def ingest_file_task(self, file_path: str, filename: str, file_bytes: bytes = None, user_id: str = None, file_id: str = None):
+def ingest_file_task(self, file_path: str, filename: str, file_bytes: bytes = None, user_id: str = None, file_id: str = None, content_hash: str = None, tenant_id: str = None):
     """
     file_path: path in Supabase bucket (if file_bytes is None)
+    content_hash: sha256 of the file, if the caller knows it; lets a file that
+    was already extracted skip both the download and the parse
+    tenant_id: whose fair share of ingest slots this runs under (defaults to user_id)
     """
+    tenant = tenant_id or user_id or ""
+    # stable across retries (they keep the task id); callers should pass one,
+    # see enqueue_ingest
+    file_id = file_id or self.request.id or str(uuid.uuid4())
+    namespace = user_id or ""
     try:
-        file_id = file_id or str(uuid.uuid4())
-
-        # Fetch bytes if not provided
-        content_bytes = file_bytes
-        if content_bytes is None:
-            # supabase returns http response object; use storage.download
-            bucket = supabase.storage.from_(os.getenv("SUPABASE_BUCKET"))
-            dl = bucket.download(file_path)
-            if hasattr(dl, "read"):
-                content_bytes = dl.read()
-            else:
-                content_bytes = dl
-
-        if not content_bytes:
-            raise ValueError("No content to ingest")
-
-        # Extract text
-        text = extract_text_from_file_bytes(filename, content_bytes)
-        if not text or not text.strip():
+        # over its share of worker slots: requeue so other tenants go first
+        if not ingest_leases.acquire(tenant, self.request.id):
+            ingest_file_task.apply_async(
+                args=self.request.args, kwargs=_with_file_id(self.request.args, self.request.kwargs, file_id),
+                countdown=ingest_leases.defer_countdown(),
+            )
+            return {"status": "deferred"}
+
+
+        # A retry of this task already registered the file's hash
+        if content_hash is None and file_bytes is None:
+            doc = registry.get(namespace, file_id)
+            content_hash = doc.get("content_hash") if doc else None
+
+        sections = None
+        if content_hash and file_bytes is None:
+            sections = extraction_pool.cached_sections(filename, content_hash)
+
+        if sections is None:
+            # Fetch bytes if not provided
+            content_bytes = file_bytes
+            if content_bytes is None:
+                # supabase returns http response object; use storage.download
+                bucket = supabase.storage.from_(BUCKET)
+                dl = bucket.download(file_path)
+                if hasattr(dl, "read"):
+                    content_bytes = dl.read()
+                else:
+                    content_bytes = dl
+
+            if not content_bytes:
+                raise ValueError("No content to ingest")
+            content_hash = hashlib.sha256(content_bytes).hexdigest()
+
+        registry.begin(namespace, file_id, filename, storage_path=file_path, content_hash=content_hash)
+
+        # Extract text (cached by content hash; otherwise an isolated worker
+        # process with time / memory limits)
+        if sections is None:
+            try:
+                sections = extraction_pool.extract_sections(filename, content_bytes, content_hash)
+            except ExtractionFailed as e:
+                if e.reason == "overloaded":
+                    raise
+                # the same bytes will fail the same way again; don't retry
+                logger.warning("Extraction failed for %s: %s", filename, e)
+                registry.finish(namespace, file_id, STATUS_FAILED)
+                return {"status": "extract_failed", "reason": e.reason}
+        if not any(s.text.strip() for s in sections):
             logger.warning("No text extracted for %s", filename)
+            registry.finish(namespace, file_id, STATUS_READY)
             return {"status": "no_text"}
 
         # Chunk
-        chunks_meta = chunk_text_by_tokens(text)
-        texts = [c[0] for c in chunks_meta]
-        if not texts:
+        chunks_meta = list(iter_chunks_from_sections(sections))
+        if not chunks_meta:
+            registry.finish(namespace, file_id, STATUS_READY)
             return {"status": "no_chunks"}
 
-        # Batch embed
-        vectors = embed_texts(texts)
+        # Drop / reuse near-duplicates, then batch embed what's left
+        deduper = Deduper(namespace)
+        new, reused = deduper.split(chunks_meta, lambda c: f"{file_id}:{c[1]}-{c[2]}")
+        rows = vectors_for(namespace, new, reused, deduper, {})
 
         # Build upserts in batches for Pinecone
         upserts = []
-        for (chunk_text, start, end), vec in zip(chunks_meta, vectors):
-            chunk_id = f"{file_id}:{start}-{end}"
+        texts_by_id = {}
+        for (chunk_text, start, end, locator), chunk_id, vec in rows:
+            # full text lives in the chunk store; metadata stays small
+            texts_by_id[chunk_id] = chunk_text
             meta = {
                 "filename": filename,
                 "file_id": file_id,
-                "text": chunk_text[:2000],  # store snippet (limit metadata size)
+                "locator": locator,
                 "created_at": datetime.utcnow().isoformat(),
                 "user_id": user_id
             }
             upserts.append((chunk_id, vec, meta))
+        chunk_store.put_many(namespace, texts_by_id)
+        registry.add_chunks(namespace, file_id, texts_by_id.keys())
 
         # Upsert into pinecone in batches
         batch_size = 100
@@ -72,11 +138,53 @@ def ingest_file_task(self, file_path: str, filename: str, file_bytes: bytes = No
             ids = [u[0] for u in batch]
             vecs = [u[1] for u in batch]
             metas = [u[2] for u in batch]
-            index.upsert(vectors=list(zip(ids, vecs, metas)))
+            index.upsert(vectors=list(zip(ids, vecs, metas)), namespace=namespace)
+
+        deduper.remember(texts_by_id.keys())
+        # summary vector for query routing
+        centroid = Centroid()
+        centroid.add(vec for _, _, vec in rows)
+        upsert_centroid(namespace, file_id, centroid, filename)
 
+        registry.finish(namespace, file_id, STATUS_READY)
+        answer_cache.bump(namespace)
+        report = deduper.report()
+        log_event(logger, "ingest_dedup", file_id=file_id, **report)
         logger.info("Ingested %d chunks for %s", len(upserts), filename)
-        return {"status": "ok", "inserted": len(upserts)}
+        return {"status": "ok", "inserted": len(upserts), "dedup": report}
 
     except Exception as exc:
         logger.exception("Ingestion failed: %s", exc)
+        if self.request.retries >= self.max_retries:
+            # out of retries: drop what this attempt wrote and say so
+            try:
+                discard_partial(namespace, file_id)
+                registry.finish(namespace, file_id, STATUS_FAILED)
+                answer_cache.bump(namespace)
+            except Exception as e:
+                logger.warning("Could not mark %s failed: %s", file_id, e)
+            raise
         raise self.retry(exc=exc, countdown=min(60 * (2 ** self.request.retries), 300))
+    finally:
+        ingest_leases.release(tenant, self.request.id)
+
+
+def _with_file_id(args, kwargs, file_id: str) -> dict:
+    """Task kwargs with `file_id` filled in, unless it was passed positionally."""
+    kwargs = dict(kwargs or {})
+    if len(args or ()) <= 4:
+        kwargs["file_id"] = file_id
+    return kwargs
+
+
+def enqueue_ingest(file_path: str, filename: str, user_id: str, tenant_id: str = None, content_hash: str = None,
+                   file_id: str = None) -> str:
+    """Queue an ingest of a file already in storage. The file_id is chosen
+    here, so the caller can return it right away and every retry or deferral
+    works on the same registry row."""
+    file_id = file_id or str(uuid.uuid4())
+    ingest_file_task.apply_async(kwargs={
+        "file_path": file_path, "filename": filename, "user_id": user_id, "file_id": file_id,
+        "content_hash": content_hash, "tenant_id": tenant_id,
+    })
+    return file_id